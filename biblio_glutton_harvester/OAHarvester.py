@@ -5,17 +5,18 @@ import shutil
 import gzip
 import json
 import magic
-import requests
 import pickle
 import lmdb
-import uuid
 import subprocess
 import argparse
 import time
 import yaml
-from concurrent.futures import ThreadPoolExecutor
 import tarfile
-from random import randint, choices
+import threading
+import contextlib
+import asyncio
+import concurrent.futures
+from random import choices
 from tqdm import tqdm
 import cloudscraper
 from bs4 import BeautifulSoup
@@ -30,6 +31,43 @@ import biblio_glutton_harvester.S3 as S3
 # support for SWIFT object storage
 import biblio_glutton_harvester.swift as swift
 
+# single pass reading of the harvesting input files
+from biblio_glutton_harvester.snapshot import SnapshotReader, create_checkpoint, checkpoint_resume_point
+
+# random sampling of the harvesting input entries
+from biblio_glutton_harvester.sampling import sample_lines
+
+# byte-level pre-filtering, decoding and OA location selection of the Unpaywall entries
+from biblio_glutton_harvester.ingestion import UnpaywallIngestion, chunked
+from biblio_glutton_harvester.oa_policy import OALocationPolicy
+
+# batched registry of the harvested entries identifiers
+from biblio_glutton_harvester.registry import IdentifierRegistry
+from biblio_glutton_harvester.gzip_blocks import load_block_index
+from biblio_glutton_harvester.pipeline import HarvestPipeline, DEFAULT_DOWNLOAD_WORKERS, DEFAULT_STORAGE_WORKERS, DEFAULT_ENRICHMENT_WORKERS
+from biblio_glutton_harvester.politeness import PolitenessScheduler, url_host
+
+# optional asyncio download engine (requires aiohttp)
+from biblio_glutton_harvester.async_download import AsyncDownloadEngine, DEFAULT_CONCURRENCY
+
+# AIMD adjustment of the number of concurrent downloads and storages
+from biblio_glutton_harvester.adaptive import AdaptiveLimit
+
+# keep-alive HTTP connections shared by the threads, pooled per host
+from biblio_glutton_harvester.http_sessions import SessionPool
+from biblio_glutton_harvester.scraper_sessions import ScraperPool
+from biblio_glutton_harvester.ftp_sessions import FtpSessionPool
+
+# streaming of the downloads to disk with early check of the response type
+from biblio_glutton_harvester.download_stream import stream_response, read_content, expected_kinds, DownloadVerdicts, cancelled_downloads, STREAM_SUCCESS, STREAM_REJECTED, STREAM_CANCELLED
+from biblio_glutton_harvester.native_download import download_http, download_ftp, DEFAULT_TRIES
+from biblio_glutton_harvester.host_health import HostHealthRegistry
+from biblio_glutton_harvester.negative_cache import NegativeCache, FailureLog, classify_status, classify_stream, classify_exception
+from biblio_glutton_harvester.deadlines import EntryBudget, HostTimeouts, DEFAULT_TIMEOUT
+from biblio_glutton_harvester.strategies import StrategyTable, CLOUDSCRAPER, REQUESTS, NATIVE
+from biblio_glutton_harvester.governor import network_governor, REQUESTS as REQUESTS_PER_SECOND
+from biblio_glutton_harvester.compression import FileCompressor
+
 # init LMDB
 map_size = 1024 * 1024 * 1024 * 1024 
 logging.basicConfig(filename='harvester.log', filemode='w', level=logging.DEBUG)
@@ -46,6 +84,52 @@ logging.getLogger("chardet").setLevel(logging.ERROR)
 biblio_glutton_url = None
 crossref_base = None
 crossref_email = None
+
+# optional limits on the number of concurrent requests to the metadata services (semaphores)
+biblio_glutton_slots = None
+crossref_slots = None
+
+# pooled HTTP sessions used for the downloads and the metadata requests
+http_sessions = SessionPool()
+
+def _create_scraper():
+    return cloudscraper.create_scraper(interpreter='nodejs')
+
+# pooled cloudscraper sessions per host, used for the downloads with cloudflare_support
+scraper_sessions = ScraperPool(_create_scraper)
+
+# pooled FTP sessions per server, used for the PMC archives
+ftp_sessions = FtpSessionPool()
+
+# types of the downloaded files identified while streaming them, to avoid re-reading them at validation
+download_verdicts = DownloadVerdicts()
+
+# health of the download hosts with their circuit breakers, set with the LMDB environments of the harvester
+host_health = None
+
+# cache of the failed URLs, set with the LMDB environments of the harvester, and failures observed by the 
+# download methods of the URL being downloaded
+negative_cache = None
+url_failures = FailureLog()
+
+# download methods learned per host, set with the LMDB environments of the harvester
+download_strategies = None
+
+# executor of the hedged downloads of the candidate locations, created with the pipeline if hedging is enabled
+hedge_executor = None
+
+# politeness scheduler of the current pipeline, giving the slots of the hosts of the hedged downloads
+download_scheduler = None
+
+# optional wall-clock budget of the download of an entry, and timeouts of the requests adapted to their host
+entry_budget = None
+host_timeouts = HostTimeouts()
+
+# maximum size of a landing page read for following a redirection
+MAX_LANDING_PAGE_SIZE = 5 * 1024 * 1024
+
+# interval in seconds between the checks of the host slot of a hedged candidate, while other candidates are running
+HEDGE_SLOT_POLL = 0.5
 s3_arxiv = None
 swift_arxiv = None
 s3_plos = None
@@ -59,11 +143,12 @@ FAIL_DOWNLOAD = 'fail'
 Harvester for PDF available in open access. a LMDB index is used to keep track of the harvesting process and
 possible failures.
 
-This version uses the standard ThreadPoolExecutor for parallelizing the download/processing/upload processes. 
+This version uses a streaming pipeline of thread pools connected by bounded queues for parallelizing the 
+download/validation/processing/upload processes (see pipeline.py). 
 '''
 class OAHarvester(object):
 
-    def __init__(self, config, thumbnail=False, sample=None):
+    def __init__(self, config, thumbnail=False, sample=None, sample_seed=None):
         global s3_arxiv
         global swift_arxiv
         global s3_plos
@@ -80,6 +165,18 @@ class OAHarvester(object):
         # lmdb environment for keeping track of failures
         self.env_fail = None
 
+        # lmdb environment for the resume checkpoints of the input files
+        self.env_checkpoints = None
+
+        # lmdb environment for the health of the download hosts (circuit breakers)
+        self.env_hosts = None
+
+        # lmdb environment for the negative cache of the failed URLs
+        self.env_urls = None
+
+        # lmdb environment for the download methods learned per host
+        self.env_strategies = None
+
         # the following lmdb map gives for every PMC ID where to download the archive file containing NLM and PDF files
         self.env_pmc_oa = None
         
@@ -90,6 +187,9 @@ class OAHarvester(object):
         # if a sample value is provided, indicate that we only harvest the indicated number of PDF
         self.sample = sample
 
+        # optional seed for reproducible random samples
+        self.sample_seed = sample_seed
+
         self.s3 = None
         if "aws" in self.config and "bucket_name" in self.config["aws"] and self.config["aws"]["bucket_name"] and len(self.config["aws"]["bucket_name"].strip()) > 0:
             self.s3 = S3.S3(self.config["aws"])
@@ -98,6 +198,9 @@ class OAHarvester(object):
         if "swift" in self.config and self.config["swift"] and len(self.config["swift"])>0 and "swift_container" in self.config["swift"] and self.config["swift"]["swift_container"] and len(self.config["swift"]["swift_container"])>0:
             self.swift = swift.Swift(self.config["swift"], data_path=self.config["data_path"])
 
+        # in-process compression of the stored files, None if the compression is disabled
+        self.compressor = FileCompressor.from_config(self.config)
+
         # arxiv minor, either S3 compatible storage or Swift OpenStack
         if _arxiv_mirror(self.config):
             if "s3" in self.config["resources"]["arxiv"] and "arxiv_bucket_name" in self.config["resources"]["arxiv"]["s3"] and self.config["resources"]["arxiv"]["s3"]["arxiv_bucket_name"] and len(self.config["resources"]["arxiv"]["s3"]["arxiv_bucket_name"].strip()) > 0:
@@ -120,6 +223,25 @@ class OAHarvester(object):
                 self.config["resources"]["plos"]["swift"]["swift_container"] = config["resources"]["plos"]["swift"]["plos_swift_container"]
                 swift_plos = swift.Swift(self.config["resources"]["plos"]["swift"], data_path=self.config["data_path"])
 
+        # policy for selecting the OA locations of the Unpaywall entries, compiled once from the config
+        self.oa_policy = OALocationPolicy.from_config(self.config, arxiv_mirror=_arxiv_mirror(self.config), plos_mirror=_plos_mirror(self.config))
+
+    def _prioritize_pmc_archive(self, entry, task):
+        """
+        If PMC is prioritized and the PMC ID of the entry is known (from the Unpaywall entry or from biblio-glutton),
+        download the NIH PMC archive (PDF and JATS) instead of the selected PDF, unless this selected location
+        is served by a mirror (arXiv, PLOS)
+        """
+        if not self.oa_policy.prioritize_pmc or task["from_mirror"]:
+            return
+        if not "pmcid" in entry or not 'best_oa_location' in entry:
+            return
+        localUrl, localLicense = self.pmc_oa_check(pmcid=entry["pmcid"])
+        if localUrl is not None:
+            entry['best_oa_location']['url_for_pdf'] = localUrl
+            if localLicense is not None:
+                entry['license'] = localLicense
+
     def _init_lmdb(self):
         # create the data path if it does not exist 
         if not os.path.isdir(self.config["data_path"]):
@@ -140,6 +262,26 @@ class OAHarvester(object):
         envFilePath = os.path.join(self.config["data_path"], 'fail')
         self.env_fail = lmdb.open(envFilePath, map_size=map_size)
 
+        envFilePath = os.path.join(self.config["data_path"], 'checkpoints')
+        self.env_checkpoints = lmdb.open(envFilePath, map_size=map_size)
+
+        global host_health
+        envFilePath = os.path.join(self.config["data_path"], 'hosts')
+        self.env_hosts = lmdb.open(envFilePath, map_size=map_size)
+        host_health = HostHealthRegistry.from_config(self.config, self.env_hosts)
+
+        global negative_cache
+        envFilePath = os.path.join(self.config["data_path"], 'urls')
+        self.env_urls = lmdb.open(envFilePath, map_size=map_size)
+        negative_cache = NegativeCache.from_config(self.config, self.env_urls)
+
+        global download_strategies
+        envFilePath = os.path.join(self.config["data_path"], 'strategies')
+        self.env_strategies = lmdb.open(envFilePath, map_size=map_size)
+        download_strategies = StrategyTable.from_config(self.config, self.env_strategies)
+
+        self.registry = IdentifierRegistry(self.env_doi, self.env)
+
         if self.env_pmc_oa == None:
             envFilePath = os.path.join(self.config["data_path"], 'pmc_oa')
             toBeReLoaded = False
@@ -170,7 +312,7 @@ class OAHarvester(object):
                     url = "ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_file_list.txt"
                     logging.info("Downloading PMC resource file: " + url)
                     print("Downloading PMC resource file: " + url + " (done only at first launch... hold on...)")
-                    _download_wget(url, resource_file)
+                    _download_fallback(url, resource_file, size_limit=False)
 
                 if os.path.isfile(resource_file) and not os.path.isdir(envFilePath):
                     # open in write mode
@@ -215,6 +357,47 @@ class OAHarvester(object):
             if self.env_pmc_oa == None:
                 self.env_pmc_oa = lmdb.open(envFilePath, readonly=True, lock=False)
 
+    def _checkpoint_key(self, kind, filepath, reprocess):
+        key = kind
+        if reprocess:
+            key += ":reprocess"
+        key += ":" + os.path.abspath(filepath)
+        return key.encode(encoding='UTF-8')
+
+    def _load_checkpoint(self, kind, filepath, reprocess=False):
+        """
+        Return the resume point saved for the input file by an interrupted harvesting, None if the harvesting
+        of this file has to start from the beginning
+        """
+        if self.sample is not None:
+            # a random sample is always harvested from scratch
+            return None
+        with self.env_checkpoints.begin() as txn:
+            checkpoint_object = txn.get(self._checkpoint_key(kind, filepath, reprocess))
+        if checkpoint_object == None:
+            return None
+        # None if the input file has changed since the checkpoint
+        return checkpoint_resume_point(filepath, _deserialize_pickle(checkpoint_object))
+
+    def _save_checkpoint(self, kind, filepath, reprocess, reader, line):
+        """
+        Save a resume point at the given line of the input file, all the entries before this line being
+        completely processed. The resume point is given by the reader of the file (snapshot reader or block
+        index). The buffered host health, download methods and failed URLs are persisted at the same time.
+        """
+        _flush_stores()
+        if self.sample is not None:
+            return
+        resume_point = reader.checkpoint(line)
+        if resume_point is None:
+            return
+        with self.env_checkpoints.begin(write=True) as txn:
+            txn.put(self._checkpoint_key(kind, filepath, reprocess), _serialize_pickle(create_checkpoint(filepath, resume_point)))
+
+    def _clear_checkpoint(self, kind, filepath, reprocess=False):
+        with self.env_checkpoints.begin(write=True) as txn:
+            txn.delete(self._checkpoint_key(kind, filepath, reprocess))
+
     def harvestUnpaywall(self, filepath, reprocess=False):   
         """
         Main method, use the Unpaywall dataset for getting pdf url for Open Access resources, 
@@ -230,230 +413,127 @@ class OAHarvester(object):
         else:
             batch_size_pdf = 100
 
-        # batch size for lmdb commit
-        batch_size_lmdb = 10 
-        n = 0
+        # batch size for lmdb look-ups and commits, the registered entries not committed when a harvesting is
+        # interrupted being harvested again when resuming
+        batch_size_lmdb = batch_size_pdf
         i = 0
-        urls = []
-        entries = []
-        filenames = []
-        selection = None
         total_pdf_url_found = 0
         total_oa_location_found = 0
         total_no_best_oa_location_found = 0
         total_oa_location_found_but_empty_pdf_url = 0
 
-        # check the overall number of entries based on the line number
-        print("\ncalculating number of entries...")
-        count = 0
-        with gzip.open(filepath, 'rb') as gz:  
-            while 1:
-                buffer = gz.read(8192*1024)
-                if not buffer: break
-                count += buffer.count(b'\n')
-        print("number of articles to harvest:", str(count),"\n")
-
-        if self.sample is not None:
-            # random selection corresponding to the requested sample size
-            selection = [randint(0, count-1) for p in range(0, self.sample)]
-            selection.sort()
-
-        with gzip.open(filepath, 'rt') as gz:
-            position = 0
-            for line in tqdm(gz, total=count):
-                if selection is not None and not position in selection:
-                    position += 1
-                    continue
-
-                if len(line.strip()) == 0:
-                    continue
-
-                if i == batch_size_pdf:
-                    self.processBatch(urls, filenames, entries)
-                    # reinit
-                    i = 0
-                    urls = []
-                    entries = []
-                    filenames = []
-                    n += batch_size_pdf
-
-                # one json entry per line
-                entry = json.loads(line)
-                doi = entry['doi']
-
-                if "genre" in entry and entry["genre"] == "component":
-                    # components are figures or tables, which will be in the corresponding article with more context 
-                    # and usefulness, so we skip
-                    position += 1
-                    continue
-
-                # check if the entry has already been processed
-                id_candidate = self.getUUIDByIdentifier(doi)
-                if id_candidate is not None:
-                    id_candidate = id_candidate.decode("utf-8") 
-                    if reprocess:
-                        entry['id'] = id_candidate
-                        # did we success with this entry?  
-                        with self.env.begin() as txn:
-                            local_object = txn.get(id_candidate.encode(encoding='UTF-8'))
-                            if local_object != None:
-                                local_entry = _deserialize_pickle(local_object)
-                                if local_entry != None:
-                                    if "resources" in local_entry and "pdf" in local_entry["resources"]:
-                                        # we have a PDF, so no need to reprocess and we skip
-                                        position += 1
-                                        continue
-                        # otherwise we consider the entry for reprocessing
-                    else:
-                        # we don't reprocess existing entries
-                        position += 1
-                        continue
+        # lines which cannot lead to a download are rejected on their raw bytes, then the remaining entries are 
+        # decoded and their OA locations are selected, possibly in parallel by a pool of worker processes 
+        nb_ingestion_workers = 0
+        if 'ingestion_workers' in self.config and self.config['ingestion_workers']:
+            nb_ingestion_workers = self.config['ingestion_workers']
+        ingestion = UnpaywallIngestion(self.oa_policy, nb_workers=nb_ingestion_workers)
+
+        # if the snapshot has been re-encoded in independent gzip blocks, the workers also decompress the blocks
+        block_index = None
+        if nb_ingestion_workers > 1 and self.sample is None:
+            block_index = load_block_index(filepath)
+            if block_index is not None and not block_index.is_parallelizable():
+                block_index = None
+
+        # the worker processes are forked before the pipeline starts its threads, and are stopped even if the
+        # harvesting is interrupted
+        with ingestion:
+            # if a previous harvesting of this snapshot has been interrupted, we restart after its last processed batch
+            resume_point = self._load_checkpoint("unpaywall", filepath, reprocess)
+
+            # the snapshot is decompressed only once, progress is given by the offset in the compressed file
+            # or by the number of lines cached from a previous run
+            with SnapshotReader(filepath, resume_point=resume_point) as snapshot:
+                if snapshot.line_count is not None:
+                    print("\nnumber of articles to harvest:", str(snapshot.line_count),"\n")
+                if resume_point is not None:
+                    print("resuming harvesting at entry", str(snapshot.start_line))
+
+                if block_index is not None:
+                    print("parallel decompression of", str(len(block_index.blocks)), "gzip blocks")
+                    tasks = ingestion.resolve_blocks(filepath, block_index, start_line=snapshot.start_line)
+                    reader = block_index
                 else:
-                    # store a UUID
-                    entry['id'] = str(uuid.uuid4())
-                    with self.env_doi.begin(write=True) as txn_doi:
-                        txn_doi.put(entry['doi'].encode(encoding='UTF-8'), entry['id'].encode(encoding='UTF-8'))
+                    # optional random selection corresponding to the requested sample size, if the number of entries
+                    # is not known, a reservoir sampling is used and the sample is processed at the end of the pass
+                    lines = sample_lines(snapshot, self.sample, total=snapshot.line_count, seed=self.sample_seed, start=snapshot.start_line)
+                    tasks = ingestion.resolve(lines)
+                    reader = snapshot
+
+                # the entries are downloaded, validated and stored in a streaming pipeline, with a concurrent metadata 
+                # enrichment stage if biblio-glutton is used
+                enrich = None
+                if biblio_glutton_url != None:
+                    enrich = self._enrichEntry
+                pipeline = self._create_pipeline(batch_size_pdf, enrich=enrich)
+
+                # the entries are looked-up and registered by chunks, with one LMDB read and one LMDB write 
+                # transaction per chunk
+                for chunk in chunked(tasks, batch_size_lmdb):
+                    # check which entries have already been processed, and register the new ones
+                    to_process = self.registry.register_entries([task["entry"] for position, task in chunk], reprocess=reprocess)
+                    for (position, task), process_entry in zip(chunk, to_process):
+                        if not process_entry:
+                            continue
 
-                if 'oa_locations' in entry and len(entry['oa_locations'])>0:
-                    total_oa_location_found += 1
+                        if i == batch_size_pdf:
+                            # all the entries before the oldest uncompleted one are processed
+                            self._save_checkpoint("unpaywall", filepath, reprocess, reader, pipeline.safe_position(position))
+                            i = 0
 
-                if biblio_glutton_url != None:
-                    # enriching the bibliographical information via biblio-glutton
-                    local_doi = None
-                    if "doi" in entry:
-                        local_doi = entry['doi']
-                    local_pmcid = None
-                    if "pmicd" in entry:
-                        local_pmcid = entry['pmicd']
-                    local_pmid = None
-                    if "pmid" in entry:
-                        local_pmid = entry['pmid']
-                    glutton_record = _biblio_glutton_lookup(biblio_glutton_url,
-                                                            doi=local_doi,
-                                                            pmcid=local_pmcid,
-                                                            pmid=local_pmid,
-                                                            crossref_base= crossref_base, 
-                                                            crossref_email=crossref_email)
-                    if glutton_record != None:
-                        entry["glutton"] = glutton_record
-                        if not "doi" in entry and "doi" in glutton_record:
-                            entry["doi"] = glutton_record["doi"]
-                        if not "pmid" in entry and "pmid" in glutton_record:
-                            entry["pmid"] = glutton_record["pmid"]
-                        if not "pmcid" in entry and "pmcid" in glutton_record:
-                            entry["pmcid"] = glutton_record["pmcid"]    
-                        if not "istexId" in entry and "istexId" in glutton_record:
-                            entry["istexId"] = glutton_record["istexId"]
-
-                # if requested, we always prioritize PMC pdf over publisher one for higher chance of successful download
-                if "pmc" in self.config["resources"] and self.config["resources"]["pmc"] and "prioritize_pmc" in self.config["resources"]["pmc"] and self.config["resources"]["pmc"]["prioritize_pmc"]:
-                    for oa_location in entry['oa_locations']:
-                        if 'url_for_pdf' in oa_location and oa_location['url_for_pdf'] != None:
-                            if oa_location['url_for_pdf'].find('europepmc.org/articles/pmc') != -1 or oa_location['url_for_pdf'].find('ncbi.nlm.nih.gov/pmc/articles') != -1:
-                                entry['best_oa_location'] = oa_location
-
-                            # if PMC is prefered, we also change the download url to retrieve the tar archive from the NIH PMC ftp server
-                            # rather than a vulgus PDF
-                            if "pmcid" in entry:
-                                localUrl, localLicense = self.pmc_oa_check(pmcid=entry["pmcid"])
-                                if localUrl is not None:
-                                    entry['best_oa_location']['url_for_pdf'] = localUrl
-                                    if localLicense is not None:
-                                        entry['license'] = localLicense
-                                break
+                        entry = task["entry"]
 
-                # if we have a mirror of arXiv, we prioritize arxiv resources for hugher chance of successful download
-                if _arxiv_mirror(self.config):
-                    for oa_location in entry['oa_locations']:
-                        if "url" in oa_location and oa_location["url"] and oa_location["url"].find('arxiv.org') != -1:
-                            entry['best_oa_location'] = oa_location
-                            break
-
-                # if we have a PLOS resource, we use the PLOS PDF url, but also the PLOS mirror to get the JATS and TEI full text versions
-                if _plos_mirror(self.config):
-                    for oa_location in entry['oa_locations']:
-                        if 'url_for_pdf' in oa_location and oa_location['url_for_pdf'] and oa_location['url_for_pdf'].find('plos.org') != -1:
-                            entry['best_oa_location'] = oa_location
-                            break
-
-                # if the best location is none, we discard it 
-                if 'best_oa_location' in entry and entry['best_oa_location'] == None:
-                    del entry['best_oa_location']
-
-                # if the best location is not none but it has no usable 'url_for_pdf' field, we discard it 
-                if 'best_oa_location' in entry and entry['best_oa_location'] != None and not 'url_for_pdf' in entry['best_oa_location']:
-                    del entry['best_oa_location']
-                if 'best_oa_location' in entry and entry['best_oa_location'] != None and 'url_for_pdf' in entry['best_oa_location'] and entry['best_oa_location']['url_for_pdf'] == None:
-                    del entry['best_oa_location']
-
-                if not 'best_oa_location' in entry and 'oa_locations' in entry and len(entry['oa_locations'])>0:
-                    # the best oa_location identified with a "is_best" attribute, we need a valid link to a PDF too
-                    for oa_location in entry['oa_locations']:
-                        if oa_location['is_best'] and 'url_for_pdf' in oa_location and oa_location['url_for_pdf'] != None:
-                            entry['best_oa_location'] = oa_location
-                            break
-
-                # optionally, skip the IEEE locations
-                if "ieee" in self.config["resources"] and self.config["resources"]["ieee"] and "skip" in self.config["resources"]["ieee"] and self.config["resources"]["ieee"]["skip"]:
-                   if 'best_oa_location' in entry and entry['best_oa_location'] != None and 'url_for_pdf' in entry['best_oa_location'] and entry['best_oa_location']['url_for_pdf'] != None:
-                        if entry['best_oa_location']['url_for_pdf'].find("ieee.org") != -1:
-                            del entry['best_oa_location']
-
-                if 'oa_locations' in entry and len(entry['oa_locations'])>0:
-                    # if still no best location, take the first one with a valid link to a PDF
-                    # otherwise, we store lternative non-best PDF URL to improve chance of download
-                    for oa_location in entry['oa_locations']:
-                        if 'url_for_pdf' in oa_location and oa_location['url_for_pdf'] != None:
-                            # optionally, skip the IEEE locations
-                            if "ieee" in self.config["resources"] and self.config["resources"]["ieee"] and "skip" in self.config["resources"]["ieee"] and self.config["resources"]["ieee"]["skip"]:
-                                if oa_location['url_for_pdf'] != None:
-                                    if oa_location['url_for_pdf'].find("ieee.org") != -1:
-                                        continue
-                            if not 'best_oa_location' in entry:
-                                entry['best_oa_location'] = oa_location
-                            elif entry['best_oa_location'] != oa_location:
-                                # consider alternative non-best PDF URL to improve chance of download,
-                                if not 'alternative_oa_locations' in entry:
-                                    entry['alternative_oa_locations'] = []
-                                entry['alternative_oa_locations'].append(oa_location)
-
-                if 'oa_locations' in entry and len(entry['oa_locations'])>0:
-                    if not 'best_oa_location' in entry:
-                        total_oa_location_found_but_empty_pdf_url += 1
-
-                if 'best_oa_location' in entry:
-                    if entry['best_oa_location'] is not None and 'url_for_pdf' in entry['best_oa_location']:
-                        pdf_url = entry['best_oa_location']['url_for_pdf']
-                        if pdf_url is not None:
-                            total_pdf_url_found += 1
+                        if task["has_oa_locations"]:
+                            total_oa_location_found += 1
 
-                            urls.append(pdf_url)
-                            entries.append(entry)
+                        if task["has_oa_locations"] and not 'best_oa_location' in entry:
+                            total_oa_location_found_but_empty_pdf_url += 1
 
-                            if pdf_url.endswith("tar.gz"):
-                                # this is a PMC archive
-                                filenames.append(os.path.join(self.config["data_path"], entry['id']+".tar.gz"))
-                            else:
-                                # this is a usual PDF
-                                filenames.append(os.path.join(self.config["data_path"], entry['id']+".pdf"))
-                            i += 1
+                        if 'best_oa_location' in entry:
+                            total_pdf_url_found += 1
                             if "is_best" in entry['best_oa_location']:
                                 del entry['best_oa_location']['is_best']
-                else:
-                    total_no_best_oa_location_found += 1
 
-                position += 1
+                            if biblio_glutton_url != None:
+                                # the metadata enrichment stage resolves the download url (which can change with 
+                                # the enriched PMC ID), blocking if the enrichment queue is full
+                                pipeline.submit(position, None, None, entry, context=task)
+                            else:
+                                pdf_url, filename = self._resolveDownload(entry, task)
+                                # blocking if the download queue is full
+                                pipeline.submit(position, pdf_url, filename, entry)
+                            i += 1
+                        else:
+                            total_no_best_oa_location_found += 1
             
-        # we need to process the latest incomplete batch (if not empty)
-        if len(urls) >0:
-            self.processBatch(urls, filenames, entries)
-            n += len(urls)
+                # wait for the completion of the entries in the pipeline
+                ingestion.close()
+                pipeline.close()
+                _flush_stores()
+
+        # the snapshot is fully harvested, a new harvesting will start from the beginning
+        self._clear_checkpoint("unpaywall", filepath, reprocess)
 
+        ingestion.prefilter.report()
         print("total entries with non empty oa_location found:", total_oa_location_found)
         print("total entries with no oa_location or no usable oa_location found:", total_no_best_oa_location_found)
         print("total entries with oa_location but no usable pdf url found:", total_oa_location_found_but_empty_pdf_url)
         print("total entries with usable pdf url found:", total_pdf_url_found)
-        print("total processed entries:", n)
+        print("total processed entries:", pipeline.nb_submitted)
+        http_sessions.report()
+        scraper_sessions.report()
+        ftp_sessions.report()
+        if host_timeouts != None:
+            host_timeouts.report()
+        if entry_budget != None:
+            entry_budget.report()
+        network_governor.report()
+        if self.compressor != None:
+            self.compressor.report()
+        for limit in (pipeline.download_limit, pipeline.storage_limit):
+            if limit != None:
+                limit.report()
 
     def harvestPMC(self, filepath, reprocess=False):   
         """
@@ -471,214 +551,263 @@ class OAHarvester(object):
             return
         pmc_base = self.config["resources"]["pmc"]["pmc_base"]
 
-        # batch size for lmdb commit
-        batch_size_lmdb = 10 
-        n = 0
+        # batch size for lmdb look-ups and commits, the registered entries not committed when a harvesting is
+        # interrupted being harvested again when resuming
+        batch_size_lmdb = batch_size_pdf
         i = 0
-        urls = []
-        entries = []
-        filenames = []
 
-        selection = None
-
-        # check the overall number of entries based on the line number
-        print("calculating number of entries...")
-        count = 0
-        with open(filepath, 'rb') as fp:  
-            while 1:
-                buffer = fp.read(8192*1024)
-                if not buffer: break
-                count += buffer.count(b'\n')
+        # if a previous harvesting of this list has been interrupted, we restart after its last processed batch
+        resume_point = self._load_checkpoint("pmc", filepath, reprocess)
+
+        # single pass over the list file, progress is given by the file offset or by the number of lines
+        # cached from a previous run
+        with SnapshotReader(filepath, resume_point=resume_point) as snapshot:
+            if snapshot.line_count is not None:
+                print("total entries found: " + str(snapshot.line_count))
+            if resume_point is not None:
+                print("resuming harvesting at entry", str(snapshot.start_line))
+
+            # optional random selection corresponding to the requested sample size, if the number of entries
+            # is not known, a reservoir sampling is used and the sample is processed at the end of the pass, the 
+            # first line giving the generation date of the list is not sampled
+            lines = sample_lines(snapshot, self.sample, total=snapshot.line_count, seed=self.sample_seed, start=snapshot.start_line, 
+                header_lines=1)
+            # the entries are downloaded, validated and stored in a streaming pipeline
+            pipeline = self._create_pipeline(batch_size_pdf)
+
+            # the entries are looked-up and registered by chunks, with one LMDB read and one LMDB write 
+            # transaction per chunk
+            for chunk in chunked(_pmc_list_entries(lines, pmc_base), batch_size_lmdb):
+                # check which entries have already been processed, and register the new ones
+                to_process = self.registry.register_entries([entry for position, entry in chunk], reprocess=reprocess)
+                for (position, entry), process_entry in zip(chunk, to_process):
+                    if not process_entry:
+                        continue
 
-        print("total entries found: " + str(count))
+                    if i == batch_size_pdf:
+                        # all the entries before the oldest uncompleted one are processed
+                        self._save_checkpoint("pmc", filepath, reprocess, snapshot, pipeline.safe_position(position))
+                        i = 0
 
-        if self.sample is not None:
-            # random selection corresponding to the requested sample size
-            selection = [randint(0, count-1) for p in range(0, self.sample)]
-            selection.sort()
-
-        with open(filepath, 'rt') as fp:  
-            position = 0
-            for line in tqdm(fp, total=count):
-                if selection is not None and not position in selection:
-                    position += 1
-                    continue
-
-                # skip first line which gives the date when the list has been generated
-                if position == 0:
-                    position += 1
-                    continue
-
-                if i == batch_size_pdf:
-                    self.processBatch(urls, filenames, entries)
-                    # reinit
-                    i = 0
-                    urls = []
-                    entries = []
-                    filenames = []
-                    n += batch_size_pdf
-
-                # one PMC entry per line
-                tokens = line.split('\t')
-                subpath = tokens[0]
-                pmcid = tokens[2]
-                pmid = str(tokens[3])
-                ind = pmid.find(":")
-                if ind != -1:
-                    pmid = pmid[ind+1:]
-                
-                if pmcid is None:
-                    position += 1
-                    continue
-
-                # check if the entry has already been processed
-                if self.getUUIDByIdentifier(pmcid) is not None:
-                    position += 1
-                    continue
-
-                entry = {}
-                entry['pmid'] = pmid
-                # TODO: avoid depending on instanciated DOI
-                entry['doi'] = pmcid
-
-                # check if the entry has already been processed
-                id_candidate = self.getUUIDByIdentifier(pmcid)
-                if id_candidate is not None:
-                    id_candidate = id_candidate.decode("utf-8") 
-                    if reprocess:
-                        entry['id'] = id_candidate
-                        # did we success with this entry?  
-                        with self.env.begin() as txn:
-                            local_object = txn.get(id_candidate.encode(encoding='UTF-8'))
-                            if local_object != None:
-                                local_entry = _deserialize_pickle(local_object)
-                                if local_entry != None:
-                                    if "resources" in local_entry and "pdf" in local_entry["resources"]:
-                                        # we have a PDF, so no need to reprocess and we skip
-                                        position += 1
-                                        continue
-                        # otherwise we consider the entry for reprocessing
-                    else:
-                        # we don't reprocess existing entries
-                        position += 1
-                        continue
-                else:
-                    # store a UUID
-                    entry['id'] = str(uuid.uuid4())
-                    with self.env_doi.begin(write=True) as txn_doi:
-                        txn_doi.put(entry['doi'].encode(encoding='UTF-8'), entry['id'].encode(encoding='UTF-8'))
-
-                if subpath is not None:
-                    tar_url = pmc_base + subpath
-                    #print(tar_url)
-                    urls.append(tar_url)
-
-                    #entry['id'] = str(uuid.uuid4())
-                    #entry['pmcid'] = pmcid
-                    
-                    entry_url = {}
-                    entry_url['url_for_pdf'] = tar_url
-                    entry['best_oa_location'] = entry_url
-                    entries.append(entry)
-                    filenames.append(os.path.join(self.config["data_path"], entry['id']+".tar.gz"))
+                    # blocking if the download queue is full
+                    pipeline.submit(position, entry['best_oa_location']['url_for_pdf'], os.path.join(self.config["data_path"], entry['id']+".tar.gz"), entry)
                     i += 1
-
-                position += 1
-            
-        # we need to process the latest incomplete batch (if not empty)
-        if len(urls) >0:
-            self.processBatch(urls, filenames, entries)
-            n += len(urls)
-
-        print("total processed entries:", n)
-
-    def processBatch(self, urls, filenames, entries):
-        with ThreadPoolExecutor(max_workers=12) as executor:
-            results = executor.map(_download, urls, filenames, entries, timeout=30)
-
-        # LMDB write transaction must be performed in the thread that created the transaction, so
-        # better to have the following lmdb updates out of the paralell process
-        entries = []
-        for result in results:
-            local_entry = result[1]
-            # conservative check if the downloaded file is of size 0 with a status code sucessful (code: 0),
-            # it should not happen *in theory*
-            # and check mime type
-            valid_file = False
-            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".pdf")
-            if os.path.isfile(local_filename): 
-                if _is_valid_file(local_filename, "pdf"):
-                    valid_file = True
-                    local_entry["valid_fulltext_pdf"] = True
-                else:
-                    if os.path.isfile(local_filename): 
-                        os.remove(local_filename)
             
-            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".nxml")
-            if os.path.isfile(local_filename): 
-                if _is_valid_file(local_filename, "xml"):
-                    valid_file = True
-                    local_entry["valid_fulltext_xml"] = True
-
-            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".jats.xml")
-            if os.path.isfile(local_filename): 
-                if _is_valid_file(local_filename, "xml"):
-                    valid_file = True
-                    local_entry["valid_fulltext_xml"] = True
-
-            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".zip")
-            if os.path.isfile(local_filename): 
-                if _is_valid_file(local_filename, "zip"):
-                    valid_file = True
-                    local_entry["valid_latex_sources"] = True
-                else:
-                    if os.path.isfile(local_filename): 
-                        os.remove(local_filename)
+            # wait for the completion of the entries in the pipeline
+            pipeline.close()
+            _flush_stores()
+
+        # the list is fully harvested, a new harvesting will start from the beginning
+        self._clear_checkpoint("pmc", filepath, reprocess)
+
+        print("total processed entries:", pipeline.nb_submitted)
+        http_sessions.report()
+        scraper_sessions.report()
+        ftp_sessions.report()
+        if host_timeouts != None:
+            host_timeouts.report()
+        if entry_budget != None:
+            entry_budget.report()
+        network_governor.report()
+        if self.compressor != None:
+            self.compressor.report()
+        for limit in (pipeline.download_limit, pipeline.storage_limit):
+            if limit != None:
+                limit.report()
+
+    def _create_pipeline(self, queue_size, enrich=None):
+        download_workers = DEFAULT_DOWNLOAD_WORKERS
+        if 'download_workers' in self.config and self.config['download_workers']:
+            download_workers = self.config['download_workers']
+        storage_workers = DEFAULT_STORAGE_WORKERS
+        if 'storage_workers' in self.config and self.config['storage_workers']:
+            storage_workers = self.config['storage_workers']
+        enrichment_workers = DEFAULT_ENRICHMENT_WORKERS
+        if "metadata" in self.config and self.config["metadata"] and "enrichment_workers" in self.config["metadata"] and self.config["metadata"]["enrichment_workers"]:
+            enrichment_workers = self.config["metadata"]["enrichment_workers"]
+        # the downloads are dispatched in round-robin over the hosts, within the politeness limits of each host,
+        # with a look-ahead independent of the queue size
+        global download_scheduler
+        scheduler = PolitenessScheduler.from_config(self.config)
+        download_scheduler = scheduler
+
+        # optionally, the HTTP downloads are performed by an event loop instead of the download threads, 
+        # which then only run the blocking download methods
+        download_engine = None
+        initial_downloads = download_workers
+        if 'download_engine' in self.config and self.config['download_engine'] == 'asyncio':
+            concurrency = DEFAULT_CONCURRENCY
+            if 'async_concurrency' in self.config and self.config['async_concurrency']:
+                concurrency = self.config['async_concurrency']
+            download_engine = AsyncDownloadEngine(_download_async, concurrency=concurrency, blocking_workers=download_workers, 
+                connections_per_host=http_sessions.connections_per_host, stats=http_sessions.stats)
+            initial_downloads = concurrency
+
+        # optionally, the number of downloads in flight and of entries stored in parallel are adjusted 
+        # within the configured bounds
+        download_limit = None
+        storage_limit = None
+        if 'adaptive_concurrency' in self.config and self.config['adaptive_concurrency']:
+            adaptive_config = self.config['adaptive_concurrency']
+            if 'downloads' in adaptive_config:
+                # the event loop cannot have more downloads in flight than its concurrency
+                upper = download_engine.concurrency if download_engine != None else None
+                download_limit = AdaptiveLimit.from_config("downloads", adaptive_config['downloads'], initial_downloads, upper=upper)
+            if 'storage' in adaptive_config:
+                storage_limit = AdaptiveLimit.from_config("storage", adaptive_config['storage'], storage_workers)
+
+        # optionally, the candidate locations of an entry are raced by the threads of the hedge executor
+        global hedge_executor
+        hedging = _hedging_config(self.config)
+        if hedging != None and download_engine == None and hedge_executor == None:
+            hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=download_workers * hedging["max_parallel"])
+
+        return HarvestPipeline(_download, self._commitDownload, self.manageFiles, download_workers=download_workers, 
+            storage_workers=storage_workers, queue_size=queue_size, enrich=enrich, enrichment_workers=enrichment_workers,
+            scheduler=scheduler, download_host=self._download_host, download_engine=download_engine,
+            download_limit=download_limit, storage_limit=storage_limit, is_success=_is_download_success)
+
+    def _download_host(self, url):
+        """
+        Host of a download for the politeness limits, None if the resource is not downloaded from its host
+        """
+        return _politeness_host(url, self.config)
 
-            #update DB
-            with self.env.begin(write=True) as txn:
-                txn.put(local_entry['id'].encode(encoding='UTF-8'), _serialize_pickle(_create_map_entry(local_entry))) 
+    def _resolveDownload(self, entry, task):
+        """
+        Return the url to download for an Unpaywall entry and the local file name of the download
+        """
+        # if PMC is prefered, we change the download url to retrieve the tar archive from the NIH PMC ftp server
+        # rather than a vulgus PDF
+        self._prioritize_pmc_archive(entry, task)
+
+        pdf_url = entry['best_oa_location']['url_for_pdf']
+        if pdf_url.endswith("tar.gz"):
+            # this is a PMC archive
+            filename = os.path.join(self.config["data_path"], entry['id']+".tar.gz")
+        else:
+            # this is a usual PDF
+            filename = os.path.join(self.config["data_path"], entry['id']+".pdf")
+        return pdf_url, filename
 
-            if (result[0] is None or result[0] == "0" or result[0] == SUCCESS_DOWNLOAD) and valid_file:
-                entries.append(local_entry)
+    def _enrichEntry(self, url, filename, entry, task):
+        """
+        Enrichment stage of the pipeline: enrich the bibliographical information of an Unpaywall entry via 
+        biblio-glutton, then resolve its download url
+        """
+        local_doi = None
+        if "doi" in entry:
+            local_doi = entry['doi']
+        local_pmcid = None
+        if "pmicd" in entry:
+            local_pmcid = entry['pmicd']
+        local_pmid = None
+        if "pmid" in entry:
+            local_pmid = entry['pmid']
+        glutton_record = _biblio_glutton_lookup(biblio_glutton_url,
+                                                doi=local_doi,
+                                                pmcid=local_pmcid,
+                                                pmid=local_pmid,
+                                                crossref_base= crossref_base, 
+                                                crossref_email=crossref_email)
+        if glutton_record != None:
+            entry["glutton"] = glutton_record
+            if not "doi" in entry and "doi" in glutton_record:
+                entry["doi"] = glutton_record["doi"]
+            if not "pmid" in entry and "pmid" in glutton_record:
+                entry["pmid"] = glutton_record["pmid"]
+            if not "pmcid" in entry and "pmcid" in glutton_record:
+                entry["pmcid"] = glutton_record["pmcid"]    
+            if not "istexId" in entry and "istexId" in glutton_record:
+                entry["istexId"] = glutton_record["istexId"]
+
+        return self._resolveDownload(entry, task)
+
+    def _commitDownload(self, result):
+        """
+        Validate the downloaded files of an entry and record the result of the download in the LMDB,
+        return True if the entry has been successfully harvested and its files have to be stored.
+        This is always called from the same pipeline thread, as LMDB write transaction must be performed 
+        in the thread that created the transaction.
+        """
+        local_entry = result[1]
+        # conservative check if the downloaded file is of size 0 with a status code sucessful (code: 0),
+        # it should not happen *in theory*
+        # and check mime type
+        valid_file = False
+        local_filename = os.path.join(self.config["data_path"], local_entry['id']+".pdf")
+        # the type of the file might have been already identified when streaming its download
+        verdict = download_verdicts.pop(local_filename)
+        if os.path.isfile(local_filename): 
+            if verdict == "pdf" or _is_valid_file(local_filename, "pdf"):
+                valid_file = True
+                local_entry["valid_fulltext_pdf"] = True
             else:
-                logging.info("register harvesting failure: " + result[0])
-
-                with self.env_fail.begin(write=True) as txn_fail:
-                    txn_fail.put(local_entry['id'].encode(encoding='UTF-8'), result[0].encode(encoding='UTF-8'))
-
-                # if an empty pdf or tar file is present, we clean
-                '''
-                local_filename = os.path.join(self.config["data_path"], local_entry['id']+".pdf")
-                if os.path.isfile(local_filename): 
-                    os.remove(local_filename)
-                local_filename = os.path.join(self.config["data_path"], local_entry['id']+".tar.gz")
-                if os.path.isfile(local_filename): 
-                    os.remove(local_filename)
-                local_filename = os.path.join(self.config["data_path"], local_entry['id']+".nxml")
-                if os.path.isfile(local_filename): 
-                    os.remove(local_filename)
-                local_filename = os.path.join(self.config["data_path"], local_entry['id']+".pub2tei.tei.xml")
-                if os.path.isfile(local_filename): 
-                    os.remove(local_filename)
-                local_filename = os.path.join(self.config["data_path"], local_entry['id']+".zip")
-                if os.path.isfile(local_filename): 
-                    os.remove(local_filename)
-                local_filename = os.path.join(self.config["data_path"], local_entry['id']+".jats.xml")
                 if os.path.isfile(local_filename): 
                     os.remove(local_filename)
-                local_filename = os.path.join(self.config["data_path"], local_entry['id']+".json")
+        
+        local_filename = os.path.join(self.config["data_path"], local_entry['id']+".nxml")
+        if os.path.isfile(local_filename): 
+            if _is_valid_file(local_filename, "xml"):
+                valid_file = True
+                local_entry["valid_fulltext_xml"] = True
+
+        local_filename = os.path.join(self.config["data_path"], local_entry['id']+".jats.xml")
+        if os.path.isfile(local_filename): 
+            if _is_valid_file(local_filename, "xml"):
+                valid_file = True
+                local_entry["valid_fulltext_xml"] = True
+
+        local_filename = os.path.join(self.config["data_path"], local_entry['id']+".zip")
+        if os.path.isfile(local_filename): 
+            if _is_valid_file(local_filename, "zip"):
+                valid_file = True
+                local_entry["valid_latex_sources"] = True
+            else:
                 if os.path.isfile(local_filename): 
                     os.remove(local_filename)
-                '''
 
-        # finally we can parallelize the thumbnail/upload/file cleaning steps for this batch
-        with ThreadPoolExecutor(max_workers=12) as executor:
-            results = executor.map(self.manageFiles, entries, timeout=30)
+        #update DB
+        with self.env.begin(write=True) as txn:
+            txn.put(local_entry['id'].encode(encoding='UTF-8'), _serialize_pickle(_create_map_entry(local_entry))) 
+
+        if (result[0] is None or result[0] == "0" or result[0] == SUCCESS_DOWNLOAD) and valid_file:
+            return True
+        else:
+            logging.info("register harvesting failure: " + result[0])
+
+            with self.env_fail.begin(write=True) as txn_fail:
+                txn_fail.put(local_entry['id'].encode(encoding='UTF-8'), result[0].encode(encoding='UTF-8'))
+
+            # if an empty pdf or tar file is present, we clean
+            '''
+            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".pdf")
+            if os.path.isfile(local_filename): 
+                os.remove(local_filename)
+            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".tar.gz")
+            if os.path.isfile(local_filename): 
+                os.remove(local_filename)
+            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".nxml")
+            if os.path.isfile(local_filename): 
+                os.remove(local_filename)
+            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".pub2tei.tei.xml")
+            if os.path.isfile(local_filename): 
+                os.remove(local_filename)
+            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".zip")
+            if os.path.isfile(local_filename): 
+                os.remove(local_filename)
+            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".jats.xml")
+            if os.path.isfile(local_filename): 
+                os.remove(local_filename)
+            local_filename = os.path.join(self.config["data_path"], local_entry['id']+".json")
+            if os.path.isfile(local_filename): 
+                os.remove(local_filename)
+            '''
+
+        return False
 
     def getUUIDByIdentifier(self, identifier):
-        txn = self.env_doi.begin()
-        return txn.get(identifier.encode(encoding='UTF-8'))
+        return self.registry.get(identifier)
 
     def manageFiles(self, local_entry):
         local_filename = os.path.join(self.config["data_path"], local_entry['id']+".pdf")
@@ -709,55 +838,50 @@ class OAHarvester(object):
         if os.path.isfile(thumb_file_small):
             local_entry["valid_thumbnails"] = True
 
-        # write metadata file
-        with open(local_filename_json, 'w') as outfile:
-            json.dump(local_entry, outfile)
-
         compression_suffix = ""
-        if self.config["compression"]:
+        if self.compressor != None:
             compression_suffix = ".gz"
 
-            try:
-                if os.path.isfile(local_filename):
-                    subprocess.check_call(['gzip', '-f', local_filename])
-                    local_filename += compression_suffix
-
-                if os.path.isfile(local_filename_nxml):
-                    subprocess.check_call(['gzip', '-f', local_filename_nxml])
-                    local_filename_nxml += compression_suffix
-
-                if os.path.isfile(local_filename_jats):
-                    subprocess.check_call(['gzip', '-f', local_filename_jats])
-                    local_filename_jats += compression_suffix    
-
-                if os.path.isfile(local_filename_tei):
-                    subprocess.check_call(['gzip', '-f', local_filename_tei])
-                    local_filename_tei += compression_suffix
-
-                if os.path.isfile(local_filename_json):
-                    subprocess.check_call(['gzip', '-f', local_filename_json])
-                    local_filename_json += compression_suffix
-
-                if os.path.isfile(local_filename_software):
-                    subprocess.check_call(['gzip', '-f', local_filename_software])
-                    local_filename_software += compression_suffix
-
-                # note: source files always as zip archive, not other compression needed
-
-                if (self.thumbnail):
-                    if os.path.isfile(thumb_file_small):
-                        subprocess.check_call(['gzip', '-f', thumb_file_small])
-                        thumb_file_small += compression_suffix
+            # the resource files of the entry are compressed in parallel by the compression threads
+            # note: source files always as zip archive, not other compression needed
+            resource_files = [local_filename, local_filename_nxml, local_filename_jats, local_filename_tei, local_filename_software]
+            if self.thumbnail:
+                resource_files += [thumb_file_small, thumb_file_medium, thumb_file_large]
+            compressed = self.compressor.compress(resource_files)
+
+            # size and checksum of the stored compressed files, recorded in the metadata file
+            if len(compressed) > 0:
+                local_entry["compressed_files"] = {}
+                for resource_file in resource_files:
+                    if resource_file in compressed:
+                        result = compressed[resource_file]
+                        local_entry["compressed_files"][os.path.basename(result["path"])] = { "size": result["size"], "sha256": result["sha256"] }
+
+            if local_filename in compressed:
+                local_filename += compression_suffix
+            if local_filename_nxml in compressed:
+                local_filename_nxml += compression_suffix
+            if local_filename_jats in compressed:
+                local_filename_jats += compression_suffix
+            if local_filename_tei in compressed:
+                local_filename_tei += compression_suffix
+            if local_filename_software in compressed:
+                local_filename_software += compression_suffix
+            if self.thumbnail:
+                if thumb_file_small in compressed:
+                    thumb_file_small += compression_suffix
+                if thumb_file_medium in compressed:
+                    thumb_file_medium += compression_suffix
+                if thumb_file_large in compressed:
+                    thumb_file_large += compression_suffix
 
-                    if os.path.isfile(thumb_file_medium): 
-                        subprocess.check_call(['gzip', '-f', thumb_file_medium])
-                        thumb_file_medium += compression_suffix
+        # write metadata file
+        with open(local_filename_json, 'w') as outfile:
+            json.dump(local_entry, outfile)
 
-                    if os.path.isfile(thumb_file_large): 
-                        subprocess.check_call(['gzip', '-f', thumb_file_large])
-                        thumb_file_large += compression_suffix
-            except:
-                logging.error("Error compressing resource files for " + local_entry['id'])
+        if self.compressor != None:
+            if local_filename_json in self.compressor.compress([local_filename_json]):
+                local_filename_json += compression_suffix
 
         if self.s3 is not None:
             # upload to S3 
@@ -833,29 +957,29 @@ class OAHarvester(object):
 
                 os.makedirs(local_dest_path, exist_ok=True)
                 if os.path.isfile(local_filename):
-                    shutil.copyfile(local_filename, os.path.join(local_dest_path, local_entry['id']+".pdf"+compression_suffix))
+                    shutil.copyfile(local_filename, os.path.join(local_dest_path, local_entry['id']+".pdf"+_compression_suffix(local_filename)))
                 if os.path.isfile(local_filename_nxml):
-                    shutil.copyfile(local_filename_nxml, os.path.join(local_dest_path, local_entry['id']+".nxml"+compression_suffix))
+                    shutil.copyfile(local_filename_nxml, os.path.join(local_dest_path, local_entry['id']+".nxml"+_compression_suffix(local_filename_nxml)))
                 if os.path.isfile(local_filename_jats):
-                    shutil.copyfile(local_filename_jats, os.path.join(local_dest_path, local_entry['id']+".jats.xml"+compression_suffix))
+                    shutil.copyfile(local_filename_jats, os.path.join(local_dest_path, local_entry['id']+".jats.xml"+_compression_suffix(local_filename_jats)))
                 if os.path.isfile(local_filename_tei):
-                    shutil.copyfile(local_filename_tei, os.path.join(local_dest_path, local_entry['id']+".pub2tei.tei.xml"+compression_suffix))
+                    shutil.copyfile(local_filename_tei, os.path.join(local_dest_path, local_entry['id']+".pub2tei.tei.xml"+_compression_suffix(local_filename_tei)))
                 if os.path.isfile(local_filename_json):
-                    shutil.copyfile(local_filename_json, os.path.join(local_dest_path, local_entry['id']+".json"+compression_suffix))
+                    shutil.copyfile(local_filename_json, os.path.join(local_dest_path, local_entry['id']+".json"+_compression_suffix(local_filename_json)))
                 if os.path.isfile(local_filename_software):
-                    shutil.copyfile(local_filename_software, os.path.join(local_dest_path, local_entry['id']+".software.json"+compression_suffix))
+                    shutil.copyfile(local_filename_software, os.path.join(local_dest_path, local_entry['id']+".software.json"+_compression_suffix(local_filename_software)))
                 if os.path.isfile(local_filename_sources):
                     shutil.copyfile(local_filename_sources, os.path.join(local_dest_path, local_entry['id']+".zip"))
 
                 if (self.thumbnail):
                     if os.path.isfile(thumb_file_small):
-                        shutil.copyfile(thumb_file_small, os.path.join(local_dest_path, local_entry['id']+"-thumb-small.png")+compression_suffix)
+                        shutil.copyfile(thumb_file_small, os.path.join(local_dest_path, local_entry['id']+"-thumb-small.png")+_compression_suffix(thumb_file_small))
 
                     if os.path.isfile(thumb_file_medium):
-                        shutil.copyfile(thumb_file_medium, os.path.join(local_dest_path, local_entry['id']+"-thumb-medium.png")+compression_suffix)
+                        shutil.copyfile(thumb_file_medium, os.path.join(local_dest_path, local_entry['id']+"-thumb-medium.png")+_compression_suffix(thumb_file_medium))
 
                     if os.path.isfile(thumb_file_large):
-                        shutil.copyfile(thumb_file_large, os.path.join(local_dest_path, local_entry['id']+"-thumb-larger.png")+compression_suffix)
+                        shutil.copyfile(thumb_file_large, os.path.join(local_dest_path, local_entry['id']+"-thumb-larger.png")+_compression_suffix(thumb_file_large))
 
             except IOError:
                 logging.exception("invalid path")
@@ -1004,6 +1128,10 @@ class OAHarvester(object):
         self.env.close()
         self.env_doi.close()
         self.env_fail.close()
+        self.env_checkpoints.close()
+        self.env_hosts.close()
+        self.env_urls.close()
+        self.env_strategies.close()
 
         envFilePath = os.path.join(self.config["data_path"], 'entries')
         shutil.rmtree(envFilePath)
@@ -1014,6 +1142,18 @@ class OAHarvester(object):
         envFilePath = os.path.join(self.config["data_path"], 'fail')
         shutil.rmtree(envFilePath)
 
+        envFilePath = os.path.join(self.config["data_path"], 'checkpoints')
+        shutil.rmtree(envFilePath)
+
+        envFilePath = os.path.join(self.config["data_path"], 'hosts')
+        shutil.rmtree(envFilePath)
+
+        envFilePath = os.path.join(self.config["data_path"], 'urls')
+        shutil.rmtree(envFilePath)
+
+        envFilePath = os.path.join(self.config["data_path"], 'strategies')
+        shutil.rmtree(envFilePath)
+
         # clean any possibly remaining tmp files (.pdf and .png)
         for f in os.listdir(self.config["data_path"]):
             local_file_path = os.path.join(self.config["data_path"], f)
@@ -1085,6 +1225,12 @@ class OAHarvester(object):
         nb_fails = txn_fail.stat()['entries']
         nb_total = txn.stat()['entries']
         print("number of failed entries with OA link:", nb_fails, "out of", nb_total, "entries")
+        if host_health != None:
+            host_health.report()
+        if negative_cache != None:
+            negative_cache.report()
+        if download_strategies != None:
+            download_strategies.report()
 
 def _biblio_glutton_lookup(biblio_glutton_url, doi=None, pmcid=None, pmid=None, istex_id=None, istex_ark=None, crossref_base= None, crossref_email=None):
     """
@@ -1099,7 +1245,8 @@ def _biblio_glutton_lookup(biblio_glutton_url, doi=None, pmcid=None, pmid=None,
 
     if doi is not None and len(doi)>0:
         try:
-            response = requests.get(biblio_glutton_url, params={'doi': doi}, verify=False, timeout=5)
+            with _service_slot(biblio_glutton_slots):
+                response = http_sessions.get(biblio_glutton_url, params={'doi': doi}, verify=False, timeout=5)
             success = (response.status_code == 200)
             if success:
                 jsonResult = response.json()
@@ -1108,7 +1255,8 @@ def _biblio_glutton_lookup(biblio_glutton_url, doi=None, pmcid=None, pmid=None,
 
     if not success and pmid is not None and len(str(pmid))>0:
         try:
-            response = requests.get(biblio_glutton_url + "pmid=" + str(pmid), verify=False, timeout=5)
+            with _service_slot(biblio_glutton_slots):
+                response = http_sessions.get(biblio_glutton_url + "pmid=" + str(pmid), verify=False, timeout=5)
             success = (response.status_code == 200)
             if success:
                 jsonResult = response.json()     
@@ -1117,7 +1265,8 @@ def _biblio_glutton_lookup(biblio_glutton_url, doi=None, pmcid=None, pmid=None,
 
     if not success and pmcid is not None and len(pmcid)>0:
         try:
-            response = requests.get(biblio_glutton_url + "pmc=" + pmcid, verify=False, timeout=5)  
+            with _service_slot(biblio_glutton_slots):
+                response = http_sessions.get(biblio_glutton_url + "pmc=" + pmcid, verify=False, timeout=5)  
             success = (response.status_code == 200)
             if success:
                 jsonResult = response.json()
@@ -1126,7 +1275,8 @@ def _biblio_glutton_lookup(biblio_glutton_url, doi=None, pmcid=None, pmid=None,
 
     if not success and istex_id is not None and len(istex_id)>0:
         try:
-            response = requests.get(biblio_glutton_url + "istexid=" + istex_id, verify=False, timeout=5)
+            with _service_slot(biblio_glutton_slots):
+                response = http_sessions.get(biblio_glutton_url + "istexid=" + istex_id, verify=False, timeout=5)
             success = (response.status_code == 200)
             if success:
                 jsonResult = response.json()
@@ -1141,7 +1291,8 @@ def _biblio_glutton_lookup(biblio_glutton_url, doi=None, pmcid=None, pmid=None,
         else:
             user_agent = {'User-agent': _get_random_user_agent()}
         try:
-            response = requests.get(crossref_base+"/works/"+doi, headers=user_agent, verify=False, timeout=5)
+            with _service_slot(crossref_slots):
+                response = http_sessions.get(crossref_base+"/works/"+doi, headers=user_agent, verify=False, timeout=5)
             if response.status_code == 200:
                 jsonResult = response.json()['message']
                 # filter out references and re-set doi, in case there are obtained via crossref
@@ -1155,6 +1306,14 @@ def _biblio_glutton_lookup(biblio_glutton_url, doi=None, pmcid=None, pmid=None,
     
     return jsonResult
 
+def _service_slot(slots):
+    """
+    Context manager limiting the number of concurrent requests to a metadata service, if a limit is set
+    """
+    if slots == None:
+        return contextlib.nullcontext()
+    return slots
+
 def _get_random_user_agent():
     '''
     This is a simple random/rotating user agent covering different devices and web clients/browsers
@@ -1169,6 +1328,37 @@ def _get_random_user_agent():
 
     return user_agent[0]
 
+def _pmc_list_entries(lines, pmc_base):
+    """
+    Create the entries to be harvested from the (position, line) pairs of a PMC file list, as (position, entry) pairs
+    """
+    for position, line in lines:
+        # skip first line which gives the date when the list has been generated
+        if position == 0:
+            continue
+
+        # one PMC entry per line
+        tokens = line.decode("utf-8").split('\t')
+        if len(tokens) < 4:
+            continue
+        subpath = tokens[0]
+        pmcid = tokens[2]
+        pmid = str(tokens[3])
+        ind = pmid.find(":")
+        if ind != -1:
+            pmid = pmid[ind+1:]
+
+        entry = {}
+        entry['pmid'] = pmid
+        # TODO: avoid depending on instanciated DOI
+        entry['doi'] = pmcid
+
+        tar_url = pmc_base + subpath
+        entry_url = {}
+        entry_url['url_for_pdf'] = tar_url
+        entry['best_oa_location'] = entry_url
+        yield position, entry
+
 def _serialize_pickle(a):
     return pickle.dumps(a)
 
@@ -1225,90 +1415,501 @@ def _download(url, filename, local_entry, config=None):
                 local_entry["istexId"] = glutton_record["istexId"]
     '''
 
-    result = FAIL_DOWNLOAD
-    if str(url).startswith("ftp"): 
-        result = _download_wget(url, filename)
-        '''
-        if result != "success":
-            # this appears to be not reliable at all with lot of decompression errors
-            # but as last options why not
-            result = _download_ftp(url, filename) 
-        '''
+    # the budget of the entry is shared by all its download methods and locations
+    if entry_budget != None:
+        entry_budget.start(filename)
+    try:
+        hedging = _hedging_config(config)
+        if hedging != None and hedge_executor != None:
+            result = _download_hedged(url, filename, local_entry, config, hedging)
+        else:
+            result = _download_url(url, filename, config)
+
+            if result != SUCCESS_DOWNLOAD:
+                # look for alternative url if present in the entry
+                if "alternative_oa_locations" in local_entry:
+                    for alternative_oa_location in local_entry['alternative_oa_locations']:
+                        if "url_for_pdf" in alternative_oa_location and alternative_oa_location["url_for_pdf"] and len(alternative_oa_location["url_for_pdf"])>0:
+                            result = _download_url(alternative_oa_location["url_for_pdf"], filename, config)
+                            if result == SUCCESS_DOWNLOAD:
+                                # update best oa location from successful alternative oa location
+                                local_entry['best_oa_location'] = alternative_oa_location
+                                break
+    finally:
+        _finish_budget(url, filename)
 
-    if result != SUCCESS_DOWNLOAD and config["cloudflare_support"]:
-        result = _download_cloudscraper(url, filename)
+    if os.path.isfile(filename) and filename.endswith(".tar.gz"):
+        _manage_pmc_archives(filename)
 
-    if result != SUCCESS_DOWNLOAD:
-        result = _download_requests(url, filename)
+    return result, local_entry
 
-    if result != SUCCESS_DOWNLOAD and not str(url).startswith("ftp"):
-        result = _download_wget(url, filename)
+class _UrlDownload(object):
+    """
+    Download of one URL with the successive download methods, shared by the download threads and the
+    asyncio engine, which only differ by the implementation of the download methods: the URL is not
+    downloaded if it is known as dead by the negative cache, if the circuit breaker of its host is open,
+    or if the budget of the entry is exhausted, and the outcomes of the methods are recorded for the host
+    """
 
-    if result != SUCCESS_DOWNLOAD:
-        # look for alternative url if present in the entry
-        if "alternative_oa_locations" in local_entry:
-            for alternative_oa_location in local_entry['alternative_oa_locations']:
-                if "url_for_pdf" in alternative_oa_location and alternative_oa_location["url_for_pdf"] and len(alternative_oa_location["url_for_pdf"])>0:
-                    if str(alternative_oa_location["url_for_pdf"]).startswith("ftp"): 
-                        result = _download_wget(alternative_oa_location["url_for_pdf"], filename)
-                        '''
-                        if result != "success":
-                            # this appears to be not reliable at all with lot of decompression errors
-                            # but as last options why not
-                            result = _download_ftp(alternative_oa_location["url_for_pdf"], filename) 
-                        '''
-                    if result != SUCCESS_DOWNLOAD and config["cloudflare_support"]:
-                        result = _download_cloudscraper(alternative_oa_location["url_for_pdf"], filename)
-
-                    if result != SUCCESS_DOWNLOAD:
-                        result = _download_requests(alternative_oa_location["url_for_pdf"], filename)
-
-                    if result != SUCCESS_DOWNLOAD and not str(alternative_oa_location["url_for_pdf"]).startswith("ftp"):
-                        result = _download_wget(alternative_oa_location["url_for_pdf"], filename)
-
-                    if result == SUCCESS_DOWNLOAD:
-                        # update best oa location from successful alternative oa location
-                        local_entry['best_oa_location'] = alternative_oa_location
-                        break
+    def __init__(self, url, filename, config, ftp_methods=None):
+        self.url = url
+        self.filename = filename
+        self.config = config
+        self.ftp_methods = ftp_methods
+        self.host = url_host(url)
+        self.cached_failure = None
+        self.start_time = None
+        self.result = FAIL_DOWNLOAD
 
-    if os.path.isfile(filename) and filename.endswith(".tar.gz"):
-        _manage_pmc_archives(filename)
+    def allowed(self):
+        """
+        Return True if the URL is to be downloaded
+        """
+        if cancelled_downloads.is_cancelled(self.filename):
+            return False
+        self.cached_failure = _cached_failure(self.url)
+        if self.cached_failure == False:
+            return False
+        if not _host_allowed(self.url, self.host):
+            return False
+        self.start_time = time.monotonic()
+        return True
 
-    return result, local_entry
+    def strategies(self):
+        """
+        Iterate over the (rank, download method) pairs to try, in the order learned for the host then in the
+        order of the cascade, until the download is cancelled
+        """
+        for rank, strategy in enumerate(_download_strategies(self.url, self.host, self.config, ftp_methods=self.ftp_methods)):
+            if cancelled_downloads.is_cancelled(self.filename):
+                break
+            yield rank, strategy
+
+    def record(self, rank, strategy, result):
+        """
+        Record the outcome of a download method, return True if the URL is downloaded
+        """
+        self.result = result
+        _record_strategy(self.host, strategy, result, self.filename, rank)
+        return result == SUCCESS_DOWNLOAD
+
+    def finish(self):
+        if cancelled_downloads.is_cancelled(self.filename):
+            # a hedged download which lost the race, or cut by the entry budget, says nothing about its URL
+            url_failures.pop(self.filename)
+        else:
+            # the host health and the negative cache are only updated in memory, without blocking the event loop
+            _record_host(self.host, self.result, self.start_time)
+            _record_url(self.url, self.filename, self.result, self.cached_failure)
+
+def _download_url(url, filename, config):
+    """
+    Download one URL with the successive download methods (see _UrlDownload)
+    """
+    download = _UrlDownload(url, filename, config)
+    if not download.allowed():
+        return FAIL_DOWNLOAD
+    try:
+        for rank, strategy in download.strategies():
+            if strategy == CLOUDSCRAPER:
+                result = _download_cloudscraper(url, filename)
+            elif strategy == REQUESTS:
+                result = _download_requests(url, filename)
+            else:
+                result = _download_fallback(url, filename)
+            if download.record(rank, strategy, result):
+                break
+    finally:
+        download.finish()
+    return download.result
 
-def _download_cloudscraper(url, filename, n=0, timeout_in_seconds=20):
+def _download_strategies(url, host, config, ftp_methods=None):
     """
-    Use a cloudscraper session for downloading Cloudflare protected file. 
+    Download methods to try for a URL: the cascade (native downloader first for a FTP URL, optional
+    cloudscraper, requests, then the native downloader), ordered by the outcomes learned for the host
+    """
+    if str(url).startswith("ftp"):
+        strategies = [NATIVE]
+        if config["cloudflare_support"]:
+            strategies.append(CLOUDSCRAPER)
+        strategies.append(REQUESTS)
+        if ftp_methods != None:
+            strategies = [strategy for strategy in strategies if strategy in ftp_methods]
+    else:
+        strategies = [CLOUDSCRAPER] if config["cloudflare_support"] else []
+        strategies += [REQUESTS, NATIVE]
+    if download_strategies != None:
+        strategies = download_strategies.order(host, strategies)
+    return strategies
+
+def _record_strategy(host, strategy, result, filename, rank):
+    """
+    Record the outcome of a download method for its host, unless the download has been cancelled
+    """
+    if download_strategies != None and not cancelled_downloads.is_cancelled(filename):
+        download_strategies.record(host, strategy, result == SUCCESS_DOWNLOAD, first=(rank == 0))
+
+def _finish_budget(url, filename):
+    """
+    End of the budget of the download of an entry
+    """
+    if entry_budget != None and entry_budget.finish(filename):
+        logging.info("Download budget exhausted for {0}".format(url))
+
+def _request_timeout(url, filename):
+    """
+    Timeout in seconds of a request for downloading url into filename, adapted to the host of the url and
+    bounded by the remaining budget of the entry
+    """
+    timeout = host_timeouts.timeout(url_host(url)) if host_timeouts != None else DEFAULT_TIMEOUT
+    remaining = cancelled_downloads.remaining(filename)
+    if remaining != None:
+        timeout = max(1.0, min(timeout, remaining))
+    return timeout
+
+def _record_latency(url, start_time):
+    """
+    Record the time until the response of a request, for adapting the timeouts of its host
+    """
+    if host_timeouts != None:
+        host_timeouts.record(url_host(url), time.monotonic() - start_time)
+
+def _flush_stores():
+    """
+    Persist the buffered updates of the host health, of the download methods learned per host and of the
+    negative cache
+    """
+    if host_health != None:
+        host_health.flush()
+    if download_strategies != None:
+        download_strategies.flush()
+    if negative_cache != None:
+        negative_cache.flush()
+
+def _host_allowed(url, host):
+    if host_health != None and not host_health.allow(host):
+        logging.info("Download deferred for {0}: circuit breaker open for {1}".format(url, host))
+        return False
+    return True
+
+def _record_host(host, result, start_time):
+    if host_health != None:
+        host_health.record(host, result == SUCCESS_DOWNLOAD, time.monotonic() - start_time)
+
+def _cached_failure(url):
+    """
+    Return the negative cache record of a URL (None if not cached), or False if the URL is to be skipped
+    """
+    if negative_cache == None:
+        return None
+    cached_failure = negative_cache.lookup(url)
+    if cached_failure != None and negative_cache.is_fresh(cached_failure):
+        logging.info("Download skipped for {0}: cached failure {1} ({2} attempts)".format(url, 
+            cached_failure["failure_class"], cached_failure["attempts"]))
+        negative_cache.skip(cached_failure)
+        return False
+    return cached_failure
+
+def _record_url(url, filename, result, cached_failure):
+    """
+    Update the negative cache with the outcome of the download of a URL
+    """
+    failures = url_failures.pop(filename)
+    if negative_cache == None:
+        return
+    if result == SUCCESS_DOWNLOAD:
+        if cached_failure != None:
+            negative_cache.discard(url)
+    else:
+        negative_cache.record(url, failures, cached_failure)
+
+def _hedging_config(config):
+    """
+    Parameters of the hedged downloads, None if not enabled
+    """
+    if config == None or not "hedged_downloads" in config or not config["hedged_downloads"]:
+        return None
+    hedging_config = config["hedged_downloads"]
+    if not "enabled" in hedging_config or not hedging_config["enabled"]:
+        return None
+    hedging = {"delay": 10, "max_parallel": 2}
+    for key in hedging:
+        if key in hedging_config and hedging_config[key] != None:
+            hedging[key] = hedging_config[key]
+    hedging["max_parallel"] = max(1, hedging["max_parallel"])
+    return hedging
+
+def _candidate_locations(url, local_entry):
+    """
+    Candidate locations of an entry, as (OA location, url) pairs: the selected url (without OA location to
+    record), then the alternative OA locations with a PDF url
+    """
+    candidates = [(None, url)]
+    if "alternative_oa_locations" in local_entry:
+        for alternative_oa_location in local_entry['alternative_oa_locations']:
+            if "url_for_pdf" in alternative_oa_location and alternative_oa_location["url_for_pdf"] and len(alternative_oa_location["url_for_pdf"])>0:
+                candidates.append((alternative_oa_location, alternative_oa_location["url_for_pdf"]))
+    return candidates
+
+def _candidate_filename(filename, rank):
+    """
+    Target file of a candidate location in a hedged download, the file of the winning candidate being then
+    moved to the final file
+    """
+    for extension in (".tar.gz", ".pdf"):
+        if filename.endswith(extension):
+            return filename[:-len(extension)] + ".hedge" + str(rank) + extension
+    return filename + ".hedge" + str(rank)
+
+def _hedge_delay(url, hedging):
+    """
+    Time to wait for the download of a candidate before starting the next candidate, no wait if the host of
+    the candidate is known to be slower than the hedging delay
+    """
+    if host_health != None:
+        latency = host_health.latency(url_host(url))
+        if latency != None and latency >= hedging["delay"]:
+            return 0
+    return hedging["delay"]
+
+def _discard_candidate(candidate_filename):
+    """
+    Clean the file of a cancelled or failed candidate once its download is finished
+    """
+    download_verdicts.discard(candidate_filename)
+    if os.path.isfile(candidate_filename):
+        try:
+            os.remove(candidate_filename)
+        except OSError:
+            logging.exception("Deletion of hedged download failed: " + candidate_filename)
+    cancelled_downloads.clear(candidate_filename)
+
+def _select_candidate(filename, candidates, rank, local_entry):
+    """
+    Move the file of the winning candidate to the final file, and record its location as the best one
+    """
+    candidate_filename = _candidate_filename(filename, rank)
+    if os.path.isfile(candidate_filename):
+        os.replace(candidate_filename, filename)
+    verdict = download_verdicts.pop(candidate_filename)
+    if verdict != None:
+        download_verdicts.record(filename, verdict)
+    cancelled_downloads.clear(candidate_filename)
+    location = candidates[rank][0]
+    if location != None:
+        # update best oa location from successful alternative oa location
+        local_entry['best_oa_location'] = location
+
+def _politeness_host(url, config):
+    """
+    Host of a download for the politeness limits, None if the resource is not downloaded from its host
+    """
+    if url.find("arxiv.org") != -1 and _arxiv_mirror(config):
+        # downloaded from the arXiv mirror
+        return None
+    return url_host(url)
+
+def _candidate_slot(host, wait):
+    """
+    Take a politeness slot of the host of a candidate location, waiting at most wait seconds. Return the host
+    of the slot to be released after the download, None if the download has no host limits, or False if no 
+    slot is available
+    """
+    if host == None or download_scheduler == None:
+        return None
+    if download_scheduler.acquire(host, timeout=wait):
+        return host
+    return False
+
+def _release_slot(slot):
+    if slot != None:
+        download_scheduler.release(slot)
+
+class _HedgedDownload(object):
+    """
+    Hedged download of the candidate locations of an entry, shared by the download threads and the asyncio
+    engine, which run the candidates as futures of the hedge executor or as tasks of the event loop: the
+    next candidate is started when the running ones did not succeed after the hedging delay (or failed), up
+    to max_parallel candidates in flight. The first successful candidate wins, the other ones are cancelled
+    and their files removed.
+
+    The candidates are downloaded within the politeness limits of their host: a candidate from the host of
+    the dispatched download uses its slot if no other candidate uses it, the other candidates take a slot
+    of their host from the scheduler. A candidate waits for its slot while other candidates are running,
+    otherwise at most the hedging delay within the budget of the entry, and is skipped if no slot is
+    available, which also ends the waits of downloads holding the host slot of each other.
+    """
+
+    def __init__(self, url, filename, local_entry, config, hedging):
+        self.filename = filename
+        self.local_entry = local_entry
+        self.config = config
+        self.hedging = hedging
+        self.candidates = _candidate_locations(url, local_entry)
+        self.owner_host = _politeness_host(url, config)
+        # rank of the candidate using the slot of the dispatched download
+        self.owner_rank = None
+        # running candidates (futures or tasks) with their rank
+        self.pending = {}
+        self.next_rank = 0
+        self.winner = None
+
+    def is_running(self):
+        return self.winner == None and (self.next_rank < len(self.candidates) or len(self.pending) > 0)
+
+    def can_start(self):
+        return self.next_rank < len(self.candidates) and len(self.pending) < self.hedging["max_parallel"]
+
+    def slot_wait(self):
+        """
+        Maximum time to wait for the slot of the next candidate
+        """
+        if len(self.pending) > 0:
+            # the slot is checked again when a running candidate ends
+            return 0
+        remaining = cancelled_downloads.remaining(self.filename)
+        if remaining == None:
+            return self.hedging["delay"]
+        return min(self.hedging["delay"], remaining)
+
+    def take_slot(self, wait=0):
+        """
+        Take the politeness slot of the next candidate, see _candidate_slot
+        """
+        host = _politeness_host(self.candidates[self.next_rank][1], self.config)
+        if host != None and host == self.owner_host and self.owner_rank == None:
+            self.owner_rank = self.next_rank
+            return None
+        return _candidate_slot(host, wait)
+
+    def start(self, slot, run):
+        """
+        Start the next candidate with its slot, run(url, filename, slot) returning the future or task of its 
+        download. Return the time to wait for the running candidates before starting the next one (None for
+        no limit, 0 for starting it right away)
+        """
+        candidate_url = self.candidates[self.next_rank][1]
+        if slot == False:
+            if len(self.pending) > 0:
+                return HEDGE_SLOT_POLL
+            logging.info("Hedged download skipped for {0}: no download slot available for its host".format(candidate_url))
+            self.next_rank += 1
+            return 0
+        candidate_filename = _candidate_filename(self.filename, self.next_rank)
+        # the candidates share the budget of the entry
+        cancelled_downloads.set_deadline(candidate_filename, cancelled_downloads.deadline(self.filename))
+        self.pending[run(candidate_url, candidate_filename, slot)] = self.next_rank
+        self.next_rank += 1
+        if self.next_rank < len(self.candidates):
+            return _hedge_delay(candidate_url, self.hedging)
+        return None
+
+    def complete(self, future):
+        """
+        Take into account a finished candidate
+        """
+        rank = self.pending.pop(future)
+        if rank == self.owner_rank:
+            self.owner_rank = None
+        try:
+            result = future.result()
+        except Exception:
+            logging.exception("Hedged download failed for {0}".format(self.candidates[rank][1]))
+            result = FAIL_DOWNLOAD
+        if result == SUCCESS_DOWNLOAD and self.winner == None:
+            self.winner = rank
+        else:
+            _discard_candidate(_candidate_filename(self.filename, rank))
+
+    def finish(self):
+        """
+        Cancel the running candidates and keep the winning one, return the result of the hedged download
+        """
+        # the cancelled candidates end at their next chunk or download method
+        for future, rank in self.pending.items():
+            candidate_filename = _candidate_filename(self.filename, rank)
+            cancelled_downloads.cancel(candidate_filename)
+            future.add_done_callback(lambda _, candidate_filename=candidate_filename: _discard_candidate(candidate_filename))
+        if self.winner == None:
+            return FAIL_DOWNLOAD
+        _select_candidate(self.filename, self.candidates, self.winner, self.local_entry)
+        return SUCCESS_DOWNLOAD
+
+def _download_candidate(url, filename, config, slot):
+    try:
+        return _download_url(url, filename, config)
+    finally:
+        _release_slot(slot)
+
+def _download_hedged(url, filename, local_entry, config, hedging):
+    """
+    Hedged download of the candidate locations of an entry by the threads of the hedge executor (see
+    _HedgedDownload)
+    """
+    hedged = _HedgedDownload(url, filename, local_entry, config, hedging)
+    while hedged.is_running():
+        timeout = None
+        if hedged.can_start():
+            slot = hedged.take_slot(hedged.slot_wait())
+            timeout = hedged.start(slot, lambda candidate_url, candidate_filename, slot: 
+                hedge_executor.submit(_download_candidate, candidate_url, candidate_filename, config, slot))
+            if timeout == 0:
+                continue
+        done, _ = concurrent.futures.wait(hedged.pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            hedged.complete(future)
+    return hedged.finish()
+
+def _record_failure(filename, status_code=None, exception=None):
+    """
+    Record the failure of a download method, by HTTP status or exception
+    """
+    if status_code != None:
+        url_failures.record(filename, classify_status(status_code), status_code)
+    elif exception != None:
+        url_failures.record(filename, classify_exception(exception))
+
+def _download_cloudscraper(url, filename, n=0, timeout_in_seconds=None):
+    """
+    Use a cloudscraper session for downloading Cloudflare protected file, the sessions being pooled per host
+    (see scraper_sessions.py). 
     Header agant generation is managed by cloudscraper.
     Websites not using Cloudflare will be treated like normal requests call. 
 
     See https://github.com/VeNoMouS/cloudscraper for more options (e.g. proxy, captcha solver)
     """
-    #global scraper
     result = FAIL_DOWNLOAD
+    redirect_url = None
+    download_verdicts.discard(filename)
+    if timeout_in_seconds == None:
+        timeout_in_seconds = _request_timeout(url, filename)
     try:
-        scraper = cloudscraper.create_scraper(interpreter='nodejs')
-        file_data = scraper.get(url, timeout=timeout_in_seconds)
-        if file_data.status_code == 200:
-            if filename.endswith(".pdf"):
-                if file_data.text[:5] == '%PDF-':
-                    with open(filename, 'wb') as f_out:
-                        f_out.write(file_data.content)
-                        result = SUCCESS_DOWNLOAD
-                elif n < 5:
-                    soup = BeautifulSoup(file_data.text, 'html.parser')
-                    if soup.select_one('a#redirect'):
-                        redirect_url = soup.select_one('a#redirect')['href']
-                        logging.debug('Waiting 5 seconds before following redirect url')
-                        sleep(5)
-                        logging.debug(f'Retry number {n + 1}')
-                        return _download_cloudscraper(redirect_url, filename, n=n+1, timeout_in_seconds=timeout_in_seconds)
-            else:
-                with open(filename, 'wb') as f_out:
-                    f_out.write(file_data.content)
-                    result = SUCCESS_DOWNLOAD
-    except Exception:
+        # the scraper of the host is reused with its Cloudflare clearance, if not expired
+        with scraper_sessions.session(url_host(url)) as scraper:
+            network_governor.throttle(REQUESTS_PER_SECOND)
+            with scraper.get(url, timeout=timeout_in_seconds, stream=True) as file_data:
+                if file_data.status_code == 200:
+                    result, status, head = _stream_download(file_data, url, filename)
+                    if status == STREAM_REJECTED and filename.endswith(".pdf") and n < 5:
+                        # possibly a landing page redirecting to the PDF
+                        page = read_content(file_data, head, max_size=MAX_LANDING_PAGE_SIZE)
+                        soup = BeautifulSoup(page, 'html.parser')
+                        if soup.select_one('a#redirect'):
+                            redirect_url = soup.select_one('a#redirect')['href']
+                else:
+                    _record_failure(filename, status_code=file_data.status_code)
+    except Exception as e:
         logging.exception("Download failed for {0} with cloudscraper".format(url))
+        _record_failure(filename, exception=e)
+
+    if redirect_url != None:
+        # followed once the scraper is released, the redirection possibly going to the same host
+        logging.debug('Waiting 5 seconds before following redirect url')
+        time.sleep(5)
+        if cancelled_downloads.is_cancelled(filename):
+            return result
+        logging.debug(f'Retry number {n + 1}')
+        return _download_cloudscraper(redirect_url, filename, n=n+1, timeout_in_seconds=timeout_in_seconds)
     
     return result
 
@@ -1319,11 +1920,17 @@ def _download_wget(url, filename):
     The drawback of wget is the compression support. It is uncertain depending on the linux distribution 
     (https://unix.stackexchange.com/a/464375) and experimental. So in the following, we keep compression disable and we
     manage the decompression in a second step after checking the mime type of the downloaded file.
+    Now only used as last fallback if wget_fallback is set in the config, see _download_native.
     """
     result = FAIL_DOWNLOAD
+    # the process is bounded by the remaining budget of the entry
+    process_timeout = 100
+    remaining = cancelled_downloads.remaining(filename)
+    if remaining != None:
+        process_timeout = max(1, min(process_timeout, remaining))
     # This is the most robust and reliable way to download files I found with Python... to rely on system wget :)
     #cmd = "wget -c --quiet" + " -O " + filename + ' --connect-timeout=10 --waitretry=10 ' + \
-    cmd = "wget -c --quiet" + " -O " + filename + ' --timeout=20 --waitretry=0 --tries=4 ' + \
+    cmd = "wget -c --quiet" + " -O " + filename + ' --timeout=' + str(int(_request_timeout(url, filename))) + ' --waitretry=0 --tries=4 ' + \
         '--header="User-Agent: ' + _get_random_user_agent()+ '" ' + \
         '--header="Accept: application/pdf, text/html;q=0.9,*/*;q=0.8" --header="Accept-Encoding: gzip, deflate" ' + \
         '--no-check-certificate ' + \
@@ -1331,7 +1938,8 @@ def _download_wget(url, filename):
     #'--compression=auto ' + \
 
     try:
-        result = subprocess.check_call(cmd, shell=True, timeout=100)
+        network_governor.throttle(REQUESTS_PER_SECOND)
+        result = subprocess.check_call(cmd, shell=True, timeout=process_timeout)
 
         # if the used version of wget does not decompress automatically, the following ensures it is done
         result_compression = _check_compression(filename)
@@ -1362,22 +1970,227 @@ def _download_wget(url, filename):
 
     return str(result)
 
+def _download_native(url, filename, size_limit=True):
+    """
+    Download with the native downloader, with retries and resume of the interrupted transfers, via the
+    pooled ftplib sessions for the FTP URLs. Used for the FTP resources and as the more robust fallback of the HTTP downloads.
+    """
+    global global_config
+
+    tries = DEFAULT_TRIES
+    if global_config != None and "download_tries" in global_config and global_config["download_tries"]:
+        tries = global_config["download_tries"]
+    max_size = _max_download_size(global_config) if size_limit else None
+    result = FAIL_DOWNLOAD
+    download_verdicts.discard(filename)
+    on_failure = lambda status_code, exception: _record_failure(filename, status_code, exception)
+    try:
+        if str(url).startswith("ftp"):
+            status, kind, _ = download_ftp(url, filename, tries=tries, timeout=_request_timeout(url, filename), 
+                accepted=expected_kinds(filename), max_size=max_size, on_failure=on_failure, sessions=ftp_sessions)
+        else:
+            HEADERS = {"""User-Agent""": _get_random_user_agent(), 
+                       """Accept""": "application/pdf, text/html;q=0.9,*/*;q=0.8"}
+            status, kind, _ = download_http(http_sessions.get, url, filename, headers=HEADERS, tries=tries, 
+                timeout=_request_timeout(url, filename), accepted=expected_kinds(filename), max_size=max_size, 
+                on_failure=on_failure)
+        if status != None:
+            result = _check_streamed_download(url, filename, status, kind)
+    except Exception as e:
+        logging.exception("Download failed for {0} with the native downloader".format(url))
+        _record_failure(filename, exception=e)
+    return result
+
+def _download_fallback(url, filename, size_limit=True):
+    """
+    Last download method of a URL: the native downloader, then wget only if wget_fallback is set in the
+    config
+    """
+    global global_config
+
+    result = _download_native(url, filename, size_limit=size_limit)
+    if result != SUCCESS_DOWNLOAD and global_config != None and "wget_fallback" in global_config and global_config["wget_fallback"]:
+        result = _download_wget(url, filename)
+    return result
+
 def _download_requests(url, filename):
     """ 
-    Download with Python requests which handle well compression, but not very robust and bad parallelization
+    Download with Python requests which handle well compression, but not very robust. The response is streamed
+    to the file, and aborted early if it is not of the expected type (e.g. HTML landing page instead of a PDF)
+    or if it is too large.
     """
     HEADERS = {"""User-Agent""": _get_random_user_agent()}
     result = FAIL_DOWNLOAD
+    download_verdicts.discard(filename)
     try:
-        file_data = requests.get(url, allow_redirects=True, headers=HEADERS, verify=False, timeout=20)
-        if file_data.status_code == 200:
-            with open(filename, 'wb') as f_out:
-                f_out.write(file_data.content)
-            result = SUCCESS_DOWNLOAD
-    except Exception:
+        start_time = time.monotonic()
+        with http_sessions.get(url, allow_redirects=True, headers=HEADERS, verify=False, timeout=_request_timeout(url, filename), stream=True) as file_data:
+            _record_latency(url, start_time)
+            if file_data.status_code == 200:
+                result, _, _ = _stream_download(file_data, url, filename)
+            else:
+                _record_failure(filename, status_code=file_data.status_code)
+    except Exception as e:
         logging.exception("Download failed for {0} with requests".format(url))
+        _record_failure(filename, exception=e)
+    return result
+
+def _stream_download(response, url, filename):
+    """
+    Write a streamed response to the target file, return the download result, the streaming status and
+    the first bytes of the response
+    """
+    status, kind, head = stream_response(response, filename, accepted=expected_kinds(filename), max_size=_max_download_size(global_config))
+    return _check_streamed_download(url, filename, status, kind), status, head
+
+def _is_download_success(result):
+    return result[0] is None or result[0] == "0" or result[0] == SUCCESS_DOWNLOAD
+
+def _check_streamed_download(url, filename, status, kind):
+    """
+    Return the download result of a streamed file, decompressing it or recording its type if needed
+    """
+    if status != STREAM_SUCCESS:
+        logging.info("Download aborted for {0}: {1}, type {2}".format(url, status, kind))
+        if status != STREAM_CANCELLED:
+            url_failures.record(filename, classify_stream(status, kind))
+        return FAIL_DOWNLOAD
+
+    if kind == 'gzip' and filename.endswith(".pdf"):
+        # compressed PDF, decompressed as for the files downloaded with wget
+        if not _check_compression(filename):
+            if os.path.isfile(filename):
+                os.remove(filename)
+            return FAIL_DOWNLOAD
+    elif kind == 'pdf':
+        download_verdicts.record(filename, kind)
+    return SUCCESS_DOWNLOAD
+
+async def _download_async(engine, url, filename, local_entry, config=None):
+    """
+    Version of _download for the asyncio download engine, with the same download methods and fallbacks.
+    The HTTP downloads are performed in the event loop, the other download methods (mirrors, FTP, 
+    cloudscraper, native and wget fallbacks) and the decompressions are run in the executor of the engine.
+    """
+    if config == None:
+        config = global_config
+
+    # downloads involving the arXiv or PLOS mirrors are entirely managed by the blocking version
+    if (url.find("arxiv.org") != -1 and config != None and _arxiv_mirror(config)) or (url.find("plos.org") != -1 and config != None and _plos_mirror(config)):
+        return await engine.run_blocking(_download, url, filename, local_entry, config)
+
+    if entry_budget != None:
+        entry_budget.start(filename)
+    try:
+        hedging = _hedging_config(config)
+        if hedging != None:
+            result = await _download_hedged_async(engine, url, filename, local_entry, config, hedging)
+        else:
+            result = await _download_url_async(engine, url, filename, config)
+
+            if result != SUCCESS_DOWNLOAD:
+                # look for alternative url if present in the entry
+                if "alternative_oa_locations" in local_entry:
+                    for alternative_oa_location in local_entry['alternative_oa_locations']:
+                        if "url_for_pdf" in alternative_oa_location and alternative_oa_location["url_for_pdf"] and len(alternative_oa_location["url_for_pdf"])>0:
+                            result = await _download_url_async(engine, alternative_oa_location["url_for_pdf"], filename, config)
+                            if result == SUCCESS_DOWNLOAD:
+                                # update best oa location from successful alternative oa location
+                                local_entry['best_oa_location'] = alternative_oa_location
+                                break
+    finally:
+        _finish_budget(url, filename)
+
+    if os.path.isfile(filename) and filename.endswith(".tar.gz"):
+        await engine.run_blocking(_manage_pmc_archives, filename)
+
+    return result, local_entry
+
+async def _download_hedged_async(engine, url, filename, local_entry, config, hedging):
+    """
+    Version of _download_hedged for the asyncio download engine, the candidates being raced as tasks of
+    the event loop
+    """
+    hedged = _HedgedDownload(url, filename, local_entry, config, hedging)
+    while hedged.is_running():
+        timeout = None
+        if hedged.can_start():
+            # the event loop is not blocked while waiting for the host slot, which is polled
+            wait = hedged.slot_wait()
+            deadline = time.monotonic() + wait
+            slot = hedged.take_slot()
+            while slot == False and time.monotonic() < deadline:
+                await asyncio.sleep(HEDGE_SLOT_POLL)
+                slot = hedged.take_slot()
+            timeout = hedged.start(slot, lambda candidate_url, candidate_filename, slot: 
+                asyncio.ensure_future(_download_candidate_async(engine, candidate_url, candidate_filename, config, slot)))
+            if timeout == 0:
+                continue
+        done, _ = await asyncio.wait(hedged.pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            hedged.complete(task)
+    return hedged.finish()
+
+async def _download_candidate_async(engine, url, filename, config, slot):
+    try:
+        return await _download_url_async(engine, url, filename, config)
+    finally:
+        _release_slot(slot)
+
+async def _download_url_async(engine, url, filename, config):
+    """
+    Download one URL with the successive download methods, as _download_url
+    """
+    # the FTP URLs are only downloaded by the native downloader, aiohttp does not support FTP
+    download = _UrlDownload(url, filename, config, ftp_methods=[NATIVE])
+    if not download.allowed():
+        return FAIL_DOWNLOAD
+    try:
+        for rank, strategy in download.strategies():
+            if strategy == CLOUDSCRAPER:
+                result = await engine.run_blocking(_download_cloudscraper, url, filename)
+            elif strategy == REQUESTS:
+                result = await _download_aiohttp(engine, url, filename)
+            else:
+                result = await engine.run_blocking(_download_fallback, url, filename)
+            if download.record(rank, strategy, result):
+                break
+    finally:
+        download.finish()
+    return download.result
+
+async def _download_aiohttp(engine, url, filename):
+    """
+    Asynchronous version of _download_requests
+    """
+    HEADERS = {"""User-Agent""": _get_random_user_agent()}
+    result = FAIL_DOWNLOAD
+    download_verdicts.discard(filename)
+    try:
+        status, kind, head = await engine.stream(url, filename, headers=HEADERS, accepted=expected_kinds(filename), 
+            max_size=_max_download_size(global_config), timeout=_request_timeout(url, filename), 
+            total=cancelled_downloads.remaining(filename),
+            on_failure=lambda status_code, exception: _record_failure(filename, status_code, exception),
+            on_response=lambda latency: host_timeouts.record(url_host(url), latency) if host_timeouts != None else None)
+        if status != None:
+            if kind == 'gzip':
+                # decompression in the executor
+                result = await engine.run_blocking(_check_streamed_download, url, filename, status, kind)
+            else:
+                result = _check_streamed_download(url, filename, status, kind)
+    except Exception as e:
+        logging.exception("Download failed for {0} with aiohttp".format(url))
+        _record_failure(filename, exception=e)
     return result
 
+def _max_download_size(config):
+    """
+    Maximum size in bytes of a downloaded file, None if not limited
+    """
+    if config != None and "max_download_size" in config and config["max_download_size"]:
+        return int(config["max_download_size"] * 1024 * 1024)
+    return None
+
 def _download_arxiv(url, filename, local_entry, config= None):
     global biblio_glutton_url
     global crossref_base
@@ -1556,6 +2369,15 @@ def _download_plos_extra(url, filename, local_entry, config=None):
             '''
     return result, local_entry
 
+def _compression_suffix(filename):
+    """
+    Suffix of a stored file for its compression, empty if the file is not compressed (compression disabled,
+    or failed for this file)
+    """
+    if filename.endswith(".gz"):
+        return ".gz"
+    return ""
+
 def _check_compression(file):
     '''
     Check if a file is GZIP compressed, if yes decompress and replace by the decompressed version.
@@ -1911,6 +2733,8 @@ if __name__ == "__main__":
     parser.add_argument("--reset", action="store_true", help="ignore previous processing states, clear the existing storage and re-init the harvesting process from the beginning") 
     parser.add_argument("--thumbnail", action="store_true", help="generate thumbnail files for the front page of the PDF") 
     parser.add_argument("--sample", type=int, default=None, help="Harvest only a random sample of indicated size")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible random samples with --sample")
+    parser.add_argument("--strategies", action="store_true", help="print the download methods learned per host") 
 
     args = parser.parse_args()
 
@@ -1922,6 +2746,8 @@ if __name__ == "__main__":
     dump = args.dump
     thumbnail = args.thumbnail
     sample = args.sample
+    seed = args.seed
+    strategies = args.strategies
 
     config = _load_config(config_path)
 
@@ -1934,8 +2760,18 @@ if __name__ == "__main__":
         crossref_base = config["metadata"]["crossref_base"]
     if "metadata" in config and "crossref_email" in config["metadata"] and config["metadata"]["crossref_email"] and len(config["metadata"]["crossref_email"].strip())>0:
         crossref_email = config["metadata"]["crossref_email"]
-
-    harvester = OAHarvester(config=config, thumbnail=thumbnail, sample=sample)
+    if "metadata" in config and "biblio_glutton_concurrency" in config["metadata"] and config["metadata"]["biblio_glutton_concurrency"]:
+        biblio_glutton_slots = threading.BoundedSemaphore(config["metadata"]["biblio_glutton_concurrency"])
+    if "metadata" in config and "crossref_concurrency" in config["metadata"] and config["metadata"]["crossref_concurrency"]:
+        crossref_slots = threading.BoundedSemaphore(config["metadata"]["crossref_concurrency"])
+    http_sessions = SessionPool.from_config(config)
+    scraper_sessions = ScraperPool.from_config(config, _create_scraper)
+    ftp_sessions = FtpSessionPool.from_config(config)
+    host_timeouts = HostTimeouts.from_config(config)
+    entry_budget = EntryBudget.from_config(config)
+    network_governor.configure(config)
+
+    harvester = OAHarvester(config=config, thumbnail=thumbnail, sample=sample, sample_seed=seed)
 
     if reset:
         if input("\nYou asked to reset the existing harvesting, this will removed all the already downloaded data files and reinitialize the harvesting from the beginning... are you sure? (y/n) ") == "y":
@@ -1952,6 +2788,9 @@ if __name__ == "__main__":
         harvester.harvestPMC(pmc, reprocess)
         harvester.diagnostic()
 
+    if strategies and download_strategies != None:
+        download_strategies.report(nb_hosts=None)
+
     runtime = round(time.time() - start_time, 3)
     print("runtime: %s seconds " % (runtime))
 
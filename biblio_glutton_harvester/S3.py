@@ -2,6 +2,8 @@ import os
 from boto3 import client
 import botocore
 
+from biblio_glutton_harvester.governor import network_governor
+
 # logging
 import logging
 import logging.handlers
@@ -40,7 +42,8 @@ class S3(object):
     def upload_file_to_s3(self, file_path, dest_path=None, storage_class='STANDARD_IA'):
         """
         Upload the given file to s3 using a managed uploader, which will split up large
-        files automatically and upload parts in parallel.
+        files automatically and upload parts in parallel, within the upload bandwidth of the
+        process.
         By default, files are stored with the class standard infrequent access. 
         Possible storage classes are: STANDARD, STANDARD_IA, REDUCED_REDUNDANCY or ONEZONE_IA
         """
@@ -54,7 +57,8 @@ class S3(object):
         else:
             full_path = file_name
         try:
-            s3_client.upload_file(file_path, self.bucket_name, full_path, ExtraArgs={"Metadata": {"StorageClass": storage_class}})
+            s3_client.upload_file(file_path, self.bucket_name, full_path, ExtraArgs={"Metadata": {"StorageClass": storage_class}},
+                Callback=network_governor.upload_callback)
         except:
             logging.error('Could not upload file ' + file_path)    
 
@@ -85,7 +89,7 @@ class S3(object):
         if not os.path.exists(dir_name):
             os.makedirs(dir_name)
         try:
-            s3_client.download_file(self.bucket_name, file_path, dest_path)
+            s3_client.download_file(self.bucket_name, file_path, dest_path, Callback=network_governor.download_callback)
         except Exception:
             logging.exception("Could not download file: " + file_path)
             return None
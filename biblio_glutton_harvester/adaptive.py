@@ -0,0 +1,160 @@
+'''
+Adaptive concurrency of the harvesting stages.
+
+The best number of concurrent downloads and uploads differs a lot between sources (a single FTP server
+for PMC, thousands of publisher hosts for Unpaywall) and over time. Instead of fixed worker counts, an
+AIMD controller (additive increase, multiplicative decrease, as for TCP congestion control) adjusts the
+number of tasks in flight of a stage, within configured bounds:
+
+- after each window of completed tasks, if the stage shows signs of congestion, the limit is multiplied
+  by a decrease factor, otherwise it is increased by one if it has been reached during the window,
+
+- the congestion signs are a latency growing beyond a tolerance of the baseline latency, a failure rate
+  growing beyond the usual failure rate of the stage, and the local saturation: CPU load, or the next
+  stage not keeping up (e.g. disk writes and uploads slower than the downloads).
+
+The baseline latency and the usual failure rate are moving averages, so that the limit keeps adapting
+to the changes of the remote servers during the harvesting.
+'''
+
+import os
+import threading
+import statistics
+
+# minimum number of completed tasks for adjusting the limit
+MIN_WINDOW = 10
+
+class AdaptiveLimit(object):
+    """
+    Thread-safe AIMD limit of the number of tasks in flight: acquire() before a task, release() after it
+    with its latency and whether it failed
+    """
+
+    def __init__(self, name, initial, minimum, maximum, decrease=0.75, latency_tolerance=2.0,
+                 failure_margin=0.15, cpu_threshold=1.0, saturated=None):
+        self.name = name
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease = decrease
+        # congestion when the latency exceeds this factor of the baseline latency
+        self.latency_tolerance = latency_tolerance
+        # congestion when the failure rate exceeds the usual failure rate by this margin
+        self.failure_margin = failure_margin
+        # local saturation when the load average per CPU exceeds this threshold
+        self.cpu_threshold = cpu_threshold
+        # optional function indicating that the next stage is saturated
+        self.saturated = saturated
+
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self._latencies = []
+        self._failures = 0
+        self._limit_reached = False
+        self.baseline_latency = None
+        self.usual_failure_rate = None
+
+        self.nb_increases = 0
+        self.nb_decreases = 0
+        self.lowest = self.limit
+        self.highest = self.limit
+
+    @classmethod
+    def from_config(cls, name, config, initial, upper=None, saturated=None):
+        """
+        Create the limit from a config section with min and max bounds, None if the section is not set,
+        the max bound being optionally capped by upper
+        """
+        if not config:
+            return None
+        minimum = config["min"] if "min" in config and config["min"] else 1
+        maximum = config["max"] if "max" in config and config["max"] else max(initial, minimum)
+        if upper != None:
+            maximum = min(maximum, upper)
+            minimum = min(minimum, maximum)
+        return cls(name, initial, minimum, maximum, saturated=saturated)
+
+    def current(self):
+        return int(self.limit)
+
+    def acquire(self):
+        """
+        Wait until a new task can be started
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            if self.in_flight >= int(self.limit):
+                self._limit_reached = True
+
+    def release(self, latency=None, failed=False):
+        """
+        Record the end of a task, and adjust the limit at the end of a window
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if latency != None:
+                self._latencies.append(latency)
+            if failed:
+                self._failures += 1
+            if len(self._latencies) >= max(MIN_WINDOW, int(self.limit)):
+                self._adjust()
+            self._cond.notify_all()
+
+    def cancel(self):
+        """
+        Release a slot acquired for a task which has not been started
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _adjust(self):
+        nb_tasks = len(self._latencies)
+        latency = statistics.median(self._latencies)
+        failure_rate = self._failures / nb_tasks
+
+        congested = self._local_saturation()
+        if self.baseline_latency != None and latency > self.latency_tolerance * self.baseline_latency:
+            congested = True
+        if self.usual_failure_rate != None and failure_rate > self.usual_failure_rate + self.failure_margin:
+            congested = True
+
+        if congested:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self.nb_decreases += 1
+        elif self._limit_reached and self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + 1)
+            self.nb_increases += 1
+        self.lowest = min(self.lowest, self.limit)
+        self.highest = max(self.highest, self.limit)
+
+        # the baseline follows immediately a lower latency, and slowly a higher one
+        if self.baseline_latency == None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency = 0.9 * self.baseline_latency + 0.1 * latency
+        if self.usual_failure_rate == None:
+            self.usual_failure_rate = failure_rate
+        else:
+            self.usual_failure_rate = 0.9 * self.usual_failure_rate + 0.1 * failure_rate
+
+        self._latencies = []
+        self._failures = 0
+        self._limit_reached = False
+
+    def _local_saturation(self):
+        if self.saturated != None and self.saturated():
+            return True
+        if hasattr(os, "getloadavg"):
+            try:
+                if os.getloadavg()[0] / (os.cpu_count() or 1) > self.cpu_threshold:
+                    return True
+            except OSError:
+                pass
+        return False
+
+    def report(self):
+        print("adaptive concurrency of", self.name + ":", self.current(), "(between", int(self.lowest), "and",
+            int(self.highest), "during the harvesting,", self.nb_increases, "increases,", self.nb_decreases, "decreases)")
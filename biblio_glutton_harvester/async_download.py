@@ -0,0 +1,181 @@
+'''
+Asynchronous download engine, as an alternative to the download thread pool of the harvesting pipeline.
+
+With the thread pool, each download holds a thread for its whole duration, possibly minutes for a slow
+host, so the number of downloads in flight is limited to the number of download threads. This engine
+runs the HTTP downloads as coroutines of a single event loop, so that thousands of downloads can be in
+flight at the same time. The blocking work (mirrors, FTP, cloudscraper and wget fallbacks, decompression
+of the downloaded files) is delegated to a thread pool executor, and the validation remains done by the
+commit stage of the pipeline.
+
+The engine requires aiohttp (pip install aiohttp), and is selected in the config file with:
+
+    download_engine: asyncio
+    async_concurrency: 1000
+'''
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from biblio_glutton_harvester.governor import network_governor, DOWNLOAD, REQUESTS
+from biblio_glutton_harvester.download_stream import StreamWriter, too_large, CHUNK_SIZE, STREAM_TOO_LARGE
+
+DEFAULT_CONCURRENCY = 1000
+DEFAULT_BLOCKING_WORKERS = 12
+DEFAULT_CONNECTIONS_PER_HOST = 8
+
+class AsyncDownloadEngine(object):
+    """
+    Download stage of the harvesting pipeline running the download coroutines in an event loop thread.
+    download(engine, url, filename, entry) is the coroutine downloading an entry and returning its
+    (status, entry) pair, it can use the HTTP session of the engine via stream() and the executor via
+    run_blocking().
+    """
+
+    def __init__(self, download, concurrency=DEFAULT_CONCURRENCY, blocking_workers=DEFAULT_BLOCKING_WORKERS,
+                 connections_per_host=DEFAULT_CONNECTIONS_PER_HOST, stats=None):
+        if aiohttp == None:
+            raise ImportError("the asyncio download engine requires aiohttp, install it with: pip install aiohttp")
+        self.download = download
+        self.concurrency = max(concurrency, 1)
+        self.connections_per_host = connections_per_host
+        # optional ConnectionStats for reporting the connection reuse rates
+        self.stats = stats
+        self.executor = ThreadPoolExecutor(max_workers=max(blocking_workers, 1))
+        # the results are passed to the next stage in a separate thread, as this might block
+        self._delivery = ThreadPoolExecutor(max_workers=1)
+        self.loop = None
+        self.session = None
+        self.limit = None
+        self.is_success = None
+
+    def start(self, scheduler, deliver, fail, limit=None, is_success=None):
+        """
+        Start the engine on the tasks of the scheduler, deliver(position, result) being called with the
+        result of each download and fail(stage, position) in case of exception. The number of downloads
+        in flight is optionally adjusted by an AdaptiveLimit, is_success(result) indicating if a download
+        succeeded. Return the threads of the engine, which end when the scheduler is closed and all its 
+        tasks are processed.
+        """
+        self.limit = limit
+        self.is_success = is_success
+        self.loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=self.loop.run_forever, name="download-loop", daemon=True)
+        loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self._open_session(), self.loop).result()
+        feeder_thread = threading.Thread(target=self._feed, args=(scheduler, deliver, fail), name="download-feeder", daemon=True)
+        feeder_thread.start()
+        return [feeder_thread, loop_thread]
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.connections_per_host, ssl=False)
+        trace_configs = []
+        if self.stats != None:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(self._on_request_start)
+            trace_config.on_connection_create_end.append(self._on_connection_create_end)
+            trace_configs.append(trace_config)
+        self.session = aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+
+    async def _on_request_start(self, session, context, params):
+        context.host = params.url.host
+        self.stats.add_request(context.host)
+
+    async def _on_connection_create_end(self, session, context, params):
+        self.stats.add_connection(getattr(context, "host", None))
+
+    def _feed(self, scheduler, deliver, fail):
+        # a slot is taken for each download in flight
+        slots = threading.BoundedSemaphore(self.concurrency)
+        while True:
+            slots.acquire()
+            if self.limit != None:
+                self.limit.acquire()
+            scheduled = scheduler.get()
+            if scheduled is None:
+                if self.limit != None:
+                    self.limit.cancel()
+                slots.release()
+                break
+            asyncio.run_coroutine_threadsafe(self._run(scheduled, scheduler, deliver, fail, slots), self.loop)
+
+        # wait for the downloads in flight, then stop the event loop
+        for _ in range(self.concurrency):
+            slots.acquire()
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=True)
+        self._delivery.shutdown(wait=True)
+
+    async def _close(self):
+        # the background tasks started by the downloads (e.g. cancelled hedged downloads) end before the session
+        current_task = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current_task]
+        if len(tasks) > 0:
+            await asyncio.wait(tasks)
+        await self.session.close()
+
+    async def _run(self, scheduled, scheduler, deliver, fail, slots):
+        host, (position, url, filename, entry) = scheduled
+        start_time = time.monotonic()
+        failed = True
+        try:
+            try:
+                result = await self.download(self, url, filename, entry)
+                failed = self.is_success != None and not self.is_success(result)
+            finally:
+                scheduler.release(host)
+                if self.limit != None:
+                    self.limit.release(time.monotonic() - start_time, failed)
+            await self.loop.run_in_executor(self._delivery, deliver, position, result)
+        except Exception:
+            fail("download", position)
+        finally:
+            slots.release()
+
+    async def run_blocking(self, func, *args):
+        """
+        Run a blocking function in the executor of the engine
+        """
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def stream(self, url, filename, headers=None, accepted=None, max_size=None, timeout=20, total=None, on_failure=None,
+                     on_response=None):
+        """
+        Download a URL into a file as download_stream.stream_response(), return the status of the download
+        (None if the HTTP status is not 200, on_failure(status_code, None) being then optionally called),
+        the sniffed type of the response and its first bytes. The optional total is the maximum duration of
+        the whole download, on_response(latency) is optionally called with the time until the response.
+        """
+        client_timeout = aiohttp.ClientTimeout(total=total, sock_connect=timeout, sock_read=timeout)
+        # within the request rate and download bandwidth of the process, without blocking the event loop
+        delay = network_governor.delay(REQUESTS)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        start_time = time.monotonic()
+        async with self.session.get(url, headers=headers, allow_redirects=True, timeout=client_timeout) as response:
+            if on_response != None:
+                on_response(time.monotonic() - start_time)
+            if response.status != 200:
+                if on_failure != None:
+                    on_failure(response.status, None)
+                return None, None, b''
+            if too_large(response.headers, max_size):
+                return STREAM_TOO_LARGE, None, b''
+            with StreamWriter(filename, accepted=accepted, max_size=max_size) as writer:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if not writer.write(chunk):
+                        break
+                    delay = network_governor.delay(DOWNLOAD, len(chunk))
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    writer.finish()
+            return writer.status, writer.kind, writer.head
@@ -0,0 +1,137 @@
+'''
+In-process gzip compression of the harvested files before their storage.
+
+With compression enabled, every stored entry has up to nine files to compress (PDF, NLM, JATS, TEI, metadata
+JSON, software JSON and the three thumbnails). Forking a gzip process for each of them, one after the other
+in the storage thread, costs a process creation per file and leaves the other cores idle while the entry
+waits. Here the files are compressed with zlib in a dedicated pool of threads sized to the number of cores
+(zlib and hashlib release the GIL on large buffers), the files of an entry being compressed in parallel
+while the other storage threads keep uploading.
+
+The result is a normal gzip file replacing the original file, as with `gzip -f`. The size and the SHA-256
+checksum of the compressed file are computed while writing it, to be recorded in the metadata of the entry.
+'''
+
+import os
+import time
+import zlib
+import hashlib
+import logging
+import threading
+import concurrent.futures
+
+# same default level as the gzip command
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# size of the chunks read from the file to compress
+CHUNK_SIZE = 1024 * 1024
+
+def compress_file(filepath, level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    Compress the file into filepath + ".gz" and remove it, return the size of the original file, and the
+    size and the SHA-256 checksum of the compressed file
+    """
+    compressed_filepath = filepath + ".gz"
+    # wbits 31 for a gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    checksum = hashlib.sha256()
+    size = 0
+    compressed_size = 0
+    try:
+        with open(filepath, 'rb') as input_file, open(compressed_filepath, 'wb') as output_file:
+            while True:
+                chunk = input_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                data = compressor.compress(chunk)
+                if data:
+                    checksum.update(data)
+                    compressed_size += len(data)
+                    output_file.write(data)
+            data = compressor.flush()
+            checksum.update(data)
+            compressed_size += len(data)
+            output_file.write(data)
+    except BaseException:
+        if os.path.isfile(compressed_filepath):
+            os.remove(compressed_filepath)
+        raise
+    os.remove(filepath)
+    return size, compressed_size, checksum.hexdigest()
+
+class FileCompressor(object):
+    """
+    Pool of threads compressing the files to be stored, shared by the storage threads
+    """
+
+    def __init__(self, level=DEFAULT_COMPRESSION_LEVEL, workers=None):
+        self.level = level
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="compression")
+        self._lock = threading.Lock()
+        self.nb_files = 0
+        self.nb_failures = 0
+        self.total_size = 0
+        self.total_compressed_size = 0
+        self.total_time = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the compressor from the compression parameters of the configuration, None if the compression
+        is disabled
+        """
+        if not ("compression" in config and config["compression"]):
+            return None
+        level = DEFAULT_COMPRESSION_LEVEL
+        if "compression_level" in config and config["compression_level"] != None:
+            level = config["compression_level"]
+        workers = None
+        if "compression_workers" in config and config["compression_workers"]:
+            workers = config["compression_workers"]
+        return cls(level=level, workers=workers)
+
+    def _compress(self, filepath):
+        start = time.monotonic()
+        size, compressed_size, checksum = compress_file(filepath, self.level)
+        with self._lock:
+            self.nb_files += 1
+            self.total_size += size
+            self.total_compressed_size += compressed_size
+            self.total_time += time.monotonic() - start
+        return compressed_size, checksum
+
+    def compress(self, filepaths):
+        """
+        Compress in parallel the existing files among filepaths, return a map of the compressed files with
+        their compressed path, size and checksum. A file which cannot be compressed is left unchanged.
+        """
+        futures = {}
+        for filepath in filepaths:
+            if filepath != None and os.path.isfile(filepath):
+                futures[filepath] = self.executor.submit(self._compress, filepath)
+        compressed = {}
+        for filepath, future in futures.items():
+            try:
+                compressed_size, checksum = future.result()
+                compressed[filepath] = {
+                    "path": filepath + ".gz",
+                    "size": compressed_size,
+                    "sha256": checksum
+                }
+            except Exception:
+                logging.exception("error compressing " + filepath)
+                with self._lock:
+                    self.nb_failures += 1
+        return compressed
+
+    def report(self):
+        with self._lock:
+            if self.nb_files == 0 and self.nb_failures == 0:
+                return
+            ratio = self.total_compressed_size / self.total_size if self.total_size > 0 else 1.0
+            print("compressed files:", self.nb_files, "- failures:", self.nb_failures, "- compressed size:",
+                str(round(self.total_compressed_size / (1024 * 1024), 1)) + "MB", "/", str(round(self.total_size / (1024 * 1024), 1)) + "MB",
+                "(" + str(round(ratio * 100, 1)) + "%)", "- cumulated compression time:", str(round(self.total_time, 1)) + "s",
+                "with", self.workers, "threads")
@@ -0,0 +1,158 @@
+'''
+Time limits of the downloads: a wall-clock budget per entry and adaptive timeouts per host.
+
+A failing entry goes through all the download methods (cloudscraper, requests, native downloader with its
+retries, wget) for each of its OA locations, each method with its own timeouts, so that a single entry can
+keep a download worker busy for minutes. The download of an entry has a deadline, shared by all its
+download methods and locations: the target files of the entry are registered with the deadline in
+cancelled_downloads (download_stream.py), so that the downloads are cancelled when it is passed (at the
+next chunk, retry or download method), and the timeout of every request is bounded by the remaining time.
+
+The timeout of a request is also adapted to its host, from the percentiles of the latencies observed for
+the host (time until the response headers): fast hosts fail fast, the known slow repositories get more
+time, within configured bounds.
+'''
+
+import time
+import threading
+from collections import deque
+
+from biblio_glutton_harvester.download_stream import cancelled_downloads
+
+# default timeout in seconds of a request, when the latency of the host is not known
+DEFAULT_TIMEOUT = 20
+
+# default bounds of the adaptive timeouts, in seconds
+DEFAULT_MIN_TIMEOUT = 5
+DEFAULT_MAX_TIMEOUT = 60
+
+# the timeout of a host is factor times the percentile of its recent latencies
+DEFAULT_FACTOR = 3
+DEFAULT_PERCENTILE = 95
+
+# number of recent latencies kept per host, and minimum number of latencies for adapting the timeout
+DEFAULT_WINDOW = 50
+DEFAULT_MIN_SAMPLES = 5
+
+class EntryBudget(object):
+    """
+    Wall-clock budget in seconds of the download of an entry
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        self.nb_entries = 0
+        self.nb_exhausted = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the budget from the entry_budget parameter of the configuration, None if not set
+        """
+        if "entry_budget" in config and config["entry_budget"]:
+            return cls(config["entry_budget"])
+        return None
+
+    def start(self, filename):
+        """
+        Start the budget of the download of an entry into filename
+        """
+        cancelled_downloads.set_deadline(filename, time.monotonic() + self.seconds)
+
+    def finish(self, filename):
+        """
+        End of the download of an entry, return True if its budget has been exhausted
+        """
+        exhausted = cancelled_downloads.is_cancelled(filename)
+        cancelled_downloads.clear(filename)
+        with self._lock:
+            self.nb_entries += 1
+            if exhausted:
+                self.nb_exhausted += 1
+        return exhausted
+
+    def report(self):
+        with self._lock:
+            if self.nb_entries == 0:
+                return
+            print("entries with exhausted download budget (" + str(self.seconds) + "s):", self.nb_exhausted, "/", self.nb_entries)
+
+def percentile(values, rank):
+    """
+    Percentile (nearest rank) of a list of values, rank being between 0 and 100
+    """
+    ordered = sorted(values)
+    index = int(round(rank / 100.0 * (len(ordered) - 1)))
+    return ordered[min(max(index, 0), len(ordered) - 1)]
+
+class HostTimeouts(object):
+    """
+    Thread-safe adaptive timeouts of the download hosts: record() the latency of the responses of a host,
+    timeout() for the next request to the host
+    """
+
+    def __init__(self, default=DEFAULT_TIMEOUT, minimum=DEFAULT_MIN_TIMEOUT, maximum=DEFAULT_MAX_TIMEOUT,
+                 factor=DEFAULT_FACTOR, percentile=DEFAULT_PERCENTILE, window=DEFAULT_WINDOW,
+                 min_samples=DEFAULT_MIN_SAMPLES):
+        self.default = default
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.factor = factor
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._timeouts = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the timeouts from the optional adaptive_timeouts section of the configuration, None if the
+        adaptive timeouts are disabled (enabled: false)
+        """
+        timeouts_config = config["adaptive_timeouts"] if "adaptive_timeouts" in config and config["adaptive_timeouts"] else {}
+        if "enabled" in timeouts_config and timeouts_config["enabled"] == False:
+            return None
+        parameters = {}
+        for key, parameter in [("default", "default"), ("min", "minimum"), ("max", "maximum"), ("factor", "factor"),
+                               ("percentile", "percentile"), ("window", "window"), ("min_samples", "min_samples")]:
+            if key in timeouts_config and timeouts_config[key]:
+                parameters[parameter] = timeouts_config[key]
+        return cls(**parameters)
+
+    def record(self, host, latency):
+        """
+        Record the latency in seconds of a response of the host
+        """
+        if host == None:
+            return
+        with self._lock:
+            latencies = self._latencies.get(host)
+            if latencies == None:
+                latencies = deque(maxlen=self.window)
+                self._latencies[host] = latencies
+            latencies.append(latency)
+            if len(latencies) >= self.min_samples:
+                timeout = self.factor * percentile(latencies, self.percentile)
+                self._timeouts[host] = min(self.maximum, max(self.minimum, timeout))
+
+    def timeout(self, host):
+        """
+        Timeout in seconds of a request to the host
+        """
+        with self._lock:
+            return self._timeouts.get(host, self.default)
+
+    def report(self, nb_hosts=10):
+        with self._lock:
+            timeouts = list(self._timeouts.items())
+        if len(timeouts) == 0:
+            return
+        print("hosts with adaptive timeouts:", len(timeouts), "- fast hosts (" + str(self.minimum) + "s):",
+            len([host for host, timeout in timeouts if timeout <= self.minimum]), "- slow hosts (" + str(self.maximum) + "s):",
+            len([host for host, timeout in timeouts if timeout >= self.maximum]))
+        timeouts.sort(key=lambda item: item[1], reverse=True)
+        for host, timeout in timeouts[:nb_hosts]:
+            print("   ", host, "timeout:", str(round(timeout, 1)) + "s")
@@ -0,0 +1,269 @@
+'''
+Streaming of the downloaded resources to disk.
+
+The HTTP responses are written to the target file chunk by chunk as they arrive, instead of being loaded
+entirely in memory. The first bytes of the response are checked before anything is written: a response
+which is clearly not of the expected type (typically an HTML landing page instead of a PDF) is aborted
+immediately, without downloading the rest of it. The download is also aborted when it exceeds a maximum
+size.
+
+When the first bytes identify a PDF, the verdict is recorded, so that the validation of the downloaded
+file does not have to read it again with libmagic.
+
+A download in progress can be cancelled from another thread via its target file (cancelled_downloads),
+or when its deadline is passed, the streaming of the response being then aborted at its next chunk.
+'''
+
+import os
+import time
+import threading
+
+from biblio_glutton_harvester.governor import network_governor, DOWNLOAD
+
+PDF_MAGIC = b'%PDF-'
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+# the ustar magic of the tar files is located at offset 257 of the first header block
+TAR_MAGIC = b'ustar'
+TAR_MAGIC_OFFSET = 257
+
+# number of bytes used to identify the type of a response
+SNIFF_SIZE = 512
+
+CHUNK_SIZE = 64 * 1024
+
+# status of a streamed download
+STREAM_SUCCESS = 'success'
+STREAM_REJECTED = 'rejected'
+STREAM_TOO_LARGE = 'too_large'
+STREAM_CANCELLED = 'cancelled'
+
+def sniff(head):
+    """
+    Identify the type of a resource from its first bytes: 'pdf', 'gzip', 'tar', 'zip', 'html', 'xml' or None
+    if unknown. The PDF detection accepts the same prefixes as libmagic (new line, UTF-8 byte order mark).
+    """
+    if head.startswith(PDF_MAGIC) or head.startswith(b'\n' + PDF_MAGIC) or head.startswith(b'\xef\xbb\xbf' + PDF_MAGIC):
+        return 'pdf'
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZIP_MAGIC):
+        return 'zip'
+    if head[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET+len(TAR_MAGIC)] == TAR_MAGIC:
+        return 'tar'
+    start = head.lstrip()[:100].lower()
+    if start.startswith(b'<!doctype html') or start.startswith(b'<html') or b'<html' in start:
+        return 'html'
+    if start.startswith(b'<?xml'):
+        return 'xml'
+    return None
+
+def expected_kinds(filename):
+    """
+    Types of resource accepted for a target file, None if any response is accepted
+    """
+    if filename.endswith(".pdf"):
+        # a gzip response can be a compressed PDF
+        return ('pdf', 'gzip')
+    if filename.endswith(".tar.gz"):
+        return ('gzip', 'tar')
+    if filename.endswith(".zip"):
+        return ('zip',)
+    return None
+
+def too_large(headers, max_size):
+    """
+    Check the announced size of a response against the maximum size
+    """
+    if max_size:
+        content_length = headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_size:
+            return True
+    return False
+
+class StreamWriter(object):
+    """
+    Incremental writing of the chunks of a response to a file, after the identification of the response
+    type from its first bytes. Used as a context manager, the partially written file is removed if the
+    download is not completed, unless keep_partial is true and the download has been interrupted (so that 
+    it can be resumed). With resume_from, the chunks are appended to the first bytes of an existing partial
+    file, whose type has already been checked.
+    """
+
+    def __init__(self, filename, accepted=None, max_size=None, resume_from=0, keep_partial=False):
+        self.filename = filename
+        self.accepted = accepted
+        self.max_size = max_size
+        self.keep_partial = keep_partial
+        self.head = b''
+        self.kind = None
+        self.size = 0
+        self.status = STREAM_SUCCESS
+        self.complete = False
+        self._f_out = None
+        if resume_from > 0:
+            with open(filename, 'rb') as f_in:
+                self.head = f_in.read(SNIFF_SIZE)
+            self.kind = sniff(self.head)
+            self.size = resume_from
+            self._f_out = open(filename, 'r+b')
+            self._f_out.seek(resume_from)
+            self._f_out.truncate()
+
+    def write(self, chunk):
+        """
+        Write a chunk, return False if the download has to be aborted
+        """
+        if not chunk:
+            return True
+        if cancelled_downloads.is_cancelled(self.filename):
+            self.status = STREAM_CANCELLED
+            return False
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            self.status = STREAM_TOO_LARGE
+            return False
+        if self._f_out != None:
+            self._f_out.write(chunk)
+            return True
+        self.head += chunk
+        if len(self.head) < SNIFF_SIZE:
+            return True
+        return self._open()
+
+    def finish(self):
+        """
+        End of the response, return True if the download is successful
+        """
+        if self.status == STREAM_SUCCESS and self._f_out == None:
+            # response shorter than the sniffed size
+            if len(self.head) == 0:
+                self.status = STREAM_REJECTED
+            else:
+                self._open()
+        self.complete = self.status == STREAM_SUCCESS
+        return self.complete
+
+    def _open(self):
+        self.kind = sniff(self.head)
+        if self.accepted != None and self.kind not in self.accepted:
+            self.status = STREAM_REJECTED
+            return False
+        self._f_out = open(self.filename, 'wb')
+        self._f_out.write(self.head)
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a partially written file is never left, except an interrupted one to be resumed
+        if self._f_out != None:
+            self._f_out.close()
+            interrupted = self.status == STREAM_SUCCESS
+            if not self.complete and not (self.keep_partial and interrupted) and os.path.isfile(self.filename):
+                os.remove(self.filename)
+        return False
+
+def stream_response(response, filename, accepted=None, max_size=None, chunk_size=CHUNK_SIZE, resume_from=0, keep_partial=False):
+    """
+    Write a streamed response (requests with stream=True) to a file, return the status of the download,
+    the sniffed type of the response and its first bytes. Nothing is written if the response type is not
+    among the accepted ones, and the partially written file is removed if the maximum size is exceeded.
+    The response is not closed, it is left to the caller (e.g. to read a rejected landing page). See 
+    StreamWriter for resume_from and keep_partial.
+    """
+    if too_large(response.headers, max_size):
+        return STREAM_TOO_LARGE, None, b''
+
+    with StreamWriter(filename, accepted=accepted, max_size=max_size, resume_from=resume_from, keep_partial=keep_partial) as writer:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if not writer.write(chunk):
+                break
+            # within the download bandwidth of the process
+            network_governor.throttle(DOWNLOAD, len(chunk))
+        else:
+            writer.finish()
+    return writer.status, writer.kind, writer.head
+
+def read_content(response, head=b'', max_size=None, chunk_size=CHUNK_SIZE):
+    """
+    Read the remaining content of a response after its first bytes, up to a maximum size
+    """
+    content = head
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        content += chunk
+        if max_size and len(content) > max_size:
+            break
+    return content
+
+class DownloadVerdicts(object):
+    """
+    Thread-safe record of the type of the downloaded files identified while streaming them, consumed by
+    the validation of the files
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._verdicts = {}
+
+    def record(self, filename, kind):
+        with self._lock:
+            self._verdicts[filename] = kind
+
+    def discard(self, filename):
+        with self._lock:
+            self._verdicts.pop(filename, None)
+
+    def pop(self, filename):
+        with self._lock:
+            return self._verdicts.pop(filename, None)
+
+class CancelledDownloads(object):
+    """
+    Thread-safe set of the target files of the cancelled downloads, a download being also cancelled once
+    the optional deadline of its target file (in time.monotonic() seconds) is passed
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filenames = set()
+        self._deadlines = {}
+
+    def cancel(self, filename):
+        with self._lock:
+            self._filenames.add(filename)
+
+    def set_deadline(self, filename, deadline):
+        if deadline == None:
+            return
+        with self._lock:
+            self._deadlines[filename] = deadline
+
+    def deadline(self, filename):
+        with self._lock:
+            return self._deadlines.get(filename)
+
+    def remaining(self, filename):
+        """
+        Remaining time in seconds before the deadline of the download, None if it has no deadline
+        """
+        with self._lock:
+            deadline = self._deadlines.get(filename)
+        if deadline == None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    def is_cancelled(self, filename):
+        with self._lock:
+            if filename in self._filenames:
+                return True
+            deadline = self._deadlines.get(filename)
+        return deadline != None and time.monotonic() >= deadline
+
+    def clear(self, filename):
+        with self._lock:
+            self._filenames.discard(filename)
+            self._deadlines.pop(filename, None)
+
+cancelled_downloads = CancelledDownloads()
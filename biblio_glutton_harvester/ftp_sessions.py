@@ -0,0 +1,186 @@
+'''
+Pooled FTP sessions for the downloads of the PMC archives.
+
+Downloading every PMC archive with a new FTP connection means a TCP connection, a login and the transfer
+settings for every file, and many parallel logins to the NCBI server, which refuses the connections beyond
+its limit. Here the authenticated FTP sessions are kept per server and reused for the successive transfers:
+
+- a session is checked out by a thread for the duration of a transfer, with a maximum number of sessions
+  per server, the other threads waiting for a session to be returned,
+
+- an idle session is checked with a NOOP command before its reuse, and replaced by a new session if the
+  server closed it (or if it has been idle for too long),
+
+- a session whose transfer has been aborted or failed on a network error is closed instead of being
+  returned to the pool, its control connection being in an unknown state.
+
+The number of transfers and of logins are counted, to report the session reuse rate.
+'''
+
+import time
+import ftplib
+import threading
+import contextlib
+
+# maximum number of sessions (concurrent transfers) per FTP server
+DEFAULT_MAX_CONNECTIONS = 8
+
+# idle time in seconds after which a pooled session is closed instead of being reused
+DEFAULT_IDLE_TIMEOUT = 60
+
+DEFAULT_TIMEOUT = 20
+
+def ftp_login(host, port, user, password, timeout=DEFAULT_TIMEOUT):
+    """
+    Open a FTP session in passive and binary mode
+    """
+    ftp = ftplib.FTP(timeout=timeout)
+    try:
+        ftp.connect(host, port)
+        ftp.login(user, password)
+        ftp.voidcmd("TYPE I")
+    except Exception:
+        ftp.close()
+        raise
+    return ftp
+
+class FtpSession(object):
+    """
+    FTP session checked out for a transfer, discard() to close it instead of returning it to the pool
+    """
+
+    def __init__(self, ftp):
+        self.ftp = ftp
+        self.reusable = True
+        self.last_used = time.monotonic()
+
+    def discard(self):
+        self.reusable = False
+
+@contextlib.contextmanager
+def single_session(host, port, user, password, timeout=DEFAULT_TIMEOUT):
+    """
+    Session used for a single transfer, when the sessions are not pooled
+    """
+    session = FtpSession(ftp_login(host, port, user, password, timeout=timeout))
+    try:
+        yield session
+    finally:
+        # no QUIT command, the control connection might be waiting for the end of an aborted transfer
+        session.ftp.close()
+
+class _ServerSessions(object):
+
+    def __init__(self):
+        self.idle = []
+        self.nb_sessions = 0
+
+class FtpSessionPool(object):
+    """
+    Thread-safe pool of authenticated FTP sessions per server
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.max_connections = max(max_connections, 1)
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._servers = {}
+        self.nb_transfers = 0
+        self.nb_logins = 0
+        self.nb_reconnections = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the session pool from the optional ftp_pool section of the configuration
+        """
+        max_connections = DEFAULT_MAX_CONNECTIONS
+        idle_timeout = DEFAULT_IDLE_TIMEOUT
+        if "ftp_pool" in config and config["ftp_pool"]:
+            ftp_config = config["ftp_pool"]
+            if "max_connections" in ftp_config and ftp_config["max_connections"]:
+                max_connections = ftp_config["max_connections"]
+            if "idle_timeout" in ftp_config and ftp_config["idle_timeout"] != None:
+                idle_timeout = ftp_config["idle_timeout"]
+        return cls(max_connections=max_connections, idle_timeout=idle_timeout)
+
+    @contextlib.contextmanager
+    def session(self, host, port, user, password, timeout=DEFAULT_TIMEOUT):
+        """
+        Check out a session of the server, waiting if all its sessions are in use. The session is closed if
+        the transfer raised an error other than a permanent FTP error (e.g. file not found) or if it has been
+        discarded.
+        """
+        key = (host, port, user, password)
+        session = self._checkout(key, timeout)
+        try:
+            yield session
+        except ftplib.error_perm:
+            raise
+        except BaseException:
+            session.discard()
+            raise
+        finally:
+            self._checkin(key, session)
+
+    def _checkout(self, key, timeout):
+        with self._cond:
+            server = self._servers.get(key)
+            if server == None:
+                server = _ServerSessions()
+                self._servers[key] = server
+            while len(server.idle) == 0 and server.nb_sessions >= self.max_connections:
+                self._cond.wait()
+            session = server.idle.pop() if len(server.idle) > 0 else None
+            if session == None:
+                server.nb_sessions += 1
+            self.nb_transfers += 1
+
+        if session != None and not self._alive(session):
+            session.ftp.close()
+            session = None
+            with self._cond:
+                self.nb_reconnections += 1
+        if session == None:
+            try:
+                session = FtpSession(ftp_login(*key, timeout=timeout))
+            except Exception:
+                with self._cond:
+                    server.nb_sessions -= 1
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self.nb_logins += 1
+        session.ftp.timeout = timeout
+        session.ftp.sock.settimeout(timeout)
+        session.reusable = True
+        return session
+
+    def _alive(self, session):
+        if time.monotonic() - session.last_used > self.idle_timeout:
+            return False
+        try:
+            session.ftp.voidcmd("NOOP")
+            return True
+        except (ftplib.Error, OSError, EOFError):
+            return False
+
+    def _checkin(self, key, session):
+        if not session.reusable:
+            session.ftp.close()
+        session.last_used = time.monotonic()
+        with self._cond:
+            server = self._servers[key]
+            if session.reusable:
+                server.idle.append(session)
+            else:
+                server.nb_sessions -= 1
+            self._cond.notify_all()
+
+    def report(self):
+        with self._cond:
+            if self.nb_transfers == 0:
+                return
+            reuse_rate = max(0.0, 1.0 - self.nb_logins / self.nb_transfers)
+            print("total FTP transfers:", self.nb_transfers, "- logins:", self.nb_logins, "- session reuse rate:",
+                str(round(reuse_rate * 100, 1)) + "%", "- reconnections:", self.nb_reconnections)
@@ -0,0 +1,234 @@
+'''
+Process-wide governor of the network use of the harvester.
+
+The harvester often runs on shared nodes, next to other services. The per-host politeness limits and the
+size of the pipeline do not bound the total network use, so the governor limits, for the whole process:
+
+- the download bandwidth, shared by all the download threads and the event loop of the asyncio engine,
+
+- the upload bandwidth to the S3 or Swift storage, shared by the storage threads,
+
+- the number of requests per second (downloads, retries, metadata look-ups).
+
+Each limit is a token bucket: a download or upload reserves its bytes chunk by chunk, and waits when the
+bucket is in debt, so that the rate is respected over time without starving any thread. The limits can be
+changed for some time windows, for example in the config file, to throttle the harvesting during office
+hours:
+
+    network_governor:
+        download_bandwidth: 50
+        upload_bandwidth: ~
+        requests_per_second: 200
+        windows:
+            - days: [mon, tue, wed, thu, fri]
+              start: "08:00"
+              end: "19:00"
+              download_bandwidth: 10
+              upload_bandwidth: 5
+              requests_per_second: 50
+
+The bandwidths are given in MB per second, ~ for no limit.
+'''
+
+import time
+import threading
+
+DOWNLOAD = 'download_bandwidth'
+UPLOAD = 'upload_bandwidth'
+REQUESTS = 'requests_per_second'
+
+LIMITS = (DOWNLOAD, UPLOAD, REQUESTS)
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+# period in seconds between two checks of the active time window
+WINDOW_CHECK_PERIOD = 10
+
+class RateLimiter(object):
+    """
+    Thread-safe token bucket with a rate in units per second (None for no limit), and a capacity of one
+    second of the rate. A reservation larger than the available tokens is granted with a debt, the caller
+    having to wait for the time needed to pay it back.
+    """
+
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self.rate = None
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.total = 0
+        self.waited = 0.0
+        self.set_rate(rate)
+
+    def _refill(self, now):
+        if self.rate != None:
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate != None and self.rate == None:
+                self.tokens = rate
+            self.rate = rate
+            if rate != None:
+                self.tokens = min(self.tokens, rate)
+
+    def reserve(self, amount):
+        """
+        Reserve amount units, return the time in seconds to wait before using them
+        """
+        with self._lock:
+            self.total += amount
+            if self.rate == None:
+                return 0
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0
+            delay = -self.tokens / self.rate
+            self.waited += delay
+            return delay
+
+def _minutes(value):
+    """
+    Minutes since midnight of a "HH:MM" time, YAML possibly giving directly the minutes of an unquoted time
+    """
+    if isinstance(value, int):
+        return value
+    hours, minutes = str(value).split(":")
+    return int(hours) * 60 + int(minutes)
+
+class TimeWindow(object):
+    """
+    Limits applied during a daily time window (local time), on some days of the week
+    """
+
+    def __init__(self, limits, start=0, end=24 * 60, days=None):
+        self.limits = limits
+        self.start = start
+        self.end = end
+        self.days = days if days != None else list(range(7))
+
+    @classmethod
+    def from_config(cls, config):
+        limits = {}
+        for limit in LIMITS:
+            if limit in config:
+                limits[limit] = config[limit]
+        start = _minutes(config["start"]) if "start" in config and config["start"] != None else 0
+        end = _minutes(config["end"]) if "end" in config and config["end"] != None else 24 * 60
+        days = None
+        if "days" in config and config["days"]:
+            days = [DAYS.index(day.lower()[:3]) for day in config["days"]]
+        return cls(limits, start=start, end=end, days=days)
+
+    def is_active(self, local_time):
+        minutes = local_time.tm_hour * 60 + local_time.tm_min
+        if self.start <= self.end:
+            return local_time.tm_wday in self.days and self.start <= minutes < self.end
+        # window over midnight, starting on the indicated days
+        if minutes >= self.start:
+            return local_time.tm_wday in self.days
+        return minutes < self.end and (local_time.tm_wday - 1) % 7 in self.days
+
+class NetworkGovernor(object):
+    """
+    Limits of the network use of the process, delay() or throttle() the units of a limit (bytes of the
+    bandwidths, number of requests) before using them
+    """
+
+    def __init__(self, limits=None, windows=None):
+        self.configure_limits(limits, windows)
+
+    def configure_limits(self, limits=None, windows=None):
+        self.default_limits = limits if limits != None else {}
+        self.windows = windows if windows != None else []
+        self.limiters = dict((limit, RateLimiter()) for limit in LIMITS)
+        self._lock = threading.Lock()
+        self._active_window = None
+        self._next_check = 0
+        self._apply(self.default_limits)
+
+    def configure(self, config):
+        """
+        Set the limits from the optional network_governor section of the configuration
+        """
+        limits = {}
+        windows = []
+        if "network_governor" in config and config["network_governor"]:
+            governor_config = config["network_governor"]
+            for limit in LIMITS:
+                if limit in governor_config:
+                    limits[limit] = governor_config[limit]
+            if "windows" in governor_config and governor_config["windows"]:
+                windows = [TimeWindow.from_config(window_config) for window_config in governor_config["windows"]]
+        self.configure_limits(limits, windows)
+
+    def _apply(self, limits):
+        for limit in LIMITS:
+            rate = limits[limit] if limit in limits and limits[limit] else None
+            if rate != None and limit != REQUESTS:
+                # bandwidths in MB per second
+                rate = rate * 1024 * 1024
+            self.limiters[limit].set_rate(rate)
+
+    def _check_window(self):
+        now = time.monotonic()
+        with self._lock:
+            if len(self.windows) == 0 or now < self._next_check:
+                return
+            self._next_check = now + WINDOW_CHECK_PERIOD
+            local_time = time.localtime()
+            active_window = None
+            for window in self.windows:
+                if window.is_active(local_time):
+                    active_window = window
+                    break
+            if active_window is self._active_window:
+                return
+            self._active_window = active_window
+            limits = dict(self.default_limits)
+            if active_window != None:
+                limits.update(active_window.limits)
+            self._apply(limits)
+
+    def delay(self, limit, amount=1):
+        """
+        Reserve amount units of the limit, return the time in seconds to wait before using them
+        """
+        self._check_window()
+        return self.limiters[limit].reserve(amount)
+
+    def throttle(self, limit, amount=1):
+        """
+        Reserve amount units of the limit, waiting until they can be used
+        """
+        delay = self.delay(limit, amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    def upload_callback(self, nb_bytes):
+        """
+        Progress callback of the S3 uploads, throttling the upload threads
+        """
+        self.throttle(UPLOAD, nb_bytes)
+
+    def download_callback(self, nb_bytes):
+        """
+        Progress callback of the S3 downloads (mirrors), throttling the download threads
+        """
+        self.throttle(DOWNLOAD, nb_bytes)
+
+    def report(self):
+        download = self.limiters[DOWNLOAD]
+        upload = self.limiters[UPLOAD]
+        requests = self.limiters[REQUESTS]
+        if all(limiter.rate == None for limiter in self.limiters.values()) and len(self.windows) == 0:
+            return
+        print("network governor - downloaded:", str(round(download.total / (1024 * 1024), 1)) + "MB", "- uploaded:",
+            str(round(upload.total / (1024 * 1024), 1)) + "MB", "- requests:", requests.total, "- cumulated throttling delays:",
+            str(round(download.waited + upload.waited + requests.waited, 1)) + "s")
+
+# governor of the process, configured by the harvester
+network_governor = NetworkGovernor()
@@ -0,0 +1,365 @@
+'''
+Block index for large gzipped JSONL files (Unpaywall snapshot), to decompress and process line ranges
+in parallel.
+
+A gzip file made of a single deflate stream can only be decompressed sequentially, and the zlib API
+available in Python does not allow to restart decompression in the middle of such a stream. However a
+gzip file can be made of several members (concatenated gzip streams), each one being decompressible
+independently. This is the case for files produced by bgzip, or for files re-encoded by this module.
+
+Two operations are provided:
+
+- build a one-time index of the members of a multi-member gzip file, giving for each member where it
+  starts in the compressed file and which is the first line starting in it. The index is saved in a
+  sidecar file (same path with suffix .blocks), together with the number of lines (.count sidecar used
+  by the harvester for progress),
+
+- re-encode a gzip file (typically the single-member Unpaywall snapshot) as independent blocks of
+  complete lines, writing the index at the same time. The output is still a valid gzip file which can
+  be read by any gzip tool.
+
+With an index, the file can be split into ranges of lines decompressed and processed by separate worker
+processes, the results being collected in the file order.
+
+Usage:
+
+> python3 -m biblio_glutton_harvester.gzip_blocks --input unpaywall_snapshot.jsonl.gz --output unpaywall_snapshot_blocks.jsonl.gz --workers 8
+
+> python3 -m biblio_glutton_harvester.gzip_blocks --input already_multi_member.jsonl.gz
+'''
+
+import os
+import io
+import gzip
+import json
+import argparse
+import contextlib
+import time
+import multiprocessing
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+# logging
+import logging
+import logging.handlers
+
+from biblio_glutton_harvester.snapshot import _GzipMemberStream, READ_BUFFER_SIZE, file_signature, write_line_count
+
+# suffix of the sidecar file storing the block index of a gzip file
+BLOCK_INDEX_SIDECAR_SUFFIX = ".blocks"
+
+# number of lines per gzip member when re-encoding a file
+DEFAULT_BLOCK_LINES = 20000
+
+# minimum number of lines of a range processed by a worker, small members (e.g. bgzip 64KB blocks) are grouped
+DEFAULT_RANGE_LINES = 20000
+
+# compression level of the re-encoded blocks
+DEFAULT_COMPRESSION_LEVEL = 6
+
+class BlockIndex(object):
+    """
+    Index of the members of a gzip file. Every block is described by a tuple (member compressed offset,
+    member uncompressed offset, position of the first line starting in the member, uncompressed offset of
+    this first line). Members where no line starts are not indexed, their content is read as the continuation
+    of the previous block.
+    """
+
+    def __init__(self, blocks, line_count, uncompressed_size, signature=None):
+        self.blocks = [tuple(block) for block in blocks]
+        self.line_count = line_count
+        self.uncompressed_size = uncompressed_size
+        self.signature = signature
+        self._first_lines = [block[2] for block in self.blocks]
+
+    def is_parallelizable(self):
+        return len(self.blocks) > 1
+
+    def ranges(self, start_line=0, range_lines=DEFAULT_RANGE_LINES):
+        """
+        Split the file into ranges of consecutive blocks of at least range_lines lines (except the last one),
+        starting at the block containing the line start_line. A range is a tuple (first block, uncompressed
+        end offset, end line), the lines of the range starting before the end offset.
+        """
+        result = []
+        if len(self.blocks) == 0 or start_line >= self.line_count:
+            return result
+        index = max(bisect_right(self._first_lines, start_line) - 1, 0)
+        while index < len(self.blocks):
+            first_block = self.blocks[index]
+            end_index = index + 1
+            while end_index < len(self.blocks) and self.blocks[end_index][2] - first_block[2] < range_lines:
+                end_index += 1
+            if end_index < len(self.blocks):
+                result.append((first_block, self.blocks[end_index][3], self.blocks[end_index][2]))
+            else:
+                result.append((first_block, self.uncompressed_size, self.line_count))
+            index = end_index
+        return result
+
+    def checkpoint(self, line):
+        """
+        Return a resume point for restarting the reading at the given line position, compatible with the
+        resume points of the snapshot reader
+        """
+        index = bisect_right(self._first_lines, line) - 1
+        if index < 0:
+            return None
+        block = self.blocks[index]
+        # seek point as (line, offset, member offset, member uncompressed offset)
+        return {"line": line, "seek_point": (block[2], block[3], block[0], block[1])}
+
+    def save(self, filepath):
+        index_path = filepath + BLOCK_INDEX_SIDECAR_SUFFIX
+        index_object = {}
+        index_object["lines"] = self.line_count
+        index_object["uncompressed_size"] = self.uncompressed_size
+        index_object["size"], index_object["mtime"] = file_signature(filepath)
+        index_object["blocks"] = self.blocks
+        try:
+            with open(index_path, 'w') as index_file:
+                json.dump(index_object, index_file)
+        except OSError:
+            logging.warning("could not write block index sidecar file: " + index_path)
+        # the line count sidecar is used by the snapshot reader for progress and sampling
+        write_line_count(filepath, self.line_count)
+
+def load_block_index(filepath):
+    """
+    Return the block index of the file from its sidecar file, None if there is no index or if the index
+    does not correspond to the current version of the file
+    """
+    index_path = filepath + BLOCK_INDEX_SIDECAR_SUFFIX
+    if not os.path.isfile(index_path):
+        return None
+    try:
+        with open(index_path, 'r') as index_file:
+            index_object = json.load(index_file)
+        signature = [index_object["size"], index_object["mtime"]]
+        if signature != file_signature(filepath):
+            logging.info("block index sidecar file outdated, ignored: " + index_path)
+            return None
+        return BlockIndex(index_object["blocks"], index_object["lines"], index_object["uncompressed_size"], signature=signature)
+    except:
+        logging.exception("invalid block index sidecar file: " + index_path)
+    return None
+
+def build_block_index(filepath, show_progress=True):
+    """
+    Build the block index of a gzip file with a single decompression pass and save it as sidecar file.
+    A single-member gzip file results in an index with one block, which is not parallelizable and has to be
+    re-encoded.
+    """
+    blocks = []
+    newlines = 0
+    uncompressed_offset = 0
+    previous_byte = b'\n'
+    # member being currently decompressed, and if its first line start has been found
+    current_member = -1
+    searching_line_start = False
+
+    pbar = tqdm(total=os.path.getsize(filepath), unit='B', unit_scale=True, disable=not show_progress)
+    with open(filepath, 'rb') as raw:
+        stream = _GzipMemberStream(raw)
+        last_raw_offset = 0
+        while True:
+            chunk = stream.read(READ_BUFFER_SIZE)
+            if not chunk:
+                break
+            # a chunk returned by the stream always belongs to the latest started member
+            if len(stream.members_uncompressed) - 1 != current_member:
+                current_member = len(stream.members_uncompressed) - 1
+                searching_line_start = True
+            if searching_line_start:
+                if previous_byte == b'\n':
+                    blocks.append((stream.members_compressed[current_member], stream.members_uncompressed[current_member], newlines, uncompressed_offset))
+                    searching_line_start = False
+                else:
+                    position = chunk.find(b'\n')
+                    if position != -1 and position + 1 < len(chunk):
+                        blocks.append((stream.members_compressed[current_member], stream.members_uncompressed[current_member], newlines + 1, uncompressed_offset + position + 1))
+                        searching_line_start = False
+            newlines += chunk.count(b'\n')
+            uncompressed_offset += len(chunk)
+            previous_byte = chunk[-1:]
+            pbar.update(raw.tell() - last_raw_offset)
+            last_raw_offset = raw.tell()
+    pbar.close()
+
+    line_count = newlines
+    if previous_byte != b'\n':
+        # last line without end of line
+        line_count += 1
+
+    index = BlockIndex(blocks, line_count, uncompressed_offset)
+    index.save(filepath)
+    return index
+
+def read_block_range(filepath, block_range, start_line=0):
+    """
+    Iterate over the (position, line) pairs of the lines starting in the block range, ignoring the lines
+    before start_line
+    """
+    first_block, end_offset, end_line = block_range
+    with open(filepath, 'rb') as raw:
+        stream = io.BufferedReader(_GzipMemberStream(raw, start_offset=first_block[0], start_uncompressed_offset=first_block[1]), buffer_size=READ_BUFFER_SIZE)
+        # skip the end of the line started in the previous block
+        to_skip = first_block[3] - first_block[1]
+        while to_skip > 0:
+            buffer = stream.read(min(to_skip, READ_BUFFER_SIZE))
+            if not buffer:
+                return
+            to_skip -= len(buffer)
+
+        position = first_block[2]
+        offset = first_block[3]
+        while offset < end_offset:
+            line = stream.readline()
+            if not line:
+                break
+            if position >= start_line:
+                yield position, line
+            position += 1
+            offset += len(line)
+
+def _warm_up():
+    return None
+
+def start_process_pool(nb_workers, initializer=None, initargs=()):
+    """
+    Create a pool of nb_workers processes and fork all of them immediately. The pool must be started 
+    before any other thread is running in the process: a forked worker inherits the locks held by the 
+    other threads (logging, tqdm, LMDB), which are never released in the worker.
+    """
+    # fork the workers: the harvester main module must not be re-imported by the workers (its import
+    # re-initializes the log file)
+    mp_context = multiprocessing.get_context("fork")
+    executor = ProcessPoolExecutor(max_workers=nb_workers, mp_context=mp_context, initializer=initializer, initargs=initargs)
+    try:
+        # a forked pool creates all its processes with the first task
+        for future in [executor.submit(_warm_up) for _ in range(nb_workers)]:
+            future.result()
+    except BaseException:
+        executor.shutdown()
+        raise
+    return executor
+
+def _apply_on_block_range(func, filepath, block_range, start_line):
+    return func(read_block_range(filepath, block_range, start_line))
+
+def map_block_ranges(filepath, index, func, nb_workers, start_line=0, range_lines=DEFAULT_RANGE_LINES,
+                     initializer=None, initargs=(), show_progress=True, executor=None):
+    """
+    Apply func on the (position, line) pairs of every range of the indexed gzip file in a pool of worker
+    processes, and iterate over the results in the file order. func must be a picklable function (module
+    function or functools.partial), large read-only data can be passed to the workers via initializer.
+    The number of ranges in progress is bounded to keep the memory usage under control. An already 
+    started pool of processes can be provided as executor (the initializer is then ignored), for instance
+    when the caller runs other threads which must not be running when the workers are forked.
+    """
+    max_pending_ranges = nb_workers * 2
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(start_process_pool(nb_workers, initializer=initializer, initargs=initargs))
+        # the progress bar starts a monitor thread, so it is created after forking the workers
+        pbar = stack.enter_context(tqdm(total=index.line_count, initial=start_line, disable=not show_progress))
+        pending = deque()
+        for block_range in index.ranges(start_line=start_line, range_lines=range_lines):
+            pending.append((block_range, executor.submit(_apply_on_block_range, func, filepath, block_range, start_line)))
+            if len(pending) >= max_pending_ranges:
+                yield _collect_range(pending.popleft(), pbar, start_line)
+        while len(pending) > 0:
+            yield _collect_range(pending.popleft(), pbar, start_line)
+
+def _collect_range(item, pbar, start_line):
+    block_range, future = item
+    result = future.result()
+    pbar.update(block_range[2] - max(block_range[0][2], start_line))
+    return result
+
+def _compress_block(lines, compression_level):
+    return gzip.compress(b''.join(lines), compresslevel=compression_level), len(lines)
+
+def reencode_blocks(input_path, output_path, block_lines=DEFAULT_BLOCK_LINES, nb_workers=1,
+                    compression_level=DEFAULT_COMPRESSION_LEVEL, show_progress=True):
+    """
+    Re-encode a (possibly single-member) gzip file as a sequence of independent gzip members of block_lines
+    complete lines each, compressed in parallel, and save the block index of the output file
+    """
+    blocks = []
+    line_count = 0
+    uncompressed_offset = 0
+    compressed_offset = 0
+
+    def _write(output_file, result, lines_size):
+        nonlocal line_count, uncompressed_offset, compressed_offset
+        data, nb_lines = result
+        blocks.append((compressed_offset, uncompressed_offset, line_count, uncompressed_offset))
+        output_file.write(data)
+        compressed_offset += len(data)
+        uncompressed_offset += lines_size
+        line_count += nb_lines
+
+    # the workers are forked before the progress bar starts its monitor thread
+    with start_process_pool(max(nb_workers, 1)) as executor:
+        with gzip.open(input_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
+            pbar = tqdm(total=os.path.getsize(input_path), unit='B', unit_scale=True, disable=not show_progress)
+            pending = deque()
+            lines = []
+            lines_size = 0
+            last_offset = 0
+            for line in input_file:
+                lines.append(line)
+                lines_size += len(line)
+                if len(lines) == block_lines:
+                    pending.append((executor.submit(_compress_block, lines, compression_level), lines_size))
+                    lines = []
+                    lines_size = 0
+                    raw_offset = input_file.fileobj.tell()
+                    pbar.update(raw_offset - last_offset)
+                    last_offset = raw_offset
+                    if len(pending) >= max(nb_workers, 1) * 2:
+                        future, size = pending.popleft()
+                        _write(output_file, future.result(), size)
+            if len(lines) > 0:
+                pending.append((executor.submit(_compress_block, lines, compression_level), lines_size))
+            while len(pending) > 0:
+                future, size = pending.popleft()
+                _write(output_file, future.result(), size)
+        pbar.update(os.path.getsize(input_path) - last_offset)
+        pbar.close()
+
+    index = BlockIndex(blocks, line_count, uncompressed_offset)
+    index.save(output_path)
+    return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Block index and re-encoding of gzipped snapshot files for parallel reading")
+    parser.add_argument("--input", default=None, help="path to the gzipped file (e.g. Unpaywall dataset)")
+    parser.add_argument("--output", default=None, help="if indicated, re-encode the input file as independent gzip blocks in this file, " \
+        "otherwise only index the existing gzip members of the input file")
+    parser.add_argument("--block-lines", type=int, default=DEFAULT_BLOCK_LINES, help="number of lines per block when re-encoding")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes for compressing the blocks when re-encoding")
+    parser.add_argument("--level", type=int, default=DEFAULT_COMPRESSION_LEVEL, help="compression level of the re-encoded blocks")
+
+    args = parser.parse_args()
+
+    if args.input == None:
+        print("error: the path to the input file has not been specified")
+    elif not os.path.isfile(args.input):
+        print("error: the indicated path to the input file is not valid", args.input)
+    else:
+        start_time = time.time()
+
+        if args.output != None:
+            index = reencode_blocks(args.input, args.output, block_lines=args.block_lines, nb_workers=args.workers, compression_level=args.level)
+        else:
+            index = build_block_index(args.input)
+            if not index.is_parallelizable():
+                print("warning: single gzip member, the file has to be re-encoded (--output) to be read in parallel")
+        print("total of", str(index.line_count), "lines in", str(len(index.blocks)), "blocks")
+
+        runtime = round(time.time() - start_time, 3)
+        print("runtime: %s seconds " % (runtime))
@@ -0,0 +1,232 @@
+'''
+Health of the download hosts, with a circuit breaker per host.
+
+When a large OA host is down or blocks the harvester, every entry pointing to it would still go through
+all the download methods (cloudscraper, requests, native downloader with retries) and then through its
+alternative locations, keeping the download workers busy for hours. The registry keeps the recent
+outcomes and the latency of the downloads of every host, and trips the circuit breaker of a host when
+its recent downloads are failing:
+
+- closed: the downloads are performed normally, the breaker is tripped when the last downloads of the host
+  are consecutive failures and its failure rate over the recent downloads is above a threshold,
+
+- open: the downloads from the host fail immediately (the entries are deferred to a later --reprocess,
+  their alternative locations being still tried), until the end of the open period,
+
+- half-open: one probe download is allowed, its success closes the breaker, its failure opens it again for
+  a doubled period (up to a maximum).
+
+The state of the hosts is persisted in a LMDB environment, so that a new harvesting run and its
+diagnostic see the hosts known to be unhealthy. The updates are buffered in memory, as they are made by
+the download threads and the event loop of the asyncio engine, and persisted by flush().
+'''
+
+import time
+import pickle
+import threading
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# default parameters of the circuit breakers
+DEFAULT_WINDOW = 20
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_FAILURE_RATE = 0.9
+DEFAULT_OPEN_DURATION = 300
+DEFAULT_MAX_OPEN_DURATION = 3600
+
+class HostHealth(object):
+    """
+    Recent download outcomes and circuit breaker state of a host
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.state = CLOSED
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        # recent outcomes, True for a success
+        self.recent = deque(maxlen=window)
+        # moving average of the download latency, in seconds
+        self.latency = None
+        self.opened_at = None
+        self.open_duration = None
+        self.nb_trips = 0
+        self.probing = False
+
+    def failure_rate(self):
+        if len(self.recent) == 0:
+            return 0.0
+        return self.recent.count(False) / len(self.recent)
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "recent": list(self.recent),
+            "latency": self.latency,
+            "opened_at": self.opened_at,
+            "open_duration": self.open_duration,
+            "nb_trips": self.nb_trips
+        }
+
+    @classmethod
+    def from_dict(cls, record, window=DEFAULT_WINDOW):
+        health = cls(window)
+        health.state = record["state"]
+        health.successes = record["successes"]
+        health.failures = record["failures"]
+        health.consecutive_failures = record["consecutive_failures"]
+        health.recent.extend(record["recent"])
+        health.latency = record["latency"]
+        health.opened_at = record["opened_at"]
+        health.open_duration = record["open_duration"]
+        health.nb_trips = record["nb_trips"]
+        if health.state == HALF_OPEN:
+            # the probe of a previous run is lost, a new one is allowed
+            health.state = OPEN
+            health.opened_at = 0
+        return health
+
+class HostHealthRegistry(object):
+    """
+    Thread-safe registry of the health of the download hosts: allow() before downloading from a host,
+    record() with the outcome of the download
+    """
+
+    def __init__(self, env=None, window=DEFAULT_WINDOW, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 failure_rate=DEFAULT_FAILURE_RATE, open_duration=DEFAULT_OPEN_DURATION,
+                 max_open_duration=DEFAULT_MAX_OPEN_DURATION):
+        # optional LMDB environment where the host states are persisted
+        self.env = env
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.open_duration = open_duration
+        self.max_open_duration = max(max_open_duration, open_duration)
+        self._lock = threading.Lock()
+        self._hosts = {}
+        # hosts whose state or statistics are not persisted yet
+        self._dirty = set()
+        self._load()
+
+    @classmethod
+    def from_config(cls, config, env=None):
+        """
+        Create the registry from the optional circuit_breaker section of the configuration, None if the
+        circuit breakers are disabled (enabled: false)
+        """
+        breaker_config = config["circuit_breaker"] if "circuit_breaker" in config and config["circuit_breaker"] else {}
+        if "enabled" in breaker_config and breaker_config["enabled"] == False:
+            return None
+        parameters = {}
+        for key in ["window", "failure_threshold", "failure_rate", "open_duration", "max_open_duration"]:
+            if key in breaker_config and breaker_config[key]:
+                parameters[key] = breaker_config[key]
+        return cls(env, **parameters)
+
+    def _load(self):
+        if self.env == None:
+            return
+        with self.env.begin() as txn:
+            for key, value in txn.cursor():
+                self._hosts[key.decode(encoding='UTF-8')] = HostHealth.from_dict(pickle.loads(value), self.window)
+
+    def _save(self, hosts):
+        if self.env == None or len(hosts) == 0:
+            return
+        with self.env.begin(write=True) as txn:
+            for host in hosts:
+                txn.put(host.encode(encoding='UTF-8'), pickle.dumps(self._hosts[host].to_dict()))
+
+    def allow(self, host):
+        """
+        Return True if a download can be attempted from the host, False if its circuit breaker is open
+        """
+        if host == None:
+            return True
+        with self._lock:
+            health = self._hosts.get(host)
+            if health == None or health.state == CLOSED:
+                return True
+            if health.state == HALF_OPEN or time.time() < health.opened_at + health.open_duration:
+                return False
+            # end of the open period, the download is a probe
+            health.state = HALF_OPEN
+            health.probing = True
+            self._dirty.add(host)
+            return True
+
+    def latency(self, host):
+        """
+        Moving average of the download latency of the host in seconds, None if not known
+        """
+        with self._lock:
+            health = self._hosts.get(host)
+            return health.latency if health != None else None
+
+    def record(self, host, success, latency=None):
+        """
+        Record the outcome of a download from the host, and update the state of its circuit breaker
+        """
+        if host == None:
+            return
+        with self._lock:
+            health = self._hosts.get(host)
+            if health == None:
+                health = HostHealth(self.window)
+                self._hosts[host] = health
+            if success:
+                health.successes += 1
+                health.consecutive_failures = 0
+                if latency != None:
+                    health.latency = latency if health.latency == None else 0.8 * health.latency + 0.2 * latency
+            else:
+                health.failures += 1
+                health.consecutive_failures += 1
+            health.recent.append(success)
+
+            if health.state == HALF_OPEN and health.probing:
+                health.probing = False
+                if success:
+                    health.state = CLOSED
+                    health.open_duration = None
+                    health.recent.clear()
+                else:
+                    self._trip(health, min(self.max_open_duration, 2 * health.open_duration))
+            elif health.state == CLOSED and not success:
+                if health.consecutive_failures >= self.failure_threshold and health.failure_rate() >= self.failure_rate:
+                    self._trip(health, self.open_duration)
+            self._dirty.add(host)
+
+    def _trip(self, health, open_duration):
+        health.state = OPEN
+        health.opened_at = time.time()
+        health.open_duration = open_duration
+        health.nb_trips += 1
+
+    def flush(self):
+        """
+        Persist the state and the statistics of the hosts updated since the last flush
+        """
+        with self._lock:
+            self._save([host for host in self._dirty if host in self._hosts])
+            self._dirty = set()
+
+    def report(self, nb_hosts=10):
+        with self._lock:
+            unhealthy = [(host, health) for host, health in self._hosts.items() if health.state != CLOSED]
+            nb_tracked = len(self._hosts)
+        print("download hosts tracked:", nb_tracked, "- circuit breakers open:", len(unhealthy))
+        unhealthy.sort(key=lambda item: item[1].failures, reverse=True)
+        now = time.time()
+        for host, health in unhealthy[:nb_hosts]:
+            retry_in = max(0, int(health.opened_at + health.open_duration - now))
+            latency = "n/a" if health.latency == None else str(round(health.latency, 1)) + "s"
+            print("   ", host, health.state, "- successes:", health.successes, "- failures:", health.failures,
+                "- recent failure rate:", str(round(health.failure_rate() * 100, 1)) + "%", "- latency:", latency,
+                "- trips:", health.nb_trips, "- next probe in", str(retry_in) + "s")
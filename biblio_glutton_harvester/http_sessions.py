@@ -0,0 +1,163 @@
+'''
+Pooled HTTP sessions for the download and metadata requests.
+
+Calling requests.get for every file opens a new connection (DNS look-up, TCP and TLS handshakes) even when
+many consecutive files come from the same host (Europe PMC, MDPI, Zenodo, ...). Here all the requests go
+through a single connection pool manager, which keeps per host pools of keep-alive connections shared by
+all the threads. A requests.Session object is not safe to share between threads, so every thread has its
+own light session, all of them mounted on the same pooled adapter.
+
+The number of requests and of new connections are counted per host, to report the connection reuse rates.
+'''
+
+import threading
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from biblio_glutton_harvester.governor import network_governor, REQUESTS
+
+# maximum number of host connection pools kept in the pool manager
+DEFAULT_MAX_HOSTS = 200
+
+# maximum number of keep-alive connections per host
+DEFAULT_CONNECTIONS_PER_HOST = 8
+
+class ConnectionStats(object):
+    """
+    Thread-safe counters of requests and new connections per host
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.connections = Counter()
+
+    def add_request(self, host):
+        with self._lock:
+            self.requests[host] += 1
+
+    def add_connection(self, host):
+        with self._lock:
+            self.connections[host] += 1
+
+    def reuse_rate(self, host=None):
+        """
+        Proportion of requests served by an already open connection, for a given host or for all hosts
+        """
+        with self._lock:
+            if host == None:
+                nb_requests = sum(self.requests.values())
+                nb_connections = sum(self.connections.values())
+            else:
+                nb_requests = self.requests[host]
+                nb_connections = self.connections[host]
+        if nb_requests == 0:
+            return 0.0
+        return max(0.0, 1.0 - (nb_connections / nb_requests))
+
+    def report(self, nb_hosts=10):
+        with self._lock:
+            nb_requests = sum(self.requests.values())
+            top_hosts = self.requests.most_common(nb_hosts)
+        if nb_requests == 0:
+            return
+        print("total HTTP requests:", nb_requests, "- connection reuse rate:", str(round(self.reuse_rate() * 100, 1)) + "%")
+        for host, host_requests in top_hosts:
+            print("   ", host, "requests:", host_requests, "- connection reuse rate:", str(round(self.reuse_rate(host) * 100, 1)) + "%")
+
+def _counting_pool_class(base_class, stats, keep_alive=True):
+    """
+    Connection pool class counting its requests (connections taken from the pool) and the socket connections
+    opened by its connections (a connection object closed by the server is re-opened without a new object).
+    Without keep-alive, the connections are closed when returned to the pool, to avoid sending a request on
+    a socket being closed by the server.
+    """
+    class CountingConnection(base_class.ConnectionCls):
+
+        def connect(self):
+            stats.add_connection(self.host)
+            return super().connect()
+
+    class CountingConnectionPool(base_class):
+        ConnectionCls = CountingConnection
+
+        def _get_conn(self, timeout=None):
+            stats.add_request(self.host)
+            return super()._get_conn(timeout=timeout)
+
+        def _put_conn(self, conn):
+            if not keep_alive and conn != None:
+                conn.close()
+            return super()._put_conn(conn)
+
+    return CountingConnectionPool
+
+class PooledAdapter(HTTPAdapter):
+
+    def __init__(self, stats, keep_alive=True, **kwargs):
+        self.stats = stats
+        self.keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.stats, self.keep_alive),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.stats, self.keep_alive)
+        }
+
+class SessionPool(object):
+    """
+    Thread-safe provider of HTTP sessions sharing the same per host pools of keep-alive connections
+    """
+
+    def __init__(self, max_hosts=DEFAULT_MAX_HOSTS, connections_per_host=DEFAULT_CONNECTIONS_PER_HOST, keep_alive=True):
+        self.max_hosts = max_hosts
+        self.connections_per_host = connections_per_host
+        self.keep_alive = keep_alive
+        self.stats = ConnectionStats()
+        self.adapter = PooledAdapter(self.stats, keep_alive=keep_alive, pool_connections=max_hosts, pool_maxsize=connections_per_host)
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the session pool from the optional http_pool section of the configuration
+        """
+        max_hosts = DEFAULT_MAX_HOSTS
+        connections_per_host = DEFAULT_CONNECTIONS_PER_HOST
+        keep_alive = True
+        if "http_pool" in config and config["http_pool"]:
+            http_config = config["http_pool"]
+            if "max_hosts" in http_config and http_config["max_hosts"]:
+                max_hosts = http_config["max_hosts"]
+            if "connections_per_host" in http_config and http_config["connections_per_host"]:
+                connections_per_host = http_config["connections_per_host"]
+            if "keep_alive" in http_config and http_config["keep_alive"] != None:
+                keep_alive = http_config["keep_alive"]
+        return cls(max_hosts=max_hosts, connections_per_host=connections_per_host, keep_alive=keep_alive)
+
+    def session(self):
+        """
+        Return the session of the current thread
+        """
+        session = getattr(self._local, "session", None)
+        if session == None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            if not self.keep_alive:
+                session.headers["Connection"] = "close"
+            self._local.session = session
+        return session
+
+    def get(self, url, **kwargs):
+        # within the request rate of the process
+        network_governor.throttle(REQUESTS)
+        return self.session().get(url, **kwargs)
+
+    def report(self):
+        self.stats.report()
@@ -0,0 +1,219 @@
+'''
+Ingestion of the Unpaywall snapshot entries before download.
+
+Most of the Unpaywall lines are not harvestable: closed access entries, entries without any PDF URL
+in their OA locations, or components (figures, tables) of a larger article. Decoding every line with
+json.loads just to skip them afterwards is the main CPU cost of the ingestion loop, so the lines are
+first checked on their raw bytes and only the remaining candidates are decoded.
+
+The byte-level checks rely on the fact that JSON string values escape their double quotes, so a pattern
+like "genre": "component" can only match a JSON key/value pair and never the content of a title.
+
+The remaining lines are decoded and their best and alternative OA locations are selected, possibly in a
+pool of worker processes, producing download tasks ready to be registered and scheduled by the harvester.
+'''
+
+import json
+from functools import partial
+from collections import OrderedDict, deque
+
+from biblio_glutton_harvester.gzip_blocks import map_block_ranges, start_process_pool
+
+# number of raw lines per chunk sent to an ingestion worker process
+DEFAULT_CHUNK_SIZE = 2000
+
+# pre-filter rules applied in order on the raw bytes of a line: rule name, patterns, and whether the
+# line is rejected when one of the patterns is present (True) or when none of the patterns is present (False)
+PREFILTER_RULES = [
+    ("not_oa", (b'"is_oa": false', b'"is_oa":false'), True),
+    ("component", (b'"genre": "component"', b'"genre":"component"'), True),
+    ("no_pdf_url", (b'"url_for_pdf": "', b'"url_for_pdf":"'), False)
+]
+
+# readable description of the pre-filter rules for reporting
+PREFILTER_RULE_DESCRIPTIONS = {
+    "not_oa": "not open access",
+    "component": "component genre",
+    "no_pdf_url": "no pdf url"
+}
+
+class UnpaywallPrefilter(object):
+    """
+    Reject on raw bytes the Unpaywall lines that cannot lead to a download, keeping count of the
+    number of lines dropped by each rule
+    """
+
+    def __init__(self, rules=PREFILTER_RULES):
+        self.rules = rules
+        self.dropped = OrderedDict()
+        for name, _, _ in self.rules:
+            self.dropped[name] = 0
+        self.accepted = 0
+
+    def accept(self, line):
+        """
+        Return True if the raw line (bytes) is a candidate for harvesting and needs to be decoded
+        """
+        for name, patterns, reject_if_present in self.rules:
+            present = False
+            for pattern in patterns:
+                if pattern in line:
+                    present = True
+                    break
+            if present == reject_if_present:
+                self.dropped[name] += 1
+                return False
+        self.accepted += 1
+        return True
+
+    def merge(self, other):
+        """
+        Add the counts of another pre-filter (e.g. used on another part of the snapshot)
+        """
+        for name in other.dropped:
+            self.dropped[name] = self.dropped.get(name, 0) + other.dropped[name]
+        self.accepted += other.accepted
+
+    def report(self):
+        for name in self.dropped:
+            description = PREFILTER_RULE_DESCRIPTIONS.get(name, name)
+            print("total entries dropped by pre-filter (" + description + "):", self.dropped[name])
+        print("total entries passing the pre-filter:", self.accepted)
+
+def resolve_unpaywall_line(line, policy, prefilter=None):
+    """
+    Pre-filter, decode and resolve the OA locations of a raw Unpaywall line. Return None if the line
+    is rejected, otherwise a download task as a dict with the decoded entry, its selected OA locations
+    (best_oa_location, alternative_oa_locations) set by the policy. The full entry is kept in the task, 
+    as it is stored as the metadata file of the harvested entry.
+    """
+    if len(line.strip()) == 0:
+        return None
+    if prefilter is not None and not prefilter.accept(line):
+        return None
+
+    # one json entry per line
+    entry = json.loads(line)
+
+    if "genre" in entry and entry["genre"] == "component":
+        # components are figures or tables, which will be in the corresponding article with more context 
+        # and usefulness, so we skip
+        return None
+
+    task = {}
+    task["entry"] = entry
+    task["has_oa_locations"] = 'oa_locations' in entry and entry['oa_locations'] != None and len(entry['oa_locations'])>0
+    task["from_mirror"] = policy.select(entry)
+    return task
+
+def resolve_unpaywall_chunk(chunk, policy):
+    """
+    Resolve a chunk (or any iterable) of (position, raw line) pairs, return the resolved tasks as (position, task) pairs
+    in the chunk order together with the pre-filter counts of the chunk
+    """
+    prefilter = UnpaywallPrefilter()
+    tasks = []
+    for position, line in chunk:
+        task = resolve_unpaywall_line(line, policy, prefilter=prefilter)
+        if task is not None:
+            tasks.append((position, task))
+    return tasks, prefilter
+
+class UnpaywallIngestion(object):
+    """
+    Ingestion stage turning raw Unpaywall lines into resolved download tasks.
+
+    With more than one worker, ordered chunks of raw lines are dispatched to a pool of processes which
+    do the pre-filtering, JSON decoding and OA location selection, so that this CPU-bound work is not
+    limited to the main process. The tasks are returned in the snapshot order, and the number of
+    chunks in flight is bounded to keep the memory usage under control.
+
+    The worker processes are forked by start(), which must be called before the harvester starts its
+    other threads: forking a process while other threads hold locks (logging, tqdm, LMDB) can deadlock 
+    the forked workers.
+    """
+
+    def __init__(self, policy, nb_workers=0, chunk_size=DEFAULT_CHUNK_SIZE):
+        # compiled OA location selection policy (see oa_policy.py)
+        self.policy = policy
+        self.nb_workers = nb_workers
+        self.chunk_size = chunk_size
+        # aggregated pre-filter counts
+        self.prefilter = UnpaywallPrefilter()
+        self.executor = None
+
+    def start(self):
+        """
+        Fork the pool of worker processes, if more than one worker is used
+        """
+        if self.nb_workers is None or self.nb_workers <= 1 or self.executor is not None:
+            return
+        self.executor = start_process_pool(self.nb_workers)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def resolve(self, lines):
+        """
+        Iterate over the resolved tasks of the provided (position, raw line) pairs, as (position, task)
+        pairs in the input order
+        """
+        if self.nb_workers is None or self.nb_workers <= 1:
+            for position, line in lines:
+                task = resolve_unpaywall_line(line, self.policy, prefilter=self.prefilter)
+                if task is not None:
+                    yield position, task
+            return
+
+        self.start()
+        max_pending_chunks = self.nb_workers * 2
+        pending = deque()
+        for chunk in chunked(lines, self.chunk_size):
+            pending.append(self.executor.submit(resolve_unpaywall_chunk, chunk, self.policy))
+            if len(pending) >= max_pending_chunks:
+                for item in self._collect(pending.popleft()):
+                    yield item
+        while len(pending) > 0:
+            for item in self._collect(pending.popleft()):
+                yield item
+
+    def resolve_blocks(self, filepath, index, start_line=0):
+        """
+        Iterate over the resolved tasks of a gzipped snapshot with a block index, as (position, task) pairs 
+        in the snapshot order. The decompression of the blocks is done by the worker processes too, so that
+        it is not limited to a single core.
+        """
+        self.start()
+        resolve_range = partial(resolve_unpaywall_chunk, policy=self.policy)
+        for tasks, range_prefilter in map_block_ranges(filepath, index, resolve_range, max(self.nb_workers, 1), start_line=start_line,
+                                                       executor=self.executor):
+            self.prefilter.merge(range_prefilter)
+            for item in tasks:
+                yield item
+
+    def _collect(self, future):
+        tasks, chunk_prefilter = future.result()
+        self.prefilter.merge(chunk_prefilter)
+        return tasks
+
+def chunked(items, chunk_size):
+    """
+    Group the items of an iterable in lists of chunk_size items (the last one possibly smaller)
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
@@ -0,0 +1,201 @@
+'''
+Native resumable downloads, used for the FTP resources and as fallback of the failed HTTP downloads,
+instead of spawning wget subprocesses.
+
+It covers what was obtained from wget:
+
+- retries with an exponential backoff on network errors, timeouts and transient HTTP status (429, 5xx),
+
+- tries and backoffs bounded by the optional deadline of the download (cancelled_downloads),
+
+- resume of a partially downloaded file from its current size, with an HTTP Range request or an FTP REST
+  command, if the transfer is interrupted,
+
+- redirections, and the compressed responses: the gzip/deflate content encodings are decoded when the
+  content is streamed (the resumed requests ask for an identity encoding, as the ranges apply to the
+  encoded content), and a gzip file obtained for a PDF is decompressed by the harvester as before,
+
+- FTP downloads with ftplib (passive mode, anonymous login by default), optionally through a pool of
+  reused FTP sessions (ftp_sessions.py).
+
+The downloads are streamed to disk and checked early as for the other download methods (download_stream.py).
+'''
+
+import os
+import time
+import random
+import ftplib
+from urllib.parse import urlparse, unquote
+
+import requests
+
+from biblio_glutton_harvester.ftp_sessions import single_session
+from biblio_glutton_harvester.governor import network_governor, DOWNLOAD, REQUESTS
+from biblio_glutton_harvester.download_stream import StreamWriter, stream_response, cancelled_downloads, CHUNK_SIZE, STREAM_SUCCESS, STREAM_TOO_LARGE
+
+DEFAULT_TRIES = 4
+DEFAULT_TIMEOUT = 20
+
+# backoff between two tries, in seconds: base * 2^n with a random jitter, capped
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# HTTP status worth retrying
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+def backoff_delay(retry, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    return min(maximum, base * (2 ** retry)) * random.uniform(0.5, 1.0)
+
+def _wait_before_retry(filename, retry):
+    # the backoff does not go beyond the deadline of the download
+    delay = backoff_delay(retry)
+    remaining = cancelled_downloads.remaining(filename)
+    if remaining != None:
+        delay = min(delay, remaining)
+    time.sleep(delay)
+
+def _try_timeout(filename, timeout):
+    # the timeout of a try is bounded by the remaining time before the deadline of the download
+    remaining = cancelled_downloads.remaining(filename)
+    if remaining != None:
+        return max(1.0, min(timeout, remaining))
+    return timeout
+
+def _partial_size(filename):
+    if os.path.isfile(filename):
+        return os.path.getsize(filename)
+    return 0
+
+def _remove(filename):
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+def _truncated(response, filename, resume_from):
+    # the content length can only be checked for a response without content encoding
+    length = response.headers.get("Content-Length")
+    if length == None or not length.isdigit() or response.headers.get("Content-Encoding", "identity").lower() != "identity":
+        return False
+    return _partial_size(filename) < resume_from + int(length)
+
+def download_http(get, url, filename, headers=None, tries=DEFAULT_TRIES, timeout=DEFAULT_TIMEOUT, accepted=None, max_size=None, on_failure=None):
+    """
+    Download a HTTP(S) URL with retries and resume, get being the function performing the HTTP GET requests
+    (e.g. requests.get). Return the status of the download (None if it failed), the sniffed type of the
+    resource and its first bytes, as download_stream.stream_response(). If the download failed, the optional
+    on_failure(status_code, exception) is called with the HTTP status or the exception of the last try.
+    """
+    offset = 0
+    last_status = None
+    last_exception = None
+    for retry in range(tries):
+        if retry > 0:
+            _wait_before_retry(filename, retry - 1)
+        if cancelled_downloads.is_cancelled(filename):
+            break
+        request_headers = dict(headers) if headers != None else {}
+        if offset > 0:
+            request_headers["Range"] = "bytes=" + str(offset) + "-"
+            # ranges apply to the encoded content
+            request_headers["Accept-Encoding"] = "identity"
+        try:
+            with get(url, headers=request_headers, allow_redirects=True, verify=False, timeout=_try_timeout(filename, timeout), stream=True) as response:
+                last_status = response.status_code
+                last_exception = None
+                if response.status_code in RETRY_STATUS:
+                    continue
+                if response.status_code == 416 and offset > 0:
+                    # the partial file is not consistent with the resource anymore, restart from the beginning
+                    _remove(filename)
+                    offset = 0
+                    continue
+                if response.status_code == 206 and offset > 0:
+                    resume_from = offset
+                elif response.status_code == 200:
+                    # the range might have been ignored, the download restarts from the beginning
+                    resume_from = 0
+                else:
+                    break
+                resumable = response.headers.get("Content-Encoding", "identity").lower() == "identity" and \
+                    response.headers.get("Accept-Ranges", "bytes").lower() != "none"
+                status, kind, head = stream_response(response, filename, accepted=accepted, max_size=max_size,
+                    resume_from=resume_from, keep_partial=resumable)
+                if status == STREAM_SUCCESS and _truncated(response, filename, resume_from):
+                    # connection closed before the end of the content, without error raised by urllib3
+                    offset = _partial_size(filename) if resumable else 0
+                    if offset == 0:
+                        _remove(filename)
+                    continue
+                # a rejected or too large resource is not retried
+                return status, kind, head
+        except requests.exceptions.RequestException as e:
+            last_status = None
+            last_exception = e
+            if retry == tries - 1:
+                break
+            # the partial file is kept only if it can be resumed
+            offset = _partial_size(filename)
+    _remove(filename)
+    if on_failure != None:
+        on_failure(last_status, last_exception)
+    return None, None, b''
+
+class _AbortTransfer(Exception):
+    pass
+
+def download_ftp(url, filename, tries=DEFAULT_TRIES, timeout=DEFAULT_TIMEOUT, accepted=None, max_size=None, on_failure=None, sessions=None):
+    """
+    Download a FTP URL with retries and resume, with a session of the optional FtpSessionPool sessions or
+    a new FTP connection. Return the status of the download (None if it failed), the sniffed type of the
+    resource and its first bytes, as download_stream.stream_response(). If the download failed, the optional
+    on_failure(None, exception) is called with the exception of the last try.
+    """
+    parsed = urlparse(url)
+    user = unquote(parsed.username) if parsed.username else "anonymous"
+    password = unquote(parsed.password) if parsed.password else "anonymous@"
+    path = unquote(parsed.path)
+
+    offset = 0
+    last_exception = None
+    for retry in range(tries):
+        if retry > 0:
+            _wait_before_retry(filename, retry - 1)
+        if cancelled_downloads.is_cancelled(filename):
+            break
+        open_session = sessions.session if sessions != None else single_session
+        network_governor.throttle(REQUESTS)
+        try:
+            with open_session(parsed.hostname, parsed.port or 21, user, password, timeout=_try_timeout(filename, timeout)) as session:
+                ftp = session.ftp
+                if max_size:
+                    try:
+                        size = ftp.size(path)
+                    except ftplib.error_perm:
+                        size = None
+                    if size != None and size > max_size:
+                        return STREAM_TOO_LARGE, None, b''
+
+                with StreamWriter(filename, accepted=accepted, max_size=max_size, resume_from=offset, keep_partial=True) as writer:
+                    def write_chunk(chunk):
+                        if not writer.write(chunk):
+                            raise _AbortTransfer()
+                        network_governor.throttle(DOWNLOAD, len(chunk))
+                    try:
+                        ftp.retrbinary("RETR " + path, write_chunk, blocksize=CHUNK_SIZE, rest=offset if offset > 0 else None)
+                        writer.finish()
+                    except _AbortTransfer:
+                        # the control connection is still waiting for the end of the transfer
+                        session.discard()
+                return writer.status, writer.kind, writer.head
+        except ftplib.error_perm as e:
+            # permanent error (e.g. file not found)
+            last_exception = e
+            break
+        except (ftplib.Error, OSError, EOFError) as e:
+            last_exception = e
+            if retry == tries - 1:
+                break
+            offset = _partial_size(filename)
+    _remove(filename)
+    if on_failure != None:
+        on_failure(None, last_exception)
+    return None, None, b''
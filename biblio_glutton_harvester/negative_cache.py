@@ -0,0 +1,231 @@
+'''
+Negative cache of the download URLs.
+
+With --reprocess, every entry without PDF is processed again and all its URLs are downloaded again,
+including the URLs which returned a 404, an HTML landing page or a permanent TLS error in the previous
+runs. The outcome of the failed URLs is kept in a LMDB environment (failure class, HTTP status, time of
+the last failure and number of failed attempts), and a URL is skipped while its last failure is more
+recent than the time-to-live of its failure class. The transient failures (timeouts, connection errors,
+server errors) are not cached by default, so that reprocessing spends its time on the recoverable URLs.
+
+As several download methods are tried for a URL, the failures observed by the methods are collected in
+a FailureLog, and the URL is cached with the most transient of its failure classes (the one with the
+shortest time-to-live).
+
+The records are written by the download threads, they are buffered in memory and persisted with one LMDB
+write transaction by flush(), called at each checkpoint of the harvesting and at its end.
+'''
+
+import time
+import pickle
+import hashlib
+import threading
+from collections import Counter
+
+from biblio_glutton_harvester.download_stream import STREAM_TOO_LARGE
+
+# failure classes
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+HTML_ONLY = 'html_only'
+TOO_LARGE = 'too_large'
+TLS = 'tls'
+DNS = 'dns'
+SERVER_ERROR = 'server_error'
+NETWORK = 'network'
+
+# default time-to-live of the failure classes, in days
+DEFAULT_TTL_DAYS = {
+    NOT_FOUND: 30,
+    FORBIDDEN: 1,
+    HTML_ONLY: 14,
+    TOO_LARGE: 90,
+    TLS: 7,
+    DNS: 3,
+    SERVER_ERROR: 0,
+    NETWORK: 0
+}
+
+def classify_status(status_code):
+    """
+    Failure class of an HTTP status other than 200
+    """
+    if status_code in (404, 410):
+        return NOT_FOUND
+    if status_code in (401, 403, 451):
+        return FORBIDDEN
+    if status_code == 429 or status_code >= 500:
+        return SERVER_ERROR
+    # other client errors are considered as permanent as a missing resource
+    return NOT_FOUND
+
+def classify_stream(status, kind):
+    """
+    Failure class of an aborted streamed download (see download_stream.py)
+    """
+    if status == STREAM_TOO_LARGE:
+        return TOO_LARGE
+    return HTML_ONLY
+
+def classify_exception(exception):
+    """
+    Failure class of an exception raised by a download, looking at the chain of its causes (e.g. an SSL error
+    wrapped by urllib3 then by requests)
+    """
+    seen = set()
+    pending = [exception]
+    while len(pending) > 0:
+        current = pending.pop()
+        if current == None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        names = [cls.__name__ for cls in type(current).__mro__]
+        if "error_perm" in names:
+            # permanent FTP error, e.g. 550 file not found
+            return NOT_FOUND
+        if "gaierror" in names or "NameResolutionError" in names:
+            return DNS
+        if "SSLError" in names or "CertificateError" in names or "ClientSSLError" in names:
+            return TLS
+        message = str(current)
+        if "Name or service not known" in message or "getaddrinfo failed" in message or "nodename nor servname" in message:
+            return DNS
+        if "CERTIFICATE_VERIFY_FAILED" in message or "SSLError" in message:
+            return TLS
+        pending.append(current.__cause__)
+        pending.append(current.__context__)
+        reason = getattr(current, "reason", None)
+        if isinstance(reason, BaseException):
+            pending.append(reason)
+        pending.extend(arg for arg in current.args if isinstance(arg, BaseException))
+    return NETWORK
+
+class FailureLog(object):
+    """
+    Thread-safe collection of the failures observed by the download methods of a URL, consumed at the
+    end of the download of the URL. The failures are recorded by target file of the download, which is
+    the same for all the methods (and for the redirections they follow).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = {}
+
+    def record(self, filename, failure_class, status_code=None):
+        with self._lock:
+            self._failures.setdefault(filename, []).append((failure_class, status_code))
+
+    def pop(self, filename):
+        with self._lock:
+            return self._failures.pop(filename, [])
+
+class NegativeCache(object):
+    """
+    Persistent cache of the failed URLs, with a time-to-live by failure class
+    """
+
+    def __init__(self, env, ttl_days=None):
+        self.env = env
+        self.ttls = {}
+        for failure_class, days in DEFAULT_TTL_DAYS.items():
+            if ttl_days != None and failure_class in ttl_days and ttl_days[failure_class] != None:
+                days = ttl_days[failure_class]
+            self.ttls[failure_class] = days * 24 * 3600
+        self._lock = threading.Lock()
+        self.nb_skipped = Counter()
+        # records not persisted yet by key, None for a discarded URL
+        self._pending = {}
+
+    @classmethod
+    def from_config(cls, config, env):
+        """
+        Create the cache from the optional negative_cache section of the configuration, None if the cache is
+        disabled (enabled: false)
+        """
+        cache_config = config["negative_cache"] if "negative_cache" in config and config["negative_cache"] else {}
+        if "enabled" in cache_config and cache_config["enabled"] == False:
+            return None
+        ttl_days = cache_config["ttl_days"] if "ttl_days" in cache_config else None
+        return cls(env, ttl_days)
+
+    def _key(self, url):
+        # LMDB keys are limited to 511 bytes
+        return hashlib.sha1(url.encode(encoding='UTF-8')).digest()
+
+    def lookup(self, url):
+        """
+        Return the cached failure record of a URL (possibly expired), None if the URL is not cached
+        """
+        key = self._key(url)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+        with self.env.begin() as txn:
+            value = txn.get(key)
+        if value == None:
+            return None
+        return pickle.loads(value)
+
+    def is_fresh(self, record):
+        """
+        Return True if the URL of the record is still to be skipped
+        """
+        ttl = self.ttls.get(record["failure_class"], 0)
+        return ttl > 0 and time.time() < record["timestamp"] + ttl
+
+    def skip(self, record):
+        with self._lock:
+            self.nb_skipped[record["failure_class"]] += 1
+
+    def record(self, url, failures, previous=None):
+        """
+        Cache a failed URL with the most transient of the observed failures, a list of (failure class, HTTP
+        status) pairs
+        """
+        if len(failures) == 0:
+            return
+        failure_class, status_code = min(failures, key=lambda failure: self.ttls.get(failure[0], 0))
+        record = {
+            "url": url,
+            "failure_class": failure_class,
+            "status": status_code,
+            "timestamp": time.time(),
+            "attempts": previous["attempts"] + 1 if previous != None else 1
+        }
+        with self._lock:
+            self._pending[self._key(url)] = record
+
+    def discard(self, url):
+        with self._lock:
+            self._pending[self._key(url)] = None
+
+    def flush(self):
+        """
+        Persist the records and the discarded URLs since the last flush
+        """
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+            with self.env.begin(write=True) as txn:
+                for key, record in self._pending.items():
+                    if record == None:
+                        txn.delete(key)
+                    else:
+                        txn.put(key, pickle.dumps(record))
+            self._pending = {}
+
+    def report(self):
+        self.flush()
+        nb_cached = Counter()
+        nb_fresh = 0
+        with self.env.begin() as txn:
+            for _, value in txn.cursor():
+                record = pickle.loads(value)
+                nb_cached[record["failure_class"]] += 1
+                if self.is_fresh(record):
+                    nb_fresh += 1
+        with self._lock:
+            nb_skipped = sum(self.nb_skipped.values())
+        print("failed URLs cached:", sum(nb_cached.values()), "- still skipped:", nb_fresh, "- skipped during this run:", nb_skipped)
+        for failure_class, nb in nb_cached.most_common():
+            print("   ", failure_class + ":", nb, "URLs (time-to-live:", str(round(self.ttls.get(failure_class, 0) / (24 * 3600), 1)), "days)")
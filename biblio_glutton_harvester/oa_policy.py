@@ -0,0 +1,231 @@
+'''
+Selection policy of the OA locations of the Unpaywall entries.
+
+The policy is compiled once from the configuration: the options are resolved as booleans and the
+host-specific behaviors are expressed as a table of location rules, each rule matching URL patterns
+(host names, possibly followed by a path prefix) of a location field:
+
+- preference rules select a location as best location, the rule with the highest priority having a
+  match wins (e.g. a location served by a local mirror is always preferred),
+
+- skip rules exclude the matching locations from the best and alternative locations (e.g. IEEE).
+
+The best and alternative locations of an entry are then selected with a single pass over its OA locations.
+New host rules can be added with add_rule(), or for skipping a host via the configuration, with a
+resource having a skip field and the list of its hosts, for example:
+
+    resources:
+        example:
+            skip: true
+            hosts: ["example.org", "example.com"]
+
+The selection cost can be measured independently from the harvesting:
+
+> python3 -m biblio_glutton_harvester.oa_policy --unpaywall unpaywall_snapshot.jsonl.gz --n 100000
+'''
+
+import os
+import json
+import gzip
+import time
+import argparse
+import yaml
+
+# default hosts of the known resources which can be skipped
+DEFAULT_SKIP_HOSTS = {
+    "ieee": ["ieee.org"]
+}
+
+PMC_PATTERNS = ['europepmc.org/articles/pmc', 'ncbi.nlm.nih.gov/pmc/articles']
+ARXIV_PATTERNS = ['arxiv.org']
+PLOS_PATTERNS = ['plos.org']
+
+class LocationRule(object):
+    """
+    Rule matching the OA locations having one of the patterns in the given field (url_for_pdf or url)
+    """
+
+    def __init__(self, name, patterns, field='url_for_pdf', skip=False, priority=0, from_mirror=False, last_match=False):
+        self.name = name
+        self.patterns = tuple(patterns)
+        self.field = field
+        # if true, the matching locations are never used, otherwise they are preferred as best location
+        self.skip = skip
+        # among the preference rules having a match, the one with the highest priority is used
+        self.priority = priority
+        # the preferred location will be downloaded from a local mirror
+        self.from_mirror = from_mirror
+        # if true, the last matching location is preferred instead of the first one
+        self.last_match = last_match
+
+    def matches(self, oa_location):
+        value = oa_location.get(self.field)
+        if not value:
+            return False
+        for pattern in self.patterns:
+            if pattern in value:
+                return True
+        return False
+
+class OALocationPolicy(object):
+
+    def __init__(self, prioritize_pmc=False, arxiv_mirror=False, plos_mirror=False, rules=None):
+        self.prioritize_pmc = prioritize_pmc
+        self.arxiv_mirror = arxiv_mirror
+        self.plos_mirror = plos_mirror
+        self.preference_rules = []
+        self.skip_patterns = ()
+        if rules != None:
+            for rule in rules:
+                self.add_rule(rule)
+
+    @classmethod
+    def from_config(cls, config, arxiv_mirror=False, plos_mirror=False):
+        """
+        Compile the policy from the configuration, the availability of the arXiv and PLOS mirrors
+        being resolved by the harvester
+        """
+        resources = config["resources"] if "resources" in config and config["resources"] else {}
+        prioritize_pmc = bool("pmc" in resources and resources["pmc"] and "prioritize_pmc" in resources["pmc"] and resources["pmc"]["prioritize_pmc"])
+        policy = cls(prioritize_pmc=prioritize_pmc, arxiv_mirror=arxiv_mirror, plos_mirror=plos_mirror)
+
+        # if requested, we always prioritize PMC pdf over publisher one for higher chance of successful download
+        if prioritize_pmc:
+            policy.add_rule(LocationRule("pmc", PMC_PATTERNS, priority=1, last_match=True))
+        # if we have a mirror of arXiv, we prioritize arxiv resources for higher chance of successful download
+        if arxiv_mirror:
+            policy.add_rule(LocationRule("arxiv", ARXIV_PATTERNS, field='url', priority=2, from_mirror=True))
+        # if we have a PLOS resource, we use the PLOS PDF url, but also the PLOS mirror to get the JATS and TEI full text versions
+        if plos_mirror:
+            policy.add_rule(LocationRule("plos", PLOS_PATTERNS, priority=3, from_mirror=True))
+
+        # optionally, skip some hosts (e.g. IEEE)
+        for name in resources:
+            resource = resources[name]
+            if not resource or not "skip" in resource or not resource["skip"]:
+                continue
+            hosts = resource["hosts"] if "hosts" in resource and resource["hosts"] else DEFAULT_SKIP_HOSTS.get(name)
+            if hosts:
+                policy.add_rule(LocationRule(name, hosts, skip=True))
+        return policy
+
+    def add_rule(self, rule):
+        if rule.skip:
+            self.skip_patterns += rule.patterns
+        else:
+            self.preference_rules.append(rule)
+            # highest priority first
+            self.preference_rules.sort(key=lambda the_rule: -the_rule.priority)
+
+    def is_skipped(self, url):
+        for pattern in self.skip_patterns:
+            if pattern in url:
+                return True
+        return False
+
+    def select(self, entry):
+        """
+        Select the best OA location of an Unpaywall entry and the alternative locations to be tried if
+        the download fails, updating the entry. Return True if the best location has been chosen because
+        a mirror (arXiv, PLOS) is available for it.
+
+        The PMC archive substitution (download the NIH tar archive instead of the PMC PDF when the PMC ID
+        is known) requires an LMDB look-up and possibly the biblio-glutton metadata, so it is applied
+        afterwards by the harvester.
+        """
+        oa_locations = entry['oa_locations'] if 'oa_locations' in entry and entry['oa_locations'] else []
+
+        # single pass over the locations: first match of each preference rule, first location marked as best
+        # with a PDF URL, and the usable (not skipped) locations with a PDF URL
+        nb_rules = len(self.preference_rules)
+        preferred = [None] * nb_rules
+        first_is_best = None
+        usable_locations = []
+        for oa_location in oa_locations:
+            for index in range(nb_rules):
+                rule = self.preference_rules[index]
+                if (preferred[index] is None or rule.last_match) and rule.matches(oa_location):
+                    preferred[index] = oa_location
+            url_for_pdf = oa_location.get('url_for_pdf')
+            if url_for_pdf != None:
+                if first_is_best is None and 'is_best' in oa_location and oa_location['is_best']:
+                    first_is_best = oa_location
+                if not self.is_skipped(url_for_pdf):
+                    usable_locations.append(oa_location)
+
+        # a location matching a preference rule replaces the best location indicated by Unpaywall
+        from_mirror = False
+        best_oa_location = entry['best_oa_location'] if 'best_oa_location' in entry else None
+        for index in range(nb_rules):
+            if preferred[index] is not None:
+                best_oa_location = preferred[index]
+                from_mirror = self.preference_rules[index].from_mirror
+                break
+
+        # if the best location has no usable 'url_for_pdf' field, we take the location identified with
+        # a "is_best" attribute and a valid link to a PDF
+        if best_oa_location == None or best_oa_location.get('url_for_pdf') == None:
+            best_oa_location = first_is_best
+            from_mirror = False
+
+        # skipped hosts are never used
+        if best_oa_location != None and self.is_skipped(best_oa_location['url_for_pdf']):
+            best_oa_location = None
+            from_mirror = False
+
+        # if still no best location, take the first one with a valid link to a PDF
+        # otherwise, we store alternative non-best PDF URL to improve chance of download
+        for oa_location in usable_locations:
+            if best_oa_location == None:
+                best_oa_location = oa_location
+            elif best_oa_location != oa_location:
+                if not 'alternative_oa_locations' in entry:
+                    entry['alternative_oa_locations'] = []
+                entry['alternative_oa_locations'].append(oa_location)
+
+        if best_oa_location != None:
+            entry['best_oa_location'] = best_oa_location
+        elif 'best_oa_location' in entry:
+            del entry['best_oa_location']
+        return from_mirror
+
+def benchmark(unpaywall, policy, nb_entries=100000):
+    """
+    Measure the selection time of the OA locations on the first entries of an Unpaywall file, excluding
+    the decompression and the JSON decoding
+    """
+    entries = []
+    with gzip.open(unpaywall, 'rb') as gz:
+        for line in gz:
+            entries.append(json.loads(line))
+            if len(entries) == nb_entries:
+                break
+
+    start_time = time.perf_counter()
+    nb_best = 0
+    for entry in entries:
+        policy.select(entry)
+        if 'best_oa_location' in entry:
+            nb_best += 1
+    runtime = time.perf_counter() - start_time
+    print("selection for", str(len(entries)), "entries:", round(runtime, 3), "seconds,", str(nb_best), "entries with a best location")
+    if len(entries) > 0:
+        print("average selection time:", round(runtime * 1000000 / len(entries), 3), "microseconds per entry")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark of the OA location selection policy")
+    parser.add_argument("--unpaywall", default=None, help="path to the Unpaywall dataset (gzipped)")
+    parser.add_argument("--config", default="./config.yaml", help="path to the config file, default is ./config.yaml")
+    parser.add_argument("--n", type=int, default=100000, help="number of entries used for the benchmark")
+    parser.add_argument("--arxiv-mirror", action="store_true", help="simulate an available arXiv mirror")
+    parser.add_argument("--plos-mirror", action="store_true", help="simulate an available PLOS mirror")
+
+    args = parser.parse_args()
+
+    if args.unpaywall == None or not os.path.isfile(args.unpaywall):
+        print("error: the indicated path to the Unpaywall file is not valid", args.unpaywall)
+    else:
+        with open(args.config) as the_file:
+            config = yaml.safe_load(the_file)
+        policy = OALocationPolicy.from_config(config, arxiv_mirror=args.arxiv_mirror, plos_mirror=args.plos_mirror)
+        benchmark(args.unpaywall, policy, args.n)
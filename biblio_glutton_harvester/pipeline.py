@@ -0,0 +1,264 @@
+'''
+Streaming harvesting pipeline.
+
+The harvesting was previously done by synchronous batches: download a batch of entries, wait for the
+slowest download of the batch, then validate and store the batch and wait again before reading the next
+entries. A single slow host was enough to leave most of the download workers idle at every batch tail.
+
+Here the entries flow continuously through stages connected by bounded queues:
+
+    ingestion (caller thread) -> [metadata enrichment (thread pool)] -> per-host scheduling -> download (thread pool) 
+        -> validation/commit (one thread, LMDB writes) -> storage: thumbnail, compression, upload, cleaning (thread pool)
+
+Each stage has its own workers, and a full queue blocks the previous stage (backpressure), so the memory
+usage stays bounded while a slow download only holds one download worker. The downloads are dispatched
+in round-robin over the hosts, within the politeness limits of each host (see politeness.py).
+
+As entries complete out of order, the pipeline keeps track of the oldest submitted entry not yet completed,
+which gives the position from which a harvesting can be safely resumed.
+'''
+
+import time
+import threading
+import queue
+from collections import deque
+
+from biblio_glutton_harvester.politeness import PolitenessScheduler, url_host
+
+# logging
+import logging
+import logging.handlers
+
+DEFAULT_DOWNLOAD_WORKERS = 12
+DEFAULT_STORAGE_WORKERS = 12
+DEFAULT_ENRICHMENT_WORKERS = 16
+DEFAULT_QUEUE_SIZE = 100
+
+# end of stream marker in the queues
+_END = object()
+
+class HarvestPipeline(object):
+    """
+    Pipeline of the harvesting stages:
+    - download(url, filename, entry) returns a (status, entry) pair,
+    - commit((status, entry)) validates the downloaded files and records the result, returning True if the
+      entry has to go through the storage stage, it is always executed in the same thread (required for
+      the LMDB write transactions),
+    - store(entry) manages the harvested files of a successful entry,
+    - optionally, enrich(url, filename, entry, context) completes the entry (e.g. with biblio-glutton metadata)
+      before its download and returns the (url, filename) to be downloaded, the context being the one given
+      at submission,
+    - optionally, scheduler is the PolitenessScheduler dispatching the downloads, and download_host(url) 
+      gives the host of a download for the scheduler (None for a download without host limits),
+    - optionally, download_engine replaces the download threads (e.g. AsyncDownloadEngine), it is started
+      with start(scheduler, deliver, fail, limit, is_success) and returns its threads,
+    - optionally, download_limit and storage_limit are AdaptiveLimit adjusting the number of downloads in
+      flight and of entries stored in parallel, the number of workers of the stage being then the maximum
+      of the limit, and is_success(result) indicates if a download succeeded.
+    """
+
+    def __init__(self, download, commit, store, download_workers=DEFAULT_DOWNLOAD_WORKERS,
+                 storage_workers=DEFAULT_STORAGE_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, 
+                 enrich=None, enrichment_workers=DEFAULT_ENRICHMENT_WORKERS, scheduler=None, download_host=url_host,
+                 download_engine=None, download_limit=None, storage_limit=None, is_success=None):
+        self.download = download
+        self.commit = commit
+        self.store = store
+        self.enrich = enrich
+        self.download_limit = download_limit
+        self.storage_limit = storage_limit
+        self.is_success = is_success
+        self.download_workers = max(download_limit.maximum if download_limit != None else download_workers, 1)
+        self.storage_workers = max(storage_limit.maximum if storage_limit != None else storage_workers, 1)
+        self.enrichment_workers = max(enrichment_workers, 1) if enrich != None else 0
+
+        self.enrichment_queue = queue.Queue(maxsize=queue_size)
+        # without politeness limits, the downloads are only interleaved over the hosts
+        self.scheduler = scheduler if scheduler != None else PolitenessScheduler()
+        self.download_host = download_host
+        self.commit_queue = queue.Queue(maxsize=queue_size)
+        self.storage_queue = queue.Queue(maxsize=queue_size)
+
+        # positions of the submitted entries not yet completed, in submission order
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._completed = set()
+
+        self.nb_submitted = 0
+        self.nb_completed = 0
+        self.nb_errors = 0
+
+        # the downloads are slowed down when the local stages do not keep up
+        if download_limit != None and download_limit.saturated == None:
+            download_limit.saturated = self._local_backlog
+
+        self._enrichment_threads = [self._start_thread(self._enrichment_worker, "enrichment-" + str(i)) for i in range(self.enrichment_workers)]
+        if download_engine != None:
+            self._download_threads = download_engine.start(self.scheduler, self._deliver_download, self._error, 
+                limit=download_limit, is_success=is_success)
+        else:
+            self._download_threads = [self._start_thread(self._download_worker, "download-" + str(i)) for i in range(self.download_workers)]
+        self._commit_thread = self._start_thread(self._commit_worker, "commit")
+        self._storage_threads = [self._start_thread(self._storage_worker, "storage-" + str(i)) for i in range(self.storage_workers)]
+        self._closed = False
+
+    def _start_thread(self, target, name):
+        # daemon threads, so that an interrupted harvesting does not wait for the pending downloads
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def submit(self, position, url, filename, entry, context=None):
+        """
+        Add an entry to be harvested, blocking while the first queue is full. The positions of the
+        submitted entries must be increasing. With an enrichment stage, url and filename can be None if 
+        they are resolved by the enrichment.
+        """
+        with self._lock:
+            self._pending.append(position)
+            self.nb_submitted += 1
+        if self.enrich != None:
+            self.enrichment_queue.put((position, url, filename, entry, context))
+        else:
+            self._schedule_download(position, url, filename, entry)
+
+    def _schedule_download(self, position, url, filename, entry):
+        self.scheduler.put(self.download_host(url), (position, url, filename, entry))
+
+    def safe_position(self, next_position):
+        """
+        Return the position from which the harvesting can be resumed without missing any entry, given the
+        position of the next entry to be submitted
+        """
+        with self._lock:
+            while len(self._pending) > 0 and self._pending[0] in self._completed:
+                self._completed.remove(self._pending.popleft())
+            if len(self._pending) > 0:
+                return self._pending[0]
+        return next_position
+
+    def close(self):
+        """
+        Wait for the completion of all the submitted entries and stop the workers
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._enrichment_threads:
+            self.enrichment_queue.put(_END)
+        for thread in self._enrichment_threads:
+            thread.join()
+        self.scheduler.close()
+        for thread in self._download_threads:
+            thread.join()
+        self.commit_queue.put(_END)
+        self._commit_thread.join()
+        for _ in self._storage_threads:
+            self.storage_queue.put(_END)
+        for thread in self._storage_threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        return False
+
+    def _complete(self, position):
+        with self._lock:
+            self._completed.add(position)
+            self.nb_completed += 1
+
+    def _error(self, stage, position):
+        logging.exception("harvesting pipeline, error at stage " + stage + " for entry at position " + str(position))
+        with self._lock:
+            self.nb_errors += 1
+        self._complete(position)
+
+    def _enrichment_worker(self):
+        while True:
+            task = self.enrichment_queue.get()
+            if task is _END:
+                break
+            position, url, filename, entry, context = task
+            try:
+                url, filename = self.enrich(url, filename, entry, context)
+            except Exception:
+                self._error("enrichment", position)
+                continue
+            if url == None:
+                # nothing to download for this entry
+                self._complete(position)
+                continue
+            self._schedule_download(position, url, filename, entry)
+
+    def _local_backlog(self):
+        return self.commit_queue.full() or self.storage_queue.full()
+
+    def _download_worker(self):
+        while True:
+            if self.download_limit != None:
+                self.download_limit.acquire()
+            scheduled = self.scheduler.get()
+            if scheduled is None:
+                if self.download_limit != None:
+                    self.download_limit.cancel()
+                break
+            host, (position, url, filename, entry) = scheduled
+            start_time = time.monotonic()
+            failed = True
+            try:
+                result = self.download(url, filename, entry)
+                failed = self.is_success != None and not self.is_success(result)
+            except Exception:
+                self._error("download", position)
+                continue
+            finally:
+                self.scheduler.release(host)
+                if self.download_limit != None:
+                    self.download_limit.release(time.monotonic() - start_time, failed)
+            self._deliver_download(position, result)
+
+    def _deliver_download(self, position, result):
+        self.commit_queue.put((position, result))
+
+    def _commit_worker(self):
+        while True:
+            task = self.commit_queue.get()
+            if task is _END:
+                break
+            position, result = task
+            try:
+                to_store = self.commit(result)
+            except Exception:
+                self._error("commit", position)
+                continue
+            if to_store:
+                self.storage_queue.put((position, result[1]))
+            else:
+                self._complete(position)
+
+    def _storage_worker(self):
+        while True:
+            if self.storage_limit != None:
+                self.storage_limit.acquire()
+            task = self.storage_queue.get()
+            if task is _END:
+                if self.storage_limit != None:
+                    self.storage_limit.cancel()
+                break
+            position, entry = task
+            start_time = time.monotonic()
+            failed = True
+            try:
+                self.store(entry)
+                failed = False
+            except Exception:
+                self._error("storage", position)
+                continue
+            finally:
+                if self.storage_limit != None:
+                    self.storage_limit.release(time.monotonic() - start_time, failed)
+            self._complete(position)
@@ -0,0 +1,309 @@
+'''
+Per-host politeness of the downloads.
+
+The entries arrive in the order of the snapshot, where many consecutive entries can come from the same
+publisher. Dispatching them in this order to the download workers can hit the same server dozens of
+times at once, leading to throttling, 429 responses or bans.
+
+The scheduler keeps one queue of download tasks per host and dispatches the tasks in round-robin over
+the hosts, so that the download workers stay busy with other hosts while a host is at its limits. The
+limits of a host are a maximum number of concurrent downloads and a token bucket limiting the number of
+download starts per second. Default limits apply to every host, and they can be overridden per domain
+(a domain also applies to its sub-domains), for example in the config file:
+
+    politeness:
+        max_concurrent: 4
+        requests_per_second: 2
+        lookahead: 5000
+        max_host_tasks: 1250
+        domains:
+            europepmc.org:
+                max_concurrent: 8
+                requests_per_second: 10
+
+The look-ahead is the number of tasks waiting in the scheduler, independently of the batch size of the
+other stages of the pipeline. A host can only take max_host_tasks places of the look-ahead (a quarter
+by default): the following tasks of a host at this share are parked aside, within a second budget of
+lookahead tasks, so that a long run of entries from a single host does not fill the look-ahead and block
+the tasks of the other hosts following it in the snapshot. The scheduler only blocks when the look-ahead
+is full, or when a task has to be parked and the parked tasks budget is exhausted.
+
+The downloads started outside of the dispatched tasks, such as the hedged downloads of the alternative
+locations of an entry, take a slot of their host with acquire() and are counted in the same limits.
+'''
+
+import time
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+# number of download tasks waiting in the scheduler
+DEFAULT_LOOKAHEAD = 5000
+
+# default share of the look-ahead which can be taken by the tasks of a single host
+DEFAULT_HOST_SHARE = 0.25
+
+class HostLimits(object):
+    """
+    Limits applied to the downloads from a host, None meaning no limit
+    """
+
+    def __init__(self, max_concurrent=None, requests_per_second=None, burst=None):
+        self.max_concurrent = max_concurrent
+        self.requests_per_second = requests_per_second
+        # maximum number of download starts in a burst after an idle period
+        if burst == None and requests_per_second:
+            burst = max(1, requests_per_second)
+        self.burst = burst
+
+    @classmethod
+    def from_config(cls, config, defaults=None):
+        """
+        Create limits from a config section, the limits not indicated being taken from the defaults
+        """
+        if defaults == None:
+            defaults = cls()
+        if not config:
+            return defaults
+        max_concurrent = config["max_concurrent"] if "max_concurrent" in config else defaults.max_concurrent
+        requests_per_second = config["requests_per_second"] if "requests_per_second" in config else defaults.requests_per_second
+        if "burst" in config:
+            burst = config["burst"]
+        elif "requests_per_second" in config:
+            # derived from the overridden rate
+            burst = None
+        else:
+            burst = defaults.burst
+        return cls(max_concurrent=max_concurrent, requests_per_second=requests_per_second, burst=burst)
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, now):
+        """
+        Time to wait before a token is available
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+class _HostQueue(object):
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.tasks = deque()
+        # tasks beyond the share of the host in the look-ahead
+        self.parked = deque()
+        self.active = 0
+        self.bucket = None
+        if limits.requests_per_second:
+            self.bucket = TokenBucket(limits.requests_per_second, limits.burst)
+
+class PolitenessScheduler(object):
+    """
+    Thread-safe bounded queue of download tasks, dispatched in round-robin over the hosts within the
+    limits of each host. A task obtained with get() must be released with release() when its download
+    is finished.
+    """
+
+    def __init__(self, capacity=DEFAULT_LOOKAHEAD, default_limits=None, domain_limits=None, host_capacity=None):
+        self.capacity = max(capacity, 1)
+        if host_capacity == None:
+            host_capacity = int(self.capacity * DEFAULT_HOST_SHARE)
+        self.host_capacity = min(max(host_capacity, 1), self.capacity)
+        self.default_limits = default_limits if default_limits != None else HostLimits()
+        self.domain_limits = domain_limits if domain_limits != None else {}
+        self._no_limits = HostLimits()
+        self._cond = threading.Condition()
+        self._hosts = {}
+        # hosts having queued tasks, in dispatch order
+        self._ready = deque()
+        self._size = 0
+        self._nb_parked = 0
+        self._closed = False
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the scheduler from the optional politeness section of the configuration, without any section
+        the tasks are only interleaved over the hosts
+        """
+        default_limits = HostLimits()
+        domain_limits = {}
+        capacity = DEFAULT_LOOKAHEAD
+        host_capacity = None
+        if "politeness" in config and config["politeness"]:
+            politeness_config = config["politeness"]
+            if "lookahead" in politeness_config and politeness_config["lookahead"]:
+                capacity = politeness_config["lookahead"]
+            if "max_host_tasks" in politeness_config and politeness_config["max_host_tasks"]:
+                host_capacity = politeness_config["max_host_tasks"]
+            default_limits = HostLimits.from_config(politeness_config)
+            if "domains" in politeness_config and politeness_config["domains"]:
+                for domain in politeness_config["domains"]:
+                    domain_limits[domain.lower()] = HostLimits.from_config(politeness_config["domains"][domain], default_limits)
+        return cls(capacity, default_limits=default_limits, domain_limits=domain_limits, host_capacity=host_capacity)
+
+    def limits(self, host):
+        """
+        Limits of a host: the ones of its most specific configured domain, or the default ones
+        """
+        if host == None:
+            return self._no_limits
+        domain = host.lower()
+        while True:
+            if domain in self.domain_limits:
+                return self.domain_limits[domain]
+            dot = domain.find('.')
+            if dot == -1:
+                return self.default_limits
+            domain = domain[dot+1:]
+
+    def put(self, host, task):
+        """
+        Add a task for the given host (None for a task without host limits), blocking while the look-ahead
+        is full, or while the parked tasks budget is exhausted if the host already has its share of the
+        look-ahead
+        """
+        with self._cond:
+            while True:
+                host_queue = self._hosts.get(host)
+                if host_queue != None and (len(host_queue.parked) > 0 or len(host_queue.tasks) >= self.host_capacity):
+                    if self._nb_parked < self.capacity:
+                        host_queue.parked.append(task)
+                        self._nb_parked += 1
+                        break
+                elif self._size < self.capacity:
+                    if host_queue == None:
+                        host_queue = _HostQueue(self.limits(host))
+                        self._hosts[host] = host_queue
+                    if len(host_queue.tasks) == 0:
+                        self._ready.append(host)
+                    host_queue.tasks.append(task)
+                    self._size += 1
+                    break
+                self._cond.wait()
+            self._cond.notify_all()
+
+    def get(self):
+        """
+        Return the next (host, task) to be processed within the host limits, blocking until one is
+        available, or None when the scheduler is closed and empty
+        """
+        with self._cond:
+            while True:
+                if self._size == 0 and self._closed:
+                    return None
+                now = time.monotonic()
+                wait = None
+                for _ in range(len(self._ready)):
+                    host = self._ready[0]
+                    # the examined host goes to the end of the rotation
+                    self._ready.rotate(-1)
+                    host_queue = self._hosts[host]
+                    delay = self._delay(host_queue, now)
+                    if delay != 0:
+                        if delay != None:
+                            wait = delay if wait == None else min(wait, delay)
+                        continue
+                    self._start(host_queue, now)
+                    task = host_queue.tasks.popleft()
+                    self._size -= 1
+                    if len(host_queue.parked) > 0:
+                        # the parked task takes the place freed in the look-ahead
+                        host_queue.tasks.append(host_queue.parked.popleft())
+                        self._nb_parked -= 1
+                        self._size += 1
+                    if len(host_queue.tasks) == 0:
+                        self._ready.pop()
+                    self._cond.notify_all()
+                    return host, task
+                self._cond.wait(wait)
+
+    def _delay(self, host_queue, now):
+        """
+        Time to wait before a download can start from the host, None if the host is at its maximum number of
+        concurrent downloads
+        """
+        limits = host_queue.limits
+        if limits.max_concurrent and host_queue.active >= limits.max_concurrent:
+            return None
+        if host_queue.bucket != None:
+            return host_queue.bucket.delay(now)
+        return 0
+
+    def _start(self, host_queue, now):
+        if host_queue.bucket != None:
+            host_queue.bucket.take(now)
+        host_queue.active += 1
+
+    def acquire(self, host, timeout=None):
+        """
+        Take a download slot of a host within its limits, for a download not dispatched by the scheduler
+        (e.g. a hedged download of an alternative location), blocking at most timeout seconds. Return True
+        if the slot is taken, it must then be released with release().
+        """
+        deadline = time.monotonic() + timeout if timeout != None else None
+        with self._cond:
+            while True:
+                host_queue = self._hosts.get(host)
+                if host_queue == None:
+                    host_queue = _HostQueue(self.limits(host))
+                    self._hosts[host] = host_queue
+                now = time.monotonic()
+                delay = self._delay(host_queue, now)
+                if delay == 0:
+                    self._start(host_queue, now)
+                    return True
+                if deadline != None:
+                    if now >= deadline:
+                        self._forget(host)
+                        return False
+                    delay = deadline - now if delay == None else min(delay, deadline - now)
+                self._cond.wait(delay)
+
+    def release(self, host):
+        with self._cond:
+            host_queue = self._hosts[host]
+            host_queue.active -= 1
+            self._forget(host)
+            self._cond.notify_all()
+
+    def _forget(self, host):
+        host_queue = self._hosts[host]
+        # the state of an idle host is kept only while its token bucket is not refilled
+        if host_queue.active == 0 and len(host_queue.tasks) == 0:
+            if host_queue.bucket == None or host_queue.bucket.is_full(time.monotonic()):
+                del self._hosts[host]
+
+    def close(self):
+        """
+        No more tasks will be added, get() returns None once all the tasks are dispatched
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+def url_host(url):
+    try:
+        return urlparse(url).hostname
+    except ValueError:
+        return None
@@ -0,0 +1,121 @@
+'''
+Registry of the harvested entries, mapping their strong identifier (DOI, or PMC ID for PMC harvesting)
+to the UUID used to store their resources.
+
+Looking-up and registering the identifiers one entry at a time means one LMDB transaction per entry,
+which at the scale of a full Unpaywall snapshot is a major hot spot (and leaked read transactions are
+exhausting the LMDB reader slots). Here the entries are processed by chunks: one read transaction with
+a single cursor pass for the look-ups of a chunk, one read transaction for checking the records of the
+already registered entries, and one write transaction committing all the new UUIDs of the chunk.
+
+The UUID of a new entry is registered when the entry is read, before its harvesting. An entry registered
+but without record in the harvested entries has not been committed (it was in the pipeline when a previous
+harvesting was interrupted), so it is harvested again with its registered UUID.
+'''
+
+import uuid
+import pickle
+
+class IdentifierRegistry(object):
+
+    def __init__(self, env_doi, env_entries):
+        # lmdb environment for the mapping between doi/pmcid and uuid
+        self.env_doi = env_doi
+        # lmdb environment storing the harvested entries by uuid
+        self.env_entries = env_entries
+
+    def get(self, identifier):
+        """
+        Return the UUID (bytes) registered for the identifier, None if the identifier is not registered
+        """
+        with self.env_doi.begin() as txn:
+            return txn.get(identifier.encode(encoding='UTF-8'))
+
+    def lookup(self, identifiers):
+        """
+        Return a dict mapping the registered identifiers among the provided ones to their UUID
+        """
+        result = {}
+        keys = sorted(set([identifier.encode(encoding='UTF-8') for identifier in identifiers]))
+        if len(keys) == 0:
+            return result
+        with self.env_doi.begin() as txn:
+            cursor = txn.cursor()
+            for key, value in cursor.getmulti(keys):
+                result[key.decode(encoding='UTF-8')] = value.decode(encoding='UTF-8')
+        return result
+
+    def records(self, uuids):
+        """
+        Return a dict mapping the provided UUID which have a record in the harvested entries to this record,
+        the record being written when the harvesting of the entry is committed (successful or not)
+        """
+        result = {}
+        keys = sorted(set([local_uuid.encode(encoding='UTF-8') for local_uuid in uuids]))
+        if len(keys) == 0:
+            return result
+        with self.env_entries.begin() as txn:
+            cursor = txn.cursor()
+            for key, value in cursor.getmulti(keys):
+                result[key.decode(encoding='UTF-8')] = pickle.loads(value)
+        return result
+
+    def register(self, mapping):
+        """
+        Register the provided identifier to UUID mapping in a single write transaction
+        """
+        if len(mapping) == 0:
+            return
+        items = [(identifier.encode(encoding='UTF-8'), local_uuid.encode(encoding='UTF-8')) for identifier, local_uuid in mapping.items()]
+        with self.env_doi.begin(write=True) as txn:
+            cursor = txn.cursor()
+            cursor.putmulti(items)
+
+    def register_entries(self, entries, reprocess=False):
+        """
+        Assign a UUID to a chunk of entries (dict with the identifier under the key 'doi'), registering the new ones.
+        Return a list of booleans aligned with the entries, indicating which entries have to be harvested:
+        new entries, registered entries whose harvesting has never been committed (entries in flight when a
+        previous harvesting was interrupted), and in reprocess mode the already registered entries without 
+        harvested PDF.
+        """
+        registered = self.lookup([entry['doi'] for entry in entries])
+        records = self.records([registered[entry['doi']] for entry in entries if entry['doi'] in registered])
+
+        result = []
+        new_mapping = {}
+        # UUID of the registered entries already scheduled in this chunk
+        scheduled = set()
+        for entry in entries:
+            identifier = entry['doi']
+            if identifier in new_mapping:
+                # the same identifier appears several times in the chunk, it is already scheduled
+                result.append(False)
+                continue
+            if identifier in registered:
+                local_uuid = registered[identifier]
+                if local_uuid in scheduled:
+                    result.append(False)
+                elif not local_uuid in records:
+                    # registered but never committed, the harvesting of the entry has been interrupted
+                    entry['id'] = local_uuid
+                    result.append(True)
+                elif reprocess and not _has_pdf(records[local_uuid]):
+                    # no PDF harvested for this entry, so we consider the entry for reprocessing
+                    entry['id'] = local_uuid
+                    result.append(True)
+                else:
+                    # we don't reprocess existing entries (or entries with an already harvested PDF)
+                    result.append(False)
+                scheduled.add(local_uuid)
+                continue
+            # store a UUID
+            entry['id'] = str(uuid.uuid4())
+            new_mapping[identifier] = entry['id']
+            result.append(True)
+
+        self.register(new_mapping)
+        return result
+
+def _has_pdf(local_entry):
+    return local_entry != None and "resources" in local_entry and "pdf" in local_entry["resources"]
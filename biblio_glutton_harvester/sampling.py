@@ -0,0 +1,108 @@
+'''
+Random sampling of the lines of a harvesting input file, as used by the --sample option.
+
+Two strategies are used, both with a constant cost per line and giving exactly the requested
+number of distinct lines (or all the lines if the file is smaller than the sample):
+
+- when the number of lines is known (e.g. from the line count sidecar file of the snapshot), the
+  sampled positions are drawn up-front without replacement and consumed in order with a cursor,
+  so the selected entries are processed as the file is read,
+
+- when the number of lines is not known, a reservoir sampling (Li's Algorithm L) is applied in a
+  single pass, the selected lines are kept in memory and processed at the end of the pass in their
+  original order.
+
+The sampling is reproducible when a seed is given. Header lines at the beginning of the file (e.g. the
+generation date of a PMC file list) can be excluded from the sampled lines.
+'''
+
+import math
+import random
+
+class LineSampler(object):
+
+    def __init__(self, sample_size, total=None, seed=None, header_lines=0):
+        if sample_size < 0:
+            raise ValueError("sample size must be positive: " + str(sample_size))
+        self.sample_size = sample_size
+        self.total = total
+        # number of lines at the beginning of the file which are never sampled
+        self.header_lines = header_lines
+        self.random = random.Random(seed)
+
+    def sample(self, lines):
+        """
+        Iterate over the sampled lines, as (position, line) pairs ordered by position
+        """
+        if self.total is not None:
+            return self._sample_sorted_positions(lines)
+        else:
+            return self._sample_reservoir(lines)
+
+    def _sample_sorted_positions(self, lines):
+        population = range(min(self.header_lines, self.total), self.total)
+        if self.sample_size >= len(population):
+            selection = population
+        else:
+            selection = sorted(self.random.sample(population, self.sample_size))
+        if len(selection) == 0:
+            return
+
+        cursor = 0
+        next_position = selection[cursor]
+        for position, line in enumerate(lines):
+            if position != next_position:
+                continue
+            yield position, line
+            cursor += 1
+            if cursor == len(selection):
+                break
+            next_position = selection[cursor]
+
+    def _sample_reservoir(self, lines):
+        k = self.sample_size
+        if k == 0:
+            return
+
+        reservoir = []
+        iterator = enumerate(lines)
+        for position, line in iterator:
+            if position < self.header_lines:
+                continue
+            reservoir.append((position, line))
+            if len(reservoir) == k:
+                break
+
+        if len(reservoir) == k:
+            # Algorithm L: skip directly over the lines which will not enter the reservoir
+            w = math.exp(math.log(self._uniform()) / k)
+            next_position = position + math.floor(math.log(self._uniform()) / math.log(1 - w)) + 1
+            for position, line in iterator:
+                if position < next_position:
+                    continue
+                # replace a random item of the reservoir
+                reservoir[self.random.randrange(k)] = (position, line)
+                w *= math.exp(math.log(self._uniform()) / k)
+                next_position = position + math.floor(math.log(self._uniform()) / math.log(1 - w)) + 1
+
+        # the sample is returned in file order
+        reservoir.sort(key=lambda item: item[0])
+        for position, line in reservoir:
+            yield position, line
+
+    def _uniform(self):
+        # uniform in the open interval (0, 1) to keep the logarithms defined
+        u = self.random.random()
+        while u == 0.0:
+            u = self.random.random()
+        return u
+
+def sample_lines(lines, sample_size=None, total=None, seed=None, start=0, header_lines=0):
+    """
+    Return the (position, line) pairs of the provided lines, restricted to a random sample if a sample
+    size is indicated. Without sampling, the positions start at the indicated start position (e.g. when
+    resuming the reading of a file). The header_lines first lines of the file are not part of the sample.
+    """
+    if sample_size is None:
+        return enumerate(lines, start)
+    return LineSampler(sample_size, total=total, seed=seed, header_lines=header_lines).sample(lines)
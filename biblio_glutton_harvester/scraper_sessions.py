@@ -0,0 +1,199 @@
+'''
+Pooled cloudscraper sessions for the downloads of Cloudflare protected files.
+
+Creating a new cloudscraper for every download means solving the Cloudflare challenge again (spawning
+nodejs) for every file. Here the scrapers are long-lived sessions kept per host and reused by the
+download threads, so that the challenge is solved once per host and per clearance period:
+
+- a scraper (a requests.Session) is not safe to share between threads, so it is checked out by a thread
+  for the duration of a download, with a limited number of scrapers per host,
+
+- the clearance cookies obtained by a scraper for a host, together with the User-Agent they are bound to,
+  are cached and given to the other scrapers of the host, until they expire,
+
+- the least recently used hosts are evicted when the number of hosts exceeds a maximum.
+'''
+
+import time
+import threading
+import contextlib
+from collections import OrderedDict
+
+# maximum number of hosts with pooled scrapers
+DEFAULT_MAX_HOSTS = 100
+
+# maximum number of scrapers per host, i.e. of concurrent downloads from a host with cloudscraper
+DEFAULT_SESSIONS_PER_HOST = 2
+
+# lifetime in seconds of the clearance cookies without expiry date (30 minutes by default for Cloudflare)
+DEFAULT_CLEARANCE_TTL = 1800
+
+# cookies set by Cloudflare once a challenge is passed
+CLEARANCE_COOKIES = ("cf_clearance", "__cf_bm", "__cfduid")
+
+class _Clearance(object):
+
+    def __init__(self, cookies, user_agent, expires, version):
+        self.cookies = cookies
+        self.user_agent = user_agent
+        self.expires = expires
+        self.version = version
+
+class _PooledScraper(object):
+
+    def __init__(self, scraper):
+        self.scraper = scraper
+        # version of the host clearance given to this scraper
+        self.clearance_version = 0
+        # clearance cookies of the scraper when checked out
+        self.checked_out_cookies = frozenset()
+
+class _HostScrapers(object):
+
+    def __init__(self):
+        self.idle = []
+        self.nb_scrapers = 0
+        self.clearance = None
+        self.nb_clearances = 0
+
+class ScraperPool(object):
+    """
+    Thread-safe pool of cloudscraper sessions per host, create_scraper() creating a new scraper
+    """
+
+    def __init__(self, create_scraper, max_hosts=DEFAULT_MAX_HOSTS, sessions_per_host=DEFAULT_SESSIONS_PER_HOST,
+                 clearance_ttl=DEFAULT_CLEARANCE_TTL):
+        self.create_scraper = create_scraper
+        self.max_hosts = max(max_hosts, 1)
+        self.sessions_per_host = max(sessions_per_host, 1)
+        self.clearance_ttl = clearance_ttl
+        self._cond = threading.Condition()
+        # hosts by order of last use
+        self._hosts = OrderedDict()
+        self.nb_downloads = 0
+        self.nb_cleared_downloads = 0
+        self.nb_clearances = 0
+
+    @classmethod
+    def from_config(cls, config, create_scraper):
+        """
+        Create the scraper pool from the optional cloudflare_sessions section of the configuration
+        """
+        max_hosts = DEFAULT_MAX_HOSTS
+        sessions_per_host = DEFAULT_SESSIONS_PER_HOST
+        clearance_ttl = DEFAULT_CLEARANCE_TTL
+        if "cloudflare_sessions" in config and config["cloudflare_sessions"]:
+            sessions_config = config["cloudflare_sessions"]
+            if "max_hosts" in sessions_config and sessions_config["max_hosts"]:
+                max_hosts = sessions_config["max_hosts"]
+            if "sessions_per_host" in sessions_config and sessions_config["sessions_per_host"]:
+                sessions_per_host = sessions_config["sessions_per_host"]
+            if "clearance_ttl" in sessions_config and sessions_config["clearance_ttl"]:
+                clearance_ttl = sessions_config["clearance_ttl"]
+        return cls(create_scraper, max_hosts=max_hosts, sessions_per_host=sessions_per_host, clearance_ttl=clearance_ttl)
+
+    @contextlib.contextmanager
+    def session(self, host):
+        """
+        Check out a scraper for downloading from the host, waiting if all the scrapers of the host are in use
+        """
+        pooled = self._checkout(host)
+        try:
+            yield pooled.scraper
+        finally:
+            self._checkin(host, pooled)
+
+    def _checkout(self, host):
+        with self._cond:
+            host_scrapers = self._hosts.get(host)
+            if host_scrapers == None:
+                host_scrapers = _HostScrapers()
+                self._hosts[host] = host_scrapers
+            self._hosts.move_to_end(host)
+            while len(host_scrapers.idle) == 0 and host_scrapers.nb_scrapers >= self.sessions_per_host:
+                self._cond.wait()
+            if len(host_scrapers.idle) > 0:
+                pooled = host_scrapers.idle.pop()
+            else:
+                pooled = None
+                host_scrapers.nb_scrapers += 1
+            clearance = host_scrapers.clearance
+            if clearance != None and clearance.expires < time.time():
+                # expired, the next challenge will be solved again
+                host_scrapers.clearance = None
+                clearance = None
+            self.nb_downloads += 1
+            if clearance != None:
+                self.nb_cleared_downloads += 1
+            self._evict()
+
+        if pooled == None:
+            try:
+                pooled = _PooledScraper(self.create_scraper())
+            except Exception:
+                with self._cond:
+                    host_scrapers.nb_scrapers -= 1
+                    self._cond.notify_all()
+                raise
+        if clearance == None:
+            if pooled.clearance_version != 0:
+                self._clear_cookies(pooled.scraper)
+                pooled.clearance_version = 0
+        elif pooled.clearance_version != clearance.version:
+            # clearance obtained by another scraper of the host
+            for cookie in clearance.cookies:
+                pooled.scraper.cookies.set_cookie(cookie)
+            pooled.scraper.headers["User-Agent"] = clearance.user_agent
+            pooled.clearance_version = clearance.version
+        pooled.checked_out_cookies = self._cookie_values(self._clearance_cookies(pooled.scraper))
+        return pooled
+
+    def _checkin(self, host, pooled):
+        cookies = self._clearance_cookies(pooled.scraper)
+        with self._cond:
+            host_scrapers = self._hosts.get(host)
+            if host_scrapers == None:
+                # host evicted meanwhile
+                pooled.scraper.close()
+                return
+            if len(cookies) > 0 and self._cookie_values(cookies) != pooled.checked_out_cookies:
+                # new clearance obtained by this scraper during the download
+                expires = time.time() + self.clearance_ttl
+                for cookie in cookies:
+                    if cookie.expires != None:
+                        expires = min(expires, cookie.expires)
+                host_scrapers.nb_clearances += 1
+                self.nb_clearances += 1
+                host_scrapers.clearance = _Clearance(cookies, pooled.scraper.headers.get("User-Agent"), expires, host_scrapers.nb_clearances)
+                pooled.clearance_version = host_scrapers.nb_clearances
+            host_scrapers.idle.append(pooled)
+            self._cond.notify_all()
+
+    def _clearance_cookies(self, scraper):
+        return [cookie for cookie in scraper.cookies if cookie.name in CLEARANCE_COOKIES]
+
+    def _cookie_values(self, cookies):
+        return frozenset((cookie.name, cookie.value) for cookie in cookies)
+
+    def _clear_cookies(self, scraper):
+        for cookie in self._clearance_cookies(scraper):
+            scraper.cookies.clear(cookie.domain, cookie.path, cookie.name)
+
+    def _evict(self):
+        # the least recently used hosts without scraper in use are evicted
+        for host in list(self._hosts.keys()):
+            if len(self._hosts) <= self.max_hosts:
+                break
+            host_scrapers = self._hosts[host]
+            if len(host_scrapers.idle) < host_scrapers.nb_scrapers:
+                continue
+            for pooled in host_scrapers.idle:
+                pooled.scraper.close()
+            del self._hosts[host]
+
+    def report(self):
+        with self._cond:
+            if self.nb_downloads == 0:
+                return
+            print("cloudscraper downloads:", self.nb_downloads, "- with a cached clearance:", self.nb_cleared_downloads,
+                "- clearances obtained:", self.nb_clearances, "- hosts:", len(self._hosts))
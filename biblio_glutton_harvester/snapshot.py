@@ -0,0 +1,321 @@
+'''
+Single pass reader for the large harvesting input files (gzipped Unpaywall JSONL snapshot, PMC file list).
+
+The previous approach was to decompress the whole snapshot a first time just for counting the lines
+(for the progress bar), then a second time for the actual processing. With a 130M lines Unpaywall dump,
+this first pass was taking a significant part of the harvesting time before any download could start.
+
+Here the file is read only once. The progress is reported either in lines, when a line count sidecar
+file is available from a previous complete pass over the same file, or otherwise from the offset in
+the underlying (compressed) file.
+
+The reader also keeps a sparse index of seek points while reading, so that the harvesting can be
+resumed from a checkpoint. The zlib API available in Python does not allow to save the state of a
+decompressor in the middle of a gzip member, so a seek point refers to the start of the gzip member
+containing the line:
+
+- for a gzip file made of many members (e.g. re-encoded in independent blocks), resuming seeks 
+  directly to the member and only decompresses the end of this member,
+
+- for a single member gzip file (the usual Unpaywall snapshot), resuming decompresses the beginning of
+  the file again, but without any line splitting, JSON decoding or LMDB look-up,
+
+- for an uncompressed file (PMC file list), resuming is a simple seek.
+'''
+
+import os
+import io
+import json
+import zlib
+from bisect import bisect_right
+from tqdm import tqdm
+
+# logging
+import logging
+import logging.handlers
+
+# suffix of the sidecar file caching the number of lines of a snapshot file
+LINE_COUNT_SIDECAR_SUFFIX = ".count"
+
+# number of lines between two updates of the byte-based progress bar
+PROGRESS_UPDATE_LINES = 10000
+
+# number of lines between two seek points of the index built while reading
+SEEK_POINT_INTERVAL = 100000
+
+# size of the raw reads and of the decompressed line buffer
+READ_BUFFER_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+class SnapshotReader(object):
+    """
+    Iterate over the lines (as bytes) of a possibly gzipped snapshot file with a single decompression
+    pass, reporting progress with tqdm.
+
+    When the file is completely read, the number of lines is cached in a sidecar file (same path with
+    suffix .count), so that next runs on the same snapshot can display a progress in lines and
+    know the number of entries without any extra pass.
+
+    If a resume point (as returned by checkpoint()) is given, the iteration starts at the line of this
+    resume point, the first line yielded having the position start_line.
+    """
+
+    def __init__(self, filepath, show_progress=True, write_line_count=True, resume_point=None):
+        self.filepath = filepath
+        self.show_progress = show_progress
+        self.write_line_count = write_line_count
+        self.resume_point = resume_point
+
+        self.file_size = os.path.getsize(filepath)
+        self.compressed = _is_gzip_file(filepath)
+
+        # number of lines of the file, if known from a sidecar file
+        self.line_count = read_line_count(filepath)
+
+        # position of the first line which will be yielded
+        self.start_line = 0
+        if resume_point is not None:
+            self.start_line = resume_point["line"]
+
+        # number of lines read so far during the current pass
+        self.lines_read = 0
+
+        # seek points recorded during the current pass, as (line, offset, member offset, member uncompressed offset),
+        # offset being the uncompressed offset of the line start and member offset the offset in the file
+        # of the gzip member containing the line
+        self.seek_points = []
+        self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __iter__(self):
+        point = None
+        if self.resume_point is not None:
+            point = self.resume_point["seek_point"]
+
+        with open(self.filepath, 'rb') as raw:
+            if self.compressed:
+                if point is not None:
+                    self._stream = _GzipMemberStream(raw, start_offset=point[2], start_uncompressed_offset=point[3])
+                else:
+                    self._stream = _GzipMemberStream(raw)
+                stream = io.BufferedReader(self._stream, buffer_size=READ_BUFFER_SIZE)
+            else:
+                self._stream = None
+                stream = raw
+
+            # position and uncompressed offset of the next line
+            line_number = 0
+            offset = 0
+            if point is not None:
+                line_number = point[0]
+                offset = point[1]
+                if self.compressed:
+                    # decompress without any line splitting up to the seek point
+                    _skip_bytes(stream, point[1] - point[3])
+                else:
+                    raw.seek(point[1])
+                # the remaining lines before the resume line are read without being yielded
+                while line_number < self.start_line:
+                    line = stream.readline()
+                    if not line:
+                        break
+                    offset += len(line)
+                    line_number += 1
+
+            if self.line_count is not None:
+                pbar = tqdm(total=self.line_count, initial=line_number, disable=not self.show_progress)
+                last_offset = 0
+            else:
+                pbar = tqdm(total=self.file_size, unit='B', unit_scale=True, disable=not self.show_progress)
+                last_offset = raw.tell()
+                pbar.update(last_offset)
+
+            try:
+                for line in stream:
+                    if line_number % SEEK_POINT_INTERVAL == 0:
+                        self._add_seek_point(line_number, offset)
+                    self.lines_read += 1
+                    if self.line_count is not None:
+                        pbar.update(1)
+                    elif self.lines_read % PROGRESS_UPDATE_LINES == 0:
+                        # progress from the position in the underlying compressed file
+                        raw_offset = raw.tell()
+                        pbar.update(raw_offset - last_offset)
+                        last_offset = raw_offset
+                    line_number += 1
+                    offset += len(line)
+                    yield line
+                if self.line_count is None:
+                    pbar.update(self.file_size - last_offset)
+            finally:
+                pbar.close()
+                if stream is not raw:
+                    stream.close()
+
+        # we have reached the end of the file, we can cache its number of lines for the next runs
+        if self.write_line_count and self.line_count is None and self.resume_point is None:
+            write_line_count(self.filepath, self.lines_read)
+            self.line_count = self.lines_read
+
+    def _add_seek_point(self, line_number, offset):
+        if self._stream is None:
+            self.seek_points.append((line_number, offset, offset, offset))
+        else:
+            member_offset, member_uncompressed_offset = self._stream.member_for(offset)
+            self.seek_points.append((line_number, offset, member_offset, member_uncompressed_offset))
+
+    def checkpoint(self, line):
+        """
+        Return a resume point for restarting the reading at the given line position, None if no seek point
+        is available before this line. The resume point is a dict which can be serialized and passed to a 
+        new reader.
+        """
+        index = bisect_right(self.seek_points, (line, float('inf'))) - 1
+        if index < 0:
+            if self.resume_point is not None and self.resume_point["line"] <= line:
+                # nothing indexed since the resumed position, the previous seek point is still valid
+                return {"line": line, "seek_point": self.resume_point["seek_point"]}
+            return None
+        return {"line": line, "seek_point": tuple(self.seek_points[index])}
+
+class _GzipMemberStream(io.RawIOBase):
+    """
+    Raw stream decompressing a gzip file (possibly made of several members), keeping track of the offsets
+    of the members (compressed offset in the file, uncompressed offset in the decompressed stream)
+    """
+
+    def __init__(self, raw, start_offset=0, start_uncompressed_offset=0):
+        self.raw = raw
+        self.raw.seek(start_offset)
+        self.decompressor = zlib.decompressobj(wbits=31)
+        self.compressed_offset = start_offset
+        self.uncompressed_offset = start_uncompressed_offset
+        self.members_compressed = [start_offset]
+        self.members_uncompressed = [start_uncompressed_offset]
+        self.pending = b''
+        self.pending_start = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.pending_start >= len(self.pending) and not self.eof:
+            self._fill()
+        size = min(len(buffer), len(self.pending) - self.pending_start)
+        buffer[:size] = self.pending[self.pending_start:self.pending_start+size]
+        self.pending_start += size
+        return size
+
+    def _fill(self):
+        if self.decompressor.eof:
+            # end of the current gzip member, the following data (if any) is a new member
+            data = self.decompressor.unused_data
+            if len(data) == 0:
+                data = self.raw.read(READ_BUFFER_SIZE)
+                self.compressed_offset += len(data)
+            if len(data.strip(b'\x00')) == 0:
+                # end of file, possibly with a trailing zero padding
+                self.eof = True
+                return
+            self.members_compressed.append(self.compressed_offset - len(data))
+            self.members_uncompressed.append(self.uncompressed_offset)
+            self.decompressor = zlib.decompressobj(wbits=31)
+        else:
+            data = self.decompressor.unconsumed_tail
+            if len(data) == 0:
+                data = self.raw.read(READ_BUFFER_SIZE)
+                if len(data) == 0:
+                    logging.error("truncated gzip file: " + str(self.raw.name))
+                    self.eof = True
+                    return
+                self.compressed_offset += len(data)
+        self.pending = self.decompressor.decompress(data, READ_BUFFER_SIZE * 4)
+        self.pending_start = 0
+        self.uncompressed_offset += len(self.pending)
+
+    def member_for(self, uncompressed_offset):
+        """
+        Return the compressed and uncompressed start offsets of the member containing the given
+        uncompressed offset
+        """
+        index = bisect_right(self.members_uncompressed, uncompressed_offset) - 1
+        return self.members_compressed[index], self.members_uncompressed[index]
+
+def _skip_bytes(stream, nb_bytes):
+    while nb_bytes > 0:
+        buffer = stream.read(min(nb_bytes, READ_BUFFER_SIZE * 8))
+        if not buffer:
+            break
+        nb_bytes -= len(buffer)
+
+def read_line_count(filepath):
+    """
+    Return the number of lines of the file as cached in its sidecar file, None if there is no sidecar
+    or if the sidecar does not correspond to the current version of the file
+    """
+    sidecar_path = filepath + LINE_COUNT_SIDECAR_SUFFIX
+    if not os.path.isfile(sidecar_path):
+        return None
+    try:
+        with open(sidecar_path, 'r') as sidecar_file:
+            sidecar = json.load(sidecar_file)
+        if [sidecar["size"], sidecar["mtime"]] != file_signature(filepath):
+            logging.info("line count sidecar file outdated, ignored: " + sidecar_path)
+            return None
+        return sidecar["lines"]
+    except:
+        logging.exception("invalid line count sidecar file: " + sidecar_path)
+    return None
+
+def write_line_count(filepath, nb_lines):
+    """
+    Cache the number of lines of the file in a sidecar file, together with the size and modification
+    time of the file to detect outdated sidecar files
+    """
+    sidecar_path = filepath + LINE_COUNT_SIDECAR_SUFFIX
+    sidecar = {}
+    sidecar["lines"] = nb_lines
+    sidecar["size"], sidecar["mtime"] = file_signature(filepath)
+    try:
+        with open(sidecar_path, 'w') as sidecar_file:
+            json.dump(sidecar, sidecar_file)
+    except OSError:
+        # e.g. read-only snapshot directory, not blocking
+        logging.warning("could not write line count sidecar file: " + sidecar_path)
+
+def create_checkpoint(filepath, resume_point):
+    """
+    Checkpoint of the harvesting of a file, made of a resume point of the file (see SnapshotReader.checkpoint())
+    and of the signature of the current version of the file
+    """
+    checkpoint = {}
+    checkpoint["signature"] = file_signature(filepath)
+    checkpoint["resume_point"] = resume_point
+    return checkpoint
+
+def checkpoint_resume_point(filepath, checkpoint):
+    """
+    Return the resume point of a checkpoint of the file, None if the file has changed since the checkpoint
+    """
+    if checkpoint["signature"] != file_signature(filepath):
+        logging.warning("outdated checkpoint ignored for " + filepath)
+        return None
+    return checkpoint["resume_point"]
+
+def file_signature(filepath):
+    """
+    Size and modification time of a file, used to check that a sidecar file or a checkpoint corresponds
+    to the current version of the file
+    """
+    return [os.path.getsize(filepath), int(os.path.getmtime(filepath))]
+
+def _is_gzip_file(filepath):
+    with open(filepath, 'rb') as the_file:
+        return the_file.read(2) == GZIP_MAGIC
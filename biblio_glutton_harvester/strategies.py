@@ -0,0 +1,160 @@
+'''
+Learned ordering of the download methods per host.
+
+The download methods of a URL are tried in a fixed cascade (cloudscraper if enabled, requests - or aiohttp
+with the asyncio engine -, then the native downloader with the optional wget fallback), although for many
+hosts only one of them works, the other ones being wasted attempts and time. The outcomes of the methods
+are recorded per host, and the methods are then tried for a host by decreasing success rate, the methods
+not tried yet keeping their place in the cascade. The full cascade is still tried when the first method
+fails.
+
+The table of the hosts is persisted in a LMDB environment, so that a new harvesting run starts with the
+orderings learned by the previous ones.
+'''
+
+import pickle
+import threading
+from collections import Counter
+
+# download methods
+CLOUDSCRAPER = 'cloudscraper'
+REQUESTS = 'requests'
+NATIVE = 'native'
+
+class HostStrategies(object):
+    """
+    Outcomes of the download methods of a host
+    """
+
+    def __init__(self):
+        self.successes = Counter()
+        self.attempts = Counter()
+
+    def success_rate(self, strategy):
+        # smoothed, so that a method is not ranked on a single outcome
+        return (self.successes[strategy] + 1) / (self.attempts[strategy] + 2)
+
+    def order(self, strategies):
+        """
+        Order the methods by decreasing success rate, the methods not tried yet keeping the rate of an
+        unknown method and their place in the cascade
+        """
+        return sorted(strategies, key=lambda strategy: -self.success_rate(strategy))
+
+    def to_dict(self):
+        return {
+            "successes": dict(self.successes),
+            "attempts": dict(self.attempts)
+        }
+
+    @classmethod
+    def from_dict(cls, record):
+        host_strategies = cls()
+        host_strategies.successes.update(record["successes"])
+        host_strategies.attempts.update(record["attempts"])
+        return host_strategies
+
+class StrategyTable(object):
+    """
+    Thread-safe table of the download methods per host: order() the methods before downloading from a
+    host, record() the outcome of each tried method
+    """
+
+    def __init__(self, env=None):
+        # optional LMDB environment where the table is persisted
+        self.env = env
+        self._lock = threading.Lock()
+        self._hosts = {}
+        # hosts whose outcomes are not persisted yet
+        self._dirty = set()
+        # number of downloads whose first method succeeded, by reordered or default cascade
+        self.nb_downloads = 0
+        self.nb_reordered = 0
+        self.nb_first_successes = Counter()
+        self._load()
+
+    @classmethod
+    def from_config(cls, config, env=None):
+        """
+        Create the table from the optional download_strategies section of the configuration, None if the
+        learned ordering is disabled (enabled: false)
+        """
+        strategies_config = config["download_strategies"] if "download_strategies" in config and config["download_strategies"] else {}
+        if "enabled" in strategies_config and strategies_config["enabled"] == False:
+            return None
+        return cls(env)
+
+    def _load(self):
+        if self.env == None:
+            return
+        with self.env.begin() as txn:
+            for key, value in txn.cursor():
+                self._hosts[key.decode(encoding='UTF-8')] = HostStrategies.from_dict(pickle.loads(value))
+
+    def _save(self, hosts):
+        if self.env == None or len(hosts) == 0:
+            return
+        with self.env.begin(write=True) as txn:
+            for host in hosts:
+                txn.put(host.encode(encoding='UTF-8'), pickle.dumps(self._hosts[host].to_dict()))
+
+    def order(self, host, strategies):
+        """
+        Return the download methods to try for the host, strategies being the methods in the default
+        order of the cascade
+        """
+        with self._lock:
+            self.nb_downloads += 1
+            host_strategies = self._hosts.get(host)
+            if host_strategies == None:
+                return strategies
+            ordered = host_strategies.order(strategies)
+            if ordered != strategies:
+                self.nb_reordered += 1
+            return ordered
+
+    def record(self, host, strategy, success, first=False):
+        """
+        Record the outcome of a download method for the host, first indicating if it was the first method
+        tried for the URL
+        """
+        if host == None:
+            return
+        with self._lock:
+            host_strategies = self._hosts.get(host)
+            if host_strategies == None:
+                host_strategies = HostStrategies()
+                self._hosts[host] = host_strategies
+            host_strategies.attempts[strategy] += 1
+            if success:
+                host_strategies.successes[strategy] += 1
+                if first:
+                    self.nb_first_successes[strategy] += 1
+            self._dirty.add(host)
+
+    def flush(self):
+        """
+        Persist the outcomes of the hosts updated since the last flush
+        """
+        with self._lock:
+            self._save([host for host in self._dirty if host in self._hosts])
+            self._dirty = set()
+
+    def report(self, nb_hosts=10):
+        """
+        Print the learned table, for the nb_hosts hosts with the most attempts (all the hosts if None)
+        """
+        with self._lock:
+            hosts = [(host, host_strategies.order(list(host_strategies.attempts)), HostStrategies.from_dict(host_strategies.to_dict()))
+                for host, host_strategies in self._hosts.items()]
+            nb_downloads = self.nb_downloads
+            nb_reordered = self.nb_reordered
+            nb_first_successes = sum(self.nb_first_successes.values())
+        print("download methods learned for", len(hosts), "hosts", "- downloads with reordered methods:", nb_reordered,
+            "- successes of the first method:", nb_first_successes, "/", nb_downloads)
+        hosts.sort(key=lambda item: sum(item[2].attempts.values()), reverse=True)
+        if nb_hosts != None:
+            hosts = hosts[:nb_hosts]
+        for host, ordered, host_strategies in hosts:
+            outcomes = [strategy + " " + str(host_strategies.successes[strategy]) + "/" + str(host_strategies.attempts[strategy]) for strategy in ordered]
+            print("   ", host, "-", ", ".join(outcomes))
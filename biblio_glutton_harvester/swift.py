@@ -7,6 +7,7 @@ from swiftclient.multithreading import OutputManager
 from swiftclient.service import SwiftError, SwiftService, SwiftUploadObject
 
 from biblio_glutton_harvester.OAHarvester import _check_compression
+from biblio_glutton_harvester.governor import network_governor, UPLOAD
 
 # logging
 import logging
@@ -73,6 +74,8 @@ class Swift(object):
             
         obj = SwiftUploadObject(file_path, object_name=object_name)
         objs.append(obj)
+        # the upload bandwidth is reserved for the whole file, the Swift uploads not reporting their progress
+        network_governor.throttle(UPLOAD, os.path.getsize(file_path))
         try:
             for result in self.swift.upload(self.config["swift_container"], objs):
                 if not result['success']:
@@ -100,6 +103,8 @@ class Swift(object):
             obj = SwiftUploadObject(file_path, object_name=object_name)
             objs.append(obj)
 
+        # the upload bandwidth is reserved for the whole files, the Swift uploads not reporting their progress
+        network_governor.throttle(UPLOAD, sum(os.path.getsize(file_path) for file_path in file_paths))
         try:
             for result in self.swift.upload(self.config["swift_container"], objs):
                 if not result['success']:
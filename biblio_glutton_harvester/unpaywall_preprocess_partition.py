@@ -8,6 +8,9 @@ What is done by the script:
 - skip entries without PDF open access resource
 - distribute the entries with open access resource in n bins/files
 
+If the Unpaywall file has been re-encoded in independent gzip blocks (see gzip_blocks.py), the blocks
+are decompressed and filtered in parallel by several worker processes.
+
 '''
 
 import sys
@@ -20,16 +23,26 @@ import time
 from random import randint
 from tqdm import tqdm
 
-def create_partition(unpaywall, output=None, nb_bins=10):
+from biblio_glutton_harvester.gzip_blocks import load_block_index, map_block_ranges
+from biblio_glutton_harvester.snapshot import read_line_count
+
+def create_partition(unpaywall, output=None, nb_bins=10, nb_workers=1):
+    index = load_block_index(unpaywall)
+
     # check the overall number of entries based on the line number
-    print("\ncalculating number of entries...")
-
-    count = 0
-    with gzip.open(unpaywall, 'rb') as gz:  
-        while 1:
-            buffer = gz.read(8192*1024)
-            if not buffer: break
-            count += buffer.count(b'\n')
+    if index != None:
+        count = index.line_count
+    else:
+        count = read_line_count(unpaywall)
+    if count == None:
+        print("\ncalculating number of entries...")
+
+        count = 0
+        with gzip.open(unpaywall, 'rb') as gz:  
+            while 1:
+                buffer = gz.read(8192*1024)
+                if not buffer: break
+                count += buffer.count(b'\n')
     #count = 126388740   
     print("total of", str(count), "entries")
 
@@ -47,46 +60,70 @@ def create_partition(unpaywall, output=None, nb_bins=10):
         f = gzip.open(out_path, 'wt')
         nbins_files.append(f)
 
-    gz = gzip.open(unpaywall, 'rt')
-    position = 0
     current_bin = 0
-    for line in tqdm(gz, total=count):
-        entry = json.loads(line)
-
-        if 'best_oa_location' in entry:
-            if entry['best_oa_location'] is not None:
-                if 'url_for_pdf' in entry['best_oa_location']:
-                    pdf_url = entry['best_oa_location']['url_for_pdf']
-                    if pdf_url is not None:
-                        # add the line in the selected bin
-                        nbins_files[current_bin].write(line)
+    if nb_workers > 1 and index != None and index.is_parallelizable():
+        # the blocks are decompressed and filtered by the workers, the selected lines are distributed in
+        # the bins in the file order, so the result is the same as with a sequential processing
+        for lines in map_block_ranges(unpaywall, index, _select_oa_lines, nb_workers):
+            for line in lines:
+                # add the line in the selected bin
+                nbins_files[current_bin].write(line.decode("utf-8"))
+
+                current_bin += 1
+                if current_bin == nb_bins:
+                    current_bin = 0
+
+                nb_oa_entries += 1
+    else:
+        gz = gzip.open(unpaywall, 'rt')
+        for line in tqdm(gz, total=count):
+            if _has_pdf_url(line):
+                # add the line in the selected bin
+                nbins_files[current_bin].write(line)
 
-                        current_bin += 1
-                        if current_bin == nb_bins:
-                            current_bin = 0
+                current_bin += 1
+                if current_bin == nb_bins:
+                    current_bin = 0
 
-                        nb_oa_entries += 1
-        position += 1
+                nb_oa_entries += 1
 
-    gz.close()
+        gz.close()
 
     for n in range(nb_bins):
         nbins_files[n].close()
 
     print(str(nb_bins), " files generated, with a total of ", str(nb_oa_entries), "OA entries with PDF URL")
 
+def _has_pdf_url(line):
+    entry = json.loads(line)
+    if 'best_oa_location' in entry:
+        if entry['best_oa_location'] is not None:
+            if 'url_for_pdf' in entry['best_oa_location']:
+                pdf_url = entry['best_oa_location']['url_for_pdf']
+                if pdf_url is not None:
+                    return True
+    return False
+
+def _select_oa_lines(lines):
+    """
+    Return the raw lines of a block range with an OA PDF URL, executed in a worker process
+    """
+    return [line for position, line in lines if _has_pdf_url(line)]
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Open Access PDF harvester")
     parser.add_argument("--unpaywall", default=None, help="path to the Unpaywall dataset (gzipped)") 
     parser.add_argument("--output", help="where to write the pre-processed files (default along with the Unpaywall input file)") 
     parser.add_argument("--n", type=int, default="10", help="number of bins for partitioning the unpaywall entries") 
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes, used if the Unpaywall file has been re-encoded in gzip blocks") 
 
     args = parser.parse_args()
 
     unpaywall = args.unpaywall
     output = args.output
     nb_bins = args.n
+    nb_workers = args.workers
 
     if unpaywall == None:
         print("error: the path to the Unpaywall file has not been specified")
@@ -97,7 +134,7 @@ if __name__ == "__main__":
     else:
         start_time = time.time()
 
-        create_partition(unpaywall, output, nb_bins)
+        create_partition(unpaywall, output, nb_bins, nb_workers)
 
         runtime = round(time.time() - start_time, 3)
         print("runtime: %s seconds " % (runtime))
@@ -4,6 +4,9 @@ A small preprocessing script for unpaywall dump file. The goal is to produce a s
 of the full dump restricted to a selection of DOI. A set of DOI is given by a file with 
 one DOI per line. 
 
+If the Unpaywall file has been re-encoded in independent gzip blocks (see gzip_blocks.py), the blocks
+are decompressed and filtered in parallel by several worker processes.
+
 '''
 
 import sys
@@ -16,7 +19,12 @@ import time
 from random import randint
 from tqdm import tqdm
 
-def create_selection(unpaywall, dois, output=None):
+from biblio_glutton_harvester.gzip_blocks import load_block_index, map_block_ranges
+
+# selected DOI in the worker processes
+_worker_dois = None
+
+def create_selection(unpaywall, dois, output=None, nb_workers=1):
     nb_entries = 0
 
     if output == None:
@@ -33,9 +41,22 @@ def create_selection(unpaywall, dois, output=None):
                 output_file.write(json_string)
                 output_file.write("\n")
 
+        index = None
+        if nb_workers > 1:
+            index = load_block_index(unpaywall)
+        if index != None and index.is_parallelizable():
+            # the blocks are decompressed and filtered by the workers, the selected entries are written in the 
+            # file order
+            for json_strings in map_block_ranges(unpaywall, index, _select_doi_lines, nb_workers, initializer=_init_worker_dois, initargs=(dois,)):
+                for json_string in json_strings:
+                    nb_entries += 1
+                    output_file.write(json_string)
+                    output_file.write("\n")
+                if nb_entries >= len(dois):
+                    break
+            return
+
         gz = gzip.open(unpaywall, 'rt')
-        position = 0
-        current_bin = 0
         for line in tqdm(gz, total=len(dois)):
             entry = json.loads(line)
             if 'doi' in entry:
@@ -49,6 +70,22 @@ def create_selection(unpaywall, dois, output=None):
                         break
         gz.close()
 
+def _init_worker_dois(dois):
+    global _worker_dois
+    _worker_dois = dois
+
+def _select_doi_lines(lines):
+    """
+    Return the serialized entries of a block range corresponding to the selected DOI, executed in a worker process
+    """
+    result = []
+    for position, line in lines:
+        entry = json.loads(line)
+        if 'doi' in entry:
+            if entry['doi'] in _worker_dois:
+                result.append(json.dumps(entry))
+    return result
+
 def load_dois(input):
     """
     Load a list of DOI. DOI are loaded in memory in a set, which should be okay even for several ten millions
@@ -165,12 +202,14 @@ if __name__ == "__main__":
     parser.add_argument("--unpaywall", default=None, help="path to the Unpaywall dataset (gzipped)") 
     parser.add_argument("--dois", default=None, help="path to the list of DOIs to be used to create the Unpaywall subset") 
     parser.add_argument("--output", help="where to write the subset Unpaywall file, a .json.gz extension file") 
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes, used if the Unpaywall file has been re-encoded in gzip blocks") 
 
     args = parser.parse_args()
 
     unpaywall = args.unpaywall
     output = args.output
     dois_path = args.dois
+    nb_workers = args.workers
 
     if unpaywall == None:
         print("error: the path to the Unpaywall file has not been specified")
@@ -187,7 +226,7 @@ if __name__ == "__main__":
 
         dois = load_dois(dois_path)
         if len(dois)>0:
-            create_selection(unpaywall, dois, output)
+            create_selection(unpaywall, dois, output, nb_workers)
 
         runtime = round(time.time() - start_time, 3)
         print("runtime: %s seconds " % (runtime))
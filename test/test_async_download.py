@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+import http.server
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+pytest.importorskip("aiohttp")
+
+from biblio_glutton_harvester.async_download import AsyncDownloadEngine
+from biblio_glutton_harvester.politeness import PolitenessScheduler, HostLimits, url_host
+from biblio_glutton_harvester.download_stream import expected_kinds, STREAM_SUCCESS, STREAM_REJECTED, STREAM_TOO_LARGE
+
+PDF = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF\n" + b"x" * 100000
+LANDING_PAGE = b"<!DOCTYPE html><html><body>" + b"landing page " * 1000 + b"</body></html>"
+
+MAX_SIZE = 50000
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        kind = self.path.split("/")[1]
+        if kind == "missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = LANDING_PAGE if kind == "page" else PDF
+        self.send_response(200)
+        if kind == "unsized":
+            # no content length, the size is only known while streaming
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:" + str(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def _run(urls, max_size=None):
+    """
+    Download the URLs with the engine, return the result of each download by position
+    """
+    async def download(engine, url, filename, entry):
+        status, kind, head = await engine.stream(url, filename, accepted=expected_kinds(filename), max_size=max_size)
+        return status, entry
+
+    engine = AsyncDownloadEngine(download, concurrency=4, blocking_workers=2)
+    scheduler = PolitenessScheduler(10, default_limits=HostLimits(max_concurrent=2))
+    results = {}
+    failures = []
+
+    def deliver(position, result):
+        results[position] = result
+
+    def fail(stage, position):
+        failures.append((stage, position))
+
+    threads = engine.start(scheduler, deliver, fail)
+    for position, (url, filename) in enumerate(urls):
+        scheduler.put(url_host(url), (position, url, filename, {"position": position}))
+    scheduler.close()
+    for thread in threads:
+        thread.join(30)
+        assert not thread.is_alive()
+    assert failures == []
+    assert engine.session.closed
+    assert not engine.loop.is_running()
+    return dict((position, status) for position, (status, entry) in results.items())
+
+def test_pdf_is_kept_and_landing_page_rejected(server, tmp_path):
+    pdf_file = str(tmp_path / "a.pdf")
+    page_file = str(tmp_path / "b.pdf")
+    missing_file = str(tmp_path / "c.pdf")
+    results = _run([(server + "/pdf/1", pdf_file), (server + "/page/2", page_file), (server + "/missing/3", missing_file)])
+    assert results == {0: STREAM_SUCCESS, 1: STREAM_REJECTED, 2: None}
+    with open(pdf_file, 'rb') as downloaded:
+        assert downloaded.read() == PDF
+    assert not os.path.exists(page_file)
+    assert not os.path.exists(missing_file)
+
+def test_oversized_response_is_aborted(server, tmp_path):
+    sized_file = str(tmp_path / "a.pdf")
+    unsized_file = str(tmp_path / "b.pdf")
+    results = _run([(server + "/pdf/1", sized_file), (server + "/unsized/2", unsized_file)], max_size=MAX_SIZE)
+    assert results == {0: STREAM_TOO_LARGE, 1: STREAM_TOO_LARGE}
+    assert not os.path.exists(sized_file)
+    assert not os.path.exists(unsized_file)
+
+def test_engine_shuts_down_without_tasks():
+    assert _run([]) == {}
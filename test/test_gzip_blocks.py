@@ -0,0 +1,129 @@
+import os
+import sys
+import gzip
+import json
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.gzip_blocks import build_block_index, reencode_blocks, load_block_index, map_block_ranges
+from biblio_glutton_harvester.unpaywall_preprocess_partition import create_partition
+from biblio_glutton_harvester.unpaywall_preprocess_selection import create_selection
+
+TEST_SNAPSHOT = os.path.join(os.path.dirname(__file__), "unpaywall_test.json.gz")
+
+def _sequential_lines(filepath, start_line=0):
+    with gzip.open(filepath, 'rb') as snapshot:
+        return [(position, line) for position, line in enumerate(snapshot) if position >= start_line]
+
+def _collect_lines(lines):
+    # executed in the worker processes
+    return list(lines)
+
+def _parallel_lines(filepath, index, start_line=0, range_lines=1):
+    result = []
+    for lines in map_block_ranges(filepath, index, _collect_lines, 3, start_line=start_line, range_lines=range_lines, show_progress=False):
+        result.extend(lines)
+    return result
+
+@pytest.fixture
+def reencoded(tmp_path):
+    filepath = str(tmp_path / "unpaywall_blocks.json.gz")
+    index = reencode_blocks(TEST_SNAPSHOT, filepath, block_lines=3, nb_workers=2, show_progress=False)
+    return filepath, index
+
+@pytest.fixture(params=[333, 5000])
+def cut_members(request, tmp_path):
+    """
+    Multi-member gzip file whose members are cut at arbitrary bytes, as bgzip does: lines straddle the
+    member boundaries, and some members have no line start
+    """
+    with gzip.open(TEST_SNAPSHOT, 'rb') as snapshot:
+        content = snapshot.read()
+    filepath = str(tmp_path / "unpaywall_cut.json.gz")
+    with open(filepath, 'wb') as output_file:
+        for start in range(0, len(content), request.param):
+            output_file.write(gzip.compress(content[start:start+request.param]))
+    return filepath
+
+def test_reencoded_file_is_the_same_gzip_content(reencoded):
+    filepath, index = reencoded
+    with gzip.open(TEST_SNAPSHOT, 'rb') as original, gzip.open(filepath, 'rb') as copy:
+        assert copy.read() == original.read()
+    assert index.is_parallelizable()
+    assert index.line_count == len(_sequential_lines(TEST_SNAPSHOT))
+
+def test_saved_index_is_loaded(reencoded):
+    filepath, index = reencoded
+    loaded = load_block_index(filepath)
+    assert loaded.blocks == index.blocks
+    assert loaded.line_count == index.line_count
+
+@pytest.mark.parametrize("range_lines", [1, 4, 1000])
+@pytest.mark.parametrize("start_line", [0, 1, 5, 6, 11, 12])
+def test_reencoded_blocks_read_in_parallel(reencoded, range_lines, start_line):
+    filepath, index = reencoded
+    assert _parallel_lines(filepath, index, start_line=start_line, range_lines=range_lines) == _sequential_lines(TEST_SNAPSHOT, start_line)
+
+def test_index_of_members_cut_in_lines(cut_members):
+    index = build_block_index(cut_members, show_progress=False)
+    nb_members = 0
+    with open(cut_members, 'rb') as raw:
+        data = raw.read()
+    while len(data) > 0:
+        decompressor = zlib.decompressobj(wbits=31)
+        decompressor.decompress(data)
+        data = decompressor.unused_data
+        nb_members += 1
+    # members without line start are not indexed
+    assert 1 < len(index.blocks) <= nb_members
+    # lines straddle the member boundaries
+    assert any(block[3] > block[1] for block in index.blocks)
+    lines = _sequential_lines(cut_members)
+    assert index.line_count == len(lines)
+    for block in index.blocks:
+        # the first line start of a block is the start of the line with this position
+        assert block[3] == sum(len(line) for position, line in lines[:block[2]])
+
+@pytest.mark.parametrize("range_lines", [1, 3, 1000])
+@pytest.mark.parametrize("start_line", [0, 2, 7, 11])
+def test_members_cut_in_lines_read_in_parallel(cut_members, range_lines, start_line):
+    index = build_block_index(cut_members, show_progress=False)
+    assert _parallel_lines(cut_members, index, start_line=start_line, range_lines=range_lines) == _sequential_lines(cut_members, start_line)
+
+def _read_bins(output, nb_bins):
+    result = []
+    for name in sorted(os.listdir(output)):
+        with gzip.open(os.path.join(output, name), 'rt') as bin_file:
+            result.append((name, bin_file.read()))
+    assert len(result) == nb_bins
+    return result
+
+def test_partition_parallel_is_sequential(reencoded, tmp_path):
+    filepath, index = reencoded
+    sequential_output = tmp_path / "sequential"
+    parallel_output = tmp_path / "parallel"
+    sequential_output.mkdir()
+    parallel_output.mkdir()
+    create_partition(filepath, str(sequential_output), nb_bins=3, nb_workers=1)
+    create_partition(filepath, str(parallel_output), nb_bins=3, nb_workers=3)
+    sequential_bins = _read_bins(str(sequential_output), 3)
+    assert sum(len(content) for name, content in sequential_bins) > 0
+    assert _read_bins(str(parallel_output), 3) == sequential_bins
+
+def test_selection_parallel_is_sequential(reencoded, tmp_path):
+    filepath, index = reencoded
+    lines = _sequential_lines(TEST_SNAPSHOT)
+    # DOI spread over the file, and one DOI absent from the file
+    dois = set([json.loads(line)["doi"] for position, line in lines[1::4]])
+    dois.add("10.1/absent")
+    sequential_output = str(tmp_path / "sequential.json.gz")
+    parallel_output = str(tmp_path / "parallel.json.gz")
+    create_selection(filepath, dois, sequential_output, nb_workers=1)
+    create_selection(filepath, dois, parallel_output, nb_workers=3)
+    with gzip.open(sequential_output, 'rt') as sequential, gzip.open(parallel_output, 'rt') as parallel:
+        sequential_entries = sequential.read()
+        assert len(sequential_entries.splitlines()) == len(dois) - 1
+        assert parallel.read() == sequential_entries
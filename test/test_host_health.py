@@ -0,0 +1,27 @@
+import os
+import sys
+
+import lmdb
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.host_health import HostHealthRegistry, CLOSED, OPEN
+
+def test_tripped_breaker_is_persisted_by_flush(tmp_path):
+    env = lmdb.open(str(tmp_path / "hosts"), map_size=10 * 1024 * 1024)
+    registry = HostHealthRegistry(env, window=4, failure_threshold=3, failure_rate=0.5)
+    for _ in range(3):
+        assert registry.allow("a.org")
+        registry.record("a.org", False)
+    registry.record("b.org", True, latency=2.0)
+    assert not registry.allow("a.org")
+
+    # the state changes are only persisted by flush
+    assert HostHealthRegistry(env)._hosts == {}
+    registry.flush()
+    reloaded = HostHealthRegistry(env)
+    assert reloaded._hosts["a.org"].state == OPEN
+    assert not reloaded.allow("a.org")
+    assert reloaded._hosts["b.org"].state == CLOSED
+    assert reloaded.latency("b.org") == 2.0
+    env.close()
@@ -0,0 +1,57 @@
+import os
+import sys
+import gzip
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.ingestion import UnpaywallIngestion
+from biblio_glutton_harvester.oa_policy import OALocationPolicy
+from biblio_glutton_harvester.gzip_blocks import reencode_blocks
+
+TEST_SNAPSHOT = os.path.join(os.path.dirname(__file__), "unpaywall_test.json.gz")
+
+def _lines():
+    with gzip.open(TEST_SNAPSHOT, 'rb') as snapshot:
+        return list(enumerate(snapshot))
+
+def _resolve(nb_workers, chunk_size=7):
+    with UnpaywallIngestion(OALocationPolicy(), nb_workers=nb_workers, chunk_size=chunk_size) as ingestion:
+        tasks = list(ingestion.resolve(_lines()))
+    return tasks, ingestion.prefilter
+
+def test_parallel_resolution_is_sequential_resolution():
+    sequential, sequential_prefilter = _resolve(0)
+    parallel, parallel_prefilter = _resolve(3)
+    assert len(sequential) > 0
+    assert parallel == sequential
+    assert parallel_prefilter.dropped == sequential_prefilter.dropped
+    assert parallel_prefilter.accepted == sequential_prefilter.accepted
+
+def test_tasks_keep_the_entry_and_its_selected_locations():
+    tasks, _ = _resolve(0)
+    for position, task in tasks:
+        assert set(task.keys()) == {"entry", "has_oa_locations", "from_mirror"}
+
+def test_workers_are_forked_at_start():
+    ingestion = UnpaywallIngestion(OALocationPolicy(), nb_workers=2)
+    ingestion.start()
+    try:
+        nb_processes = len(ingestion.executor._processes)
+        # threads started after the pool do not lead to new forks
+        thread = threading.Thread(target=lambda: None)
+        thread.start()
+        thread.join()
+        tasks = list(ingestion.resolve(_lines()))
+        assert len(tasks) > 0
+        assert nb_processes == 2 and len(ingestion.executor._processes) == 2
+    finally:
+        ingestion.close()
+
+def test_blocks_resolution_is_sequential_resolution(tmp_path):
+    reencoded = str(tmp_path / "snapshot_blocks.json.gz")
+    index = reencode_blocks(TEST_SNAPSHOT, reencoded, block_lines=3, show_progress=False)
+    sequential, _ = _resolve(0)
+    with UnpaywallIngestion(OALocationPolicy(), nb_workers=2) as ingestion:
+        blocks = list(ingestion.resolve_blocks(reencoded, index))
+    assert blocks == sequential
@@ -0,0 +1,134 @@
+import os
+import sys
+import random
+import threading
+import http.server
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import biblio_glutton_harvester.native_download as native_download
+from biblio_glutton_harvester.native_download import download_http
+from biblio_glutton_harvester.download_stream import expected_kinds, STREAM_SUCCESS
+
+PDF = b"%PDF-1.4\n" + bytes(random.Random(42).getrandbits(8) for _ in range(200000))
+HALF = len(PDF) // 2
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        scenario = self.path.split("/")[1]
+        requests_seen = self.server.requests.setdefault(scenario, [])
+        requests_seen.append((self.headers.get("Range"), self.headers.get("Accept-Encoding")))
+        try_number = len(requests_seen)
+        if try_number == 1 and scenario != "unavailable" and scenario != "always_unavailable":
+            # the connection is closed in the middle of the content
+            self._send(200, PDF, written=HALF, accept_ranges="none" if scenario == "no_ranges" else "bytes")
+        elif scenario in ("resume", "resume_error"):
+            self._send(206, PDF[HALF:], content_range="bytes " + str(HALF) + "-" + str(len(PDF) - 1) + "/" + str(len(PDF)))
+        elif scenario == "range_not_satisfiable" and try_number == 2:
+            self._send(416, b'')
+        elif scenario == "unavailable" and try_number == 1 or scenario == "always_unavailable":
+            self._send(503, b'')
+        else:
+            # the range is ignored
+            self._send(200, PDF)
+
+    def _send(self, status, body, written=None, content_range=None, accept_ranges="bytes"):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", accept_ranges)
+        if content_range != None:
+            self.send_header("Content-Range", content_range)
+        if written != None:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body[:written] if written != None else body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server(monkeypatch):
+    # no backoff between the tries
+    monkeypatch.setattr(native_download, "backoff_delay", lambda retry: 0)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.requests = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _get(enforce_content_length):
+    """
+    GET function for the downloads, a truncated content raising an error or not depending on enforce_content_length
+    """
+    def get(url, **kwargs):
+        response = requests.get(url, **kwargs)
+        response.raw.enforce_content_length = enforce_content_length
+        return response
+    return get
+
+def _download(server, scenario, tmp_path, enforce_content_length=False):
+    filename = str(tmp_path / (scenario + ".pdf"))
+    url = "http://127.0.0.1:" + str(server.server_address[1]) + "/" + scenario
+    failures = []
+    status, kind, head = download_http(_get(enforce_content_length), url, filename, tries=3, accepted=expected_kinds(filename),
+        on_failure=lambda status_code, exception: failures.append(status_code))
+    return filename, status, kind, failures, server.requests[scenario]
+
+def _content(filename):
+    with open(filename, 'rb') as downloaded:
+        return downloaded.read()
+
+def test_truncated_content_without_error_is_resumed(server, tmp_path):
+    filename, status, kind, failures, requests_seen = _download(server, "resume", tmp_path)
+    assert status == STREAM_SUCCESS and kind == "pdf" and failures == []
+    assert _content(filename) == PDF
+    assert [request_range for request_range, encoding in requests_seen] == [None, "bytes=" + str(HALF) + "-"]
+    # the resumed content is requested without content encoding
+    assert requests_seen[1][1] == "identity"
+
+def test_truncated_content_with_error_is_resumed(server, tmp_path):
+    filename, status, kind, failures, requests_seen = _download(server, "resume_error", tmp_path, enforce_content_length=True)
+    assert status == STREAM_SUCCESS
+    assert _content(filename) == PDF
+    assert [request_range for request_range, encoding in requests_seen] == [None, "bytes=" + str(HALF) + "-"]
+
+def test_range_not_satisfiable_restarts(server, tmp_path):
+    filename, status, kind, failures, requests_seen = _download(server, "range_not_satisfiable", tmp_path)
+    assert status == STREAM_SUCCESS
+    assert _content(filename) == PDF
+    assert [request_range for request_range, encoding in requests_seen] == [None, "bytes=" + str(HALF) + "-", None]
+
+def test_ignored_range_restarts(server, tmp_path):
+    filename, status, kind, failures, requests_seen = _download(server, "ignored_range", tmp_path)
+    assert status == STREAM_SUCCESS
+    # the full content sent with a 200 replaces the partial file
+    assert _content(filename) == PDF
+    assert [request_range for request_range, encoding in requests_seen] == [None, "bytes=" + str(HALF) + "-"]
+
+def test_truncated_content_without_ranges_restarts(server, tmp_path):
+    filename, status, kind, failures, requests_seen = _download(server, "no_ranges", tmp_path)
+    assert status == STREAM_SUCCESS
+    assert _content(filename) == PDF
+    assert [request_range for request_range, encoding in requests_seen] == [None, None]
+
+def test_transient_status_is_retried(server, tmp_path):
+    filename, status, kind, failures, requests_seen = _download(server, "unavailable", tmp_path)
+    assert status == STREAM_SUCCESS
+    assert _content(filename) == PDF
+    assert len(requests_seen) == 2
+
+def test_failed_download_leaves_no_file(server, tmp_path):
+    filename, status, kind, failures, requests_seen = _download(server, "always_unavailable", tmp_path)
+    assert status == None
+    assert failures == [503]
+    assert len(requests_seen) == 3
+    assert not os.path.exists(filename)
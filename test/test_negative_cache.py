@@ -0,0 +1,41 @@
+import os
+import sys
+
+import lmdb
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.negative_cache import NegativeCache, NOT_FOUND, SERVER_ERROR
+
+def _entries(env):
+    with env.begin() as txn:
+        return txn.stat()["entries"]
+
+def test_records_are_persisted_by_flush(tmp_path):
+    env = lmdb.open(str(tmp_path / "urls"), map_size=10 * 1024 * 1024)
+    cache = NegativeCache(env)
+    cache.record("http://a.org/1.pdf", [(NOT_FOUND, 404), (SERVER_ERROR, 503)])
+    cache.record("http://a.org/2.pdf", [(NOT_FOUND, 410)])
+    # the buffered records are visible before being persisted
+    assert _entries(env) == 0
+    record = cache.lookup("http://a.org/1.pdf")
+    assert record["failure_class"] == SERVER_ERROR and record["status"] == 503 and record["attempts"] == 1
+    assert not cache.is_fresh(record)
+    assert cache.is_fresh(cache.lookup("http://a.org/2.pdf"))
+
+    cache.flush()
+    assert _entries(env) == 2
+    reopened = NegativeCache(env)
+    assert reopened.lookup("http://a.org/2.pdf")["status"] == 410
+
+    cache.record("http://a.org/2.pdf", [(NOT_FOUND, 404)], cache.lookup("http://a.org/2.pdf"))
+    cache.discard("http://a.org/1.pdf")
+    assert cache.lookup("http://a.org/1.pdf") is None
+    assert cache.lookup("http://a.org/2.pdf")["attempts"] == 2
+    assert reopened.lookup("http://a.org/1.pdf") != None
+
+    cache.flush()
+    assert _entries(env) == 1
+    assert reopened.lookup("http://a.org/1.pdf") is None
+    assert reopened.lookup("http://a.org/2.pdf")["attempts"] == 2
+    env.close()
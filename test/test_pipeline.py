@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.pipeline import HarvestPipeline
+
+class _Harvest(object):
+    """
+    Stages of a harvesting whose downloads end when they are released by the test, and whose stages fail
+    for the entries marked with the failing stage
+    """
+
+    def __init__(self):
+        self.released = {}
+        self.downloaded = []
+        self._lock = threading.Lock()
+
+    def release(self, position):
+        self.released.setdefault(position, threading.Event()).set()
+
+    def download(self, url, filename, entry):
+        with self._lock:
+            self.downloaded.append(entry["position"])
+            released = self.released.setdefault(entry["position"], threading.Event())
+        if entry.get("fail") == "download":
+            raise Exception("download failure")
+        assert released.wait(10)
+        return "success", entry
+
+    def commit(self, result):
+        if result[1].get("fail") == "commit":
+            raise Exception("commit failure")
+        return True
+
+    def store(self, entry):
+        if entry.get("fail") == "storage":
+            raise Exception("storage failure")
+
+    def enrich(self, url, filename, entry, context):
+        if entry.get("fail") == "enrichment":
+            raise Exception("enrichment failure")
+        if context == None:
+            # nothing to download for this entry
+            return None, None
+        return context, entry["filename"]
+
+def _pipeline(harvest, enrich=False):
+    return HarvestPipeline(harvest.download, harvest.commit, harvest.store, download_workers=4, storage_workers=2,
+        queue_size=10, enrich=harvest.enrich if enrich else None, enrichment_workers=2)
+
+def _submit(pipeline, position, fail=None, url="http://a.org/"):
+    entry = {"position": position, "filename": str(position) + ".pdf"}
+    if fail != None:
+        entry["fail"] = fail
+    if pipeline.enrich != None:
+        pipeline.submit(position, None, None, entry, context=url)
+    else:
+        pipeline.submit(position, url + str(position), entry["filename"], entry)
+
+def _wait_completed(pipeline, nb_completed):
+    deadline = time.monotonic() + 10
+    while pipeline.nb_completed < nb_completed:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert pipeline.nb_completed == nb_completed
+
+def test_safe_position_with_out_of_order_completion():
+    harvest = _Harvest()
+    pipeline = _pipeline(harvest)
+    for position in (10, 11, 12, 13):
+        _submit(pipeline, position)
+    assert pipeline.safe_position(14) == 10
+
+    # the most recent entries complete first
+    harvest.release(12)
+    harvest.release(13)
+    _wait_completed(pipeline, 2)
+    assert pipeline.safe_position(14) == 10
+
+    harvest.release(10)
+    _wait_completed(pipeline, 3)
+    assert pipeline.safe_position(14) == 11
+
+    harvest.release(11)
+    _wait_completed(pipeline, 4)
+    assert pipeline.safe_position(14) == 14
+    pipeline.close()
+    assert pipeline.nb_errors == 0
+
+@pytest.mark.parametrize("stage", ["download", "commit", "storage"])
+def test_safe_position_with_failed_entries(stage):
+    harvest = _Harvest()
+    pipeline = _pipeline(harvest)
+    _submit(pipeline, 0, fail=stage)
+    _submit(pipeline, 1)
+    _submit(pipeline, 2, fail=stage)
+    harvest.release(0)
+    harvest.release(2)
+    # the failed entries are completed, they do not hold back the resume position
+    _wait_completed(pipeline, 2)
+    assert pipeline.nb_errors == 2
+    assert pipeline.safe_position(3) == 1
+
+    harvest.release(1)
+    pipeline.close()
+    assert pipeline.safe_position(3) == 3
+    assert pipeline.nb_completed == 3 and pipeline.nb_errors == 2
+
+def test_safe_position_with_entries_without_download():
+    harvest = _Harvest()
+    pipeline = _pipeline(harvest, enrich=True)
+    # no url is resolved by the enrichment for the entries 0 and 2, the enrichment of the entry 3 fails
+    _submit(pipeline, 0, url=None)
+    _submit(pipeline, 1)
+    _submit(pipeline, 2, url=None)
+    _submit(pipeline, 3, fail="enrichment")
+    _wait_completed(pipeline, 3)
+    assert pipeline.safe_position(4) == 1
+    assert pipeline.nb_errors == 1
+
+    harvest.release(1)
+    pipeline.close()
+    assert pipeline.safe_position(4) == 4
+    assert harvest.downloaded == [1]
@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.politeness import PolitenessScheduler, HostLimits
+
+def test_round_robin_over_hosts():
+    scheduler = PolitenessScheduler(10)
+    for i in range(3):
+        scheduler.put("a.org", "a" + str(i))
+    scheduler.put("b.org", "b0")
+    scheduler.close()
+    dispatched = []
+    while True:
+        scheduled = scheduler.get()
+        if scheduled == None:
+            break
+        host, task = scheduled
+        dispatched.append(task)
+        scheduler.release(host)
+    assert dispatched == ["a0", "b0", "a1", "a2"]
+
+def test_busy_host_does_not_block_other_hosts():
+    # a single download at a time from a.org, which is never released during the test
+    scheduler = PolitenessScheduler(8, default_limits=HostLimits(max_concurrent=1), host_capacity=2)
+    submitted = threading.Event()
+
+    def ingest():
+        # a run of entries from a single host longer than the look-ahead, then other hosts
+        for i in range(10):
+            scheduler.put("a.org", "a" + str(i))
+        for i in range(4):
+            scheduler.put("host" + str(i) + ".org", "other" + str(i))
+        submitted.set()
+
+    thread = threading.Thread(target=ingest, daemon=True)
+    thread.start()
+    assert submitted.wait(5)
+
+    dispatched = []
+    for _ in range(5):
+        host, task = scheduler.get()
+        dispatched.append(task)
+    assert dispatched[0] == "a0"
+    assert sorted(dispatched[1:]) == ["other0", "other1", "other2", "other3"]
+
+def test_parked_tasks_are_dispatched_in_order():
+    scheduler = PolitenessScheduler(4, host_capacity=1)
+    for i in range(4):
+        scheduler.put("a.org", i)
+    scheduler.close()
+    dispatched = []
+    while True:
+        scheduled = scheduler.get()
+        if scheduled == None:
+            break
+        host, task = scheduled
+        dispatched.append(task)
+        scheduler.release(host)
+    assert dispatched == [0, 1, 2, 3]
+
+def test_acquired_slots_are_within_the_host_limits():
+    scheduler = PolitenessScheduler(10, default_limits=HostLimits(max_concurrent=2))
+    scheduler.put("a.org", "a0")
+    host, task = scheduler.get()
+    # a download started outside of the scheduler takes the second slot of the host
+    assert scheduler.acquire("a.org", timeout=0)
+    assert not scheduler.acquire("a.org", timeout=0.05)
+    assert scheduler.acquire("b.org", timeout=0)
+
+    # the dispatched tasks wait for the release of a slot
+    scheduler.put("a.org", "a1")
+    released = threading.Timer(0.1, scheduler.release, args=("a.org",))
+    released.start()
+    assert scheduler.get() == ("a.org", "a1")
+    released.join()
+
+    # a slot waited for is taken at the release
+    waiting = threading.Timer(0.1, scheduler.release, args=("a.org",))
+    waiting.start()
+    assert scheduler.acquire("a.org", timeout=5)
+    waiting.join()
+
+def test_acquired_slots_are_within_the_request_rate():
+    scheduler = PolitenessScheduler(10, default_limits=HostLimits(requests_per_second=20, burst=1))
+    assert scheduler.acquire("a.org", timeout=0)
+    scheduler.release("a.org")
+    assert not scheduler.acquire("a.org", timeout=0)
+    assert scheduler.acquire("a.org", timeout=1)
+    scheduler.release("a.org")
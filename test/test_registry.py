@@ -0,0 +1,46 @@
+import os
+import sys
+import pickle
+
+import lmdb
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.registry import IdentifierRegistry
+
+@pytest.fixture
+def registry(tmp_path):
+    env_doi = lmdb.open(str(tmp_path / "doi"), map_size=1024 * 1024 * 16)
+    env_entries = lmdb.open(str(tmp_path / "entries"), map_size=1024 * 1024 * 16)
+    yield IdentifierRegistry(env_doi, env_entries)
+    env_doi.close()
+    env_entries.close()
+
+def _commit(registry, local_uuid, resources):
+    with registry.env_entries.begin(write=True) as txn:
+        txn.put(local_uuid.encode(encoding='UTF-8'), pickle.dumps({"id": local_uuid, "resources": resources}))
+
+def test_new_entries_are_registered(registry):
+    entries = [{"doi": "10.1/a"}, {"doi": "10.1/b"}, {"doi": "10.1/a"}]
+    assert registry.register_entries(entries) == [True, True, False]
+    assert registry.lookup(["10.1/a", "10.1/b"]) == {"10.1/a": entries[0]["id"], "10.1/b": entries[1]["id"]}
+
+def test_uncommitted_entries_are_harvested_again(registry):
+    first = [{"doi": "10.1/a"}, {"doi": "10.1/b"}]
+    registry.register_entries(first)
+    # only the first entry has been committed before the interruption
+    _commit(registry, first[0]["id"], [])
+
+    resumed = [{"doi": "10.1/a"}, {"doi": "10.1/b"}, {"doi": "10.1/b"}]
+    assert registry.register_entries(resumed) == [False, True, False]
+    assert resumed[1]["id"] == first[1]["id"]
+
+def test_reprocess_entries_without_pdf(registry):
+    first = [{"doi": "10.1/a"}, {"doi": "10.1/b"}]
+    registry.register_entries(first)
+    _commit(registry, first[0]["id"], ["pdf"])
+    _commit(registry, first[1]["id"], [])
+
+    assert registry.register_entries([{"doi": "10.1/a"}, {"doi": "10.1/b"}]) == [False, False]
+    assert registry.register_entries([{"doi": "10.1/a"}, {"doi": "10.1/b"}], reprocess=True) == [False, True]
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biblio_glutton_harvester.sampling import sample_lines
+
+LINES = ["line " + str(i) for i in range(50)]
+
+@pytest.mark.parametrize("total", [len(LINES), None])
+def test_sample_size_and_order(total):
+    for seed in range(20):
+        sample = list(sample_lines(iter(LINES), 10, total=total, seed=seed))
+        assert len(sample) == 10
+        positions = [position for position, line in sample]
+        assert positions == sorted(set(positions))
+        assert all(LINES[position] == line for position, line in sample)
+
+@pytest.mark.parametrize("total", [len(LINES), None])
+def test_sample_is_reproducible(total):
+    assert list(sample_lines(iter(LINES), 7, total=total, seed=3)) == list(sample_lines(iter(LINES), 7, total=total, seed=3))
+
+@pytest.mark.parametrize("total", [len(LINES), None])
+def test_header_lines_are_not_sampled(total):
+    for seed in range(50):
+        sample = list(sample_lines(iter(LINES), 5, total=total, seed=seed, header_lines=1))
+        assert len(sample) == 5
+        assert all(position >= 1 for position, line in sample)
+    # a sample larger than the file gives all the lines but the header
+    assert [position for position, line in sample_lines(iter(LINES), 100, total=total, header_lines=1)] == list(range(1, len(LINES)))
+
+def test_without_sampling_positions_start_at_the_start_line():
+    assert list(sample_lines(iter(LINES[5:]), None, start=5)) == list(enumerate(LINES))[5:]
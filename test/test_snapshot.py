@@ -0,0 +1,101 @@
+import os
+import sys
+import gzip
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import biblio_glutton_harvester.snapshot as snapshot
+from biblio_glutton_harvester.snapshot import SnapshotReader, create_checkpoint, checkpoint_resume_point
+
+NB_LINES = 95
+
+def _lines():
+    return [('{"doi": "10.1/' + str(i) + '", "title": "' + "t" * (i % 7) + '"}\n').encode('UTF-8') for i in range(NB_LINES)]
+
+@pytest.fixture(params=["multi_member", "single_member", "uncompressed"])
+def snapshot_file(request, tmp_path, monkeypatch):
+    # small seek point interval, so that the test file has several seek points
+    monkeypatch.setattr(snapshot, "SEEK_POINT_INTERVAL", 10)
+    lines = _lines()
+    filepath = str(tmp_path / "snapshot.jsonl")
+    if request.param == "multi_member":
+        filepath += ".gz"
+        with open(filepath, 'wb') as snapshot_file:
+            for i in range(0, len(lines), 8):
+                snapshot_file.write(gzip.compress(b''.join(lines[i:i+8])))
+    elif request.param == "single_member":
+        filepath += ".gz"
+        with open(filepath, 'wb') as snapshot_file:
+            snapshot_file.write(gzip.compress(b''.join(lines)))
+    else:
+        with open(filepath, 'wb') as snapshot_file:
+            snapshot_file.write(b''.join(lines))
+    return filepath
+
+def _read(filepath, resume_point=None, stop=None):
+    """
+    Read the (position, line) pairs of the snapshot, up to the position stop if indicated
+    """
+    reader = SnapshotReader(filepath, show_progress=False, write_line_count=False, resume_point=resume_point)
+    result = []
+    for position, line in enumerate(reader, start=reader.start_line):
+        result.append((position, line))
+        if stop is not None and position == stop:
+            break
+    return reader, result
+
+def test_full_read(snapshot_file):
+    reader, result = _read(snapshot_file)
+    assert result == list(enumerate(_lines()))
+    assert len(reader.seek_points) == 10
+
+def test_resume_from_checkpoint(snapshot_file):
+    _, full = _read(snapshot_file)
+    reader, _ = _read(snapshot_file, stop=63)
+    for line in [0, 9, 10, 37, 57, 60]:
+        resume_point = reader.checkpoint(line)
+        resumed_reader, resumed = _read(snapshot_file, resume_point=resume_point)
+        assert resumed_reader.start_line == line
+        assert resumed == full[line:]
+
+def test_checkpoint_of_a_resumed_reading(snapshot_file):
+    _, full = _read(snapshot_file)
+    reader, _ = _read(snapshot_file, stop=63)
+    # no seek point is recorded between the resumed line and the checkpoint
+    resumed_reader, _ = _read(snapshot_file, resume_point=reader.checkpoint(57), stop=58)
+    resumed_reader, resumed = _read(snapshot_file, resume_point=resumed_reader.checkpoint(58))
+    assert resumed == full[58:]
+
+def test_multi_member_checkpoint_seeks_to_the_member(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SEEK_POINT_INTERVAL", 10)
+    filepath = str(tmp_path / "snapshot.jsonl.gz")
+    lines = _lines()
+    with open(filepath, 'wb') as snapshot_file:
+        for i in range(0, len(lines), 8):
+            snapshot_file.write(gzip.compress(b''.join(lines[i:i+8])))
+    reader, _ = _read(filepath)
+    line, offset, member_offset, member_uncompressed_offset = reader.checkpoint(50)["seek_point"]
+    # line 50 is a seek point, in the member starting at line 48
+    assert line == 50
+    assert member_offset > 0
+    assert member_uncompressed_offset == len(b''.join(lines[:48]))
+    assert offset == len(b''.join(lines[:50]))
+
+def test_checkpoint_invalidated_by_a_changed_file(snapshot_file):
+    reader, _ = _read(snapshot_file, stop=40)
+    checkpoint = create_checkpoint(snapshot_file, reader.checkpoint(40))
+    assert checkpoint_resume_point(snapshot_file, checkpoint) == reader.checkpoint(40)
+
+    # same size, different modification time
+    stat = os.stat(snapshot_file)
+    os.utime(snapshot_file, (stat.st_atime, stat.st_mtime + 10))
+    assert checkpoint_resume_point(snapshot_file, checkpoint) is None
+
+    # different size
+    checkpoint = create_checkpoint(snapshot_file, reader.checkpoint(40))
+    with open(snapshot_file, 'ab') as snapshot_file_append:
+        snapshot_file_append.write(b'\n')
+    os.utime(snapshot_file, (stat.st_atime, stat.st_mtime + 10))
+    assert checkpoint_resume_point(snapshot_file, checkpoint) is None